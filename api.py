@@ -1,20 +1,45 @@
-from fastapi import FastAPI, HTTPException, Depends, status,Header
+from fastapi import FastAPI, HTTPException, Depends, status,Header, Request, BackgroundTasks
+from fastapi.responses import Response, FileResponse
 from pydantic import BaseModel, condecimal
 from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from passlib.context import CryptContext
 from typing import List, Optional
 from decimal import Decimal
 from datetime import datetime, timedelta
 from enum import Enum
-from main import users_collection, stores_collection, items_collection, recipes_collection, grocery_lists_collection
-from openai_grocerylist import generate_grocery_list 
+import os
+import hmac
+import logging
+from main import db, users_collection, stores_collection, items_collection, recipes_collection, grocery_lists_collection
+from openai_grocerylist import generate_grocery_list, index_manager
 from openai_json_recipe import generate_recipe, save_recipe_to_db
-from openai_recipe_grocery_list import generate_grocery_list_from_recipe
+from llm_client import LLMUnavailable
+from openai_recipe_grocery_list import generate_grocery_list_from_recipe, ingredient_table, recipe_index
+from ingredient_candidates import INGREDIENT_TABLE
+from bulk_grocery_list import generate_grocery_lists_bulk
+from meal_plan import generate_meal_plan, MAX_MEAL_PLAN_RECIPES
+from indexes import ensure_indexes
+from db import close_client, pool_stats
+import time
+from metrics import stage, start_trace, end_trace, server_timing_header, render_latest, REQUEST_DURATION, SERVER_TIMING
+from grocery_list_updates import apply_item_operations, GroceryListUpdateError
+from deadline import deadline, request_budget
+from responses import ORJSONResponse, CompressionMiddleware, json_response
+import profiling
+from logging_setup import start_request_logging, end_request_logging
+from pagination import (
+    clamp_limit, build_projection, present, fetch_page, wants_ndjson, ndjson_response,
+    compute_etag, etag_matches, next_page_headers,
+)
 import jwt
 from jwt.exceptions import PyJWTError
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+logger = logging.getLogger(__name__)
 
 SECRET_KEY = "2@1&]."  
 ALGORITHM = "HS256" 
@@ -26,10 +51,130 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://chop-n-shop-frontend-3-534070775559.us-central1.run.app", "http://localhost:3000", "http://localhost:3001"], 
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
 
+# brotli/gzip compression of large JSON, NDJSON and text bodies, as the client accepts
+app.add_middleware(CompressionMiddleware)
+
+# Time every request, and attach the per-stage timings of sampled requests as a Server-Timing header
+# when SERVER_TIMING is on
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    trace, token = start_trace()
+    log_token = start_request_logging(request.url.path)
+    try:
+        response = await call_next(request)
+    finally:
+        end_request_logging(log_token)
+        end_trace(token)
+    elapsed = time.perf_counter() - started
+
+    route = request.scope.get("route")
+    REQUEST_DURATION.observe(elapsed, request.method, route.path if route else "unmatched", str(response.status_code))
+    if trace is not None and SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing_header(trace, elapsed)
+    return response
+
+# Per-request profiling (signed X-Profile header or admin arming); not installed at all unless configured
+if profiling.profiling_enabled():
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+# Prometheus metrics: request and stage latency histograms plus the MongoDB pool gauges
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=render_latest(), media_type="text/plain; version=0.0.4")
+
+# Load the FAISS index (and build its BM25 index) before serving, so a missing or broken index fails the
+# start-up loudly and the first search does not scan the catalog
+@app.on_event("startup")
+async def load_search_index():
+    index_manager.active
+
+# Create the MongoDB indexes when the API starts (opt-in, the CLI in indexes.py does the same)
+@app.on_event("startup")
+async def create_indexes_on_startup():
+    if os.getenv("ENSURE_INDEXES_ON_STARTUP", "false").lower() not in ("1", "true", "yes"):
+        return
+    try:
+        ensure_indexes(db)
+    except Exception as e:
+        logger.error("Error creating MongoDB indexes: %s", e)
+
+# Build the recipe ingredient candidate table in the background as soon as the API starts
+@app.on_event("startup")
+async def start_ingredient_table():
+    if INGREDIENT_TABLE:
+        ingredient_table.start()
+
+# Build the recipe vector index and keep it in sync (RECIPE_INDEX_SYNC_SECONDS=0 turns this off)
+@app.on_event("startup")
+async def start_recipe_index():
+    recipe_index.start()
+
+# Reload the FAISS index when its files are replaced (INDEX_WATCH_SECONDS=0 turns this off)
+@app.on_event("startup")
+async def start_index_watcher():
+    index_manager.start_watching()
+
+@app.on_event("shutdown")
+async def close_mongo_client():
+    close_client()
+
+# Connection pool statistics for the shared MongoClient
+@app.get("/metrics/mongo")
+async def get_mongo_pool_metrics():
+    return pool_stats()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not profiling.ADMIN_TOKEN or not hmac.compare_digest((x_admin_token or "").encode(), profiling.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token missing or invalid")
+
+class ProfilingArmRequest(BaseModel):
+    count: int = 1
+    path_prefix: str = "/"
+    mode: str = "sampling"
+
+# Profile the next `count` requests under `path_prefix`
+@app.post("/admin/profiling/arm", dependencies=[Depends(require_admin)])
+async def arm_profiling(arm_request: ProfilingArmRequest):
+    if not profiling.profiling_enabled():
+        raise HTTPException(status_code=404, detail="Profiling is not enabled")
+    if arm_request.mode not in profiling.PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(profiling.PROFILE_MODES)}")
+    if arm_request.count < 0:
+        raise HTTPException(status_code=400, detail="count cannot be negative")
+    profiling.armed.arm(arm_request.count, arm_request.path_prefix, arm_request.mode)
+    return profiling.armed.status()
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    return {"profiles": profiling.list_profiles(), "armed": profiling.armed.status()}
+
+# Collapsed stacks, ready for flamegraph.pl or speedscope
+@app.get("/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def get_profile(name: str):
+    path = profiling.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
+
+# Active FAISS index version, versions still draining, and the last reload outcome
+@app.get("/admin/index", dependencies=[Depends(require_admin)])
+async def get_index_status():
+    return index_manager.status()
+
+# Load the index files into a new version and swap it in; searches keep running meanwhile
+@app.post("/admin/index/reload", dependencies=[Depends(require_admin)])
+async def reload_index(force: bool = False):
+    try:
+        swapped = await run_in_threadpool(index_manager.reload, force)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Index reload failed, keeping the current version: {e}")
+    return {"swapped": swapped, **index_manager.status()}
+
 # Cryptography (for hashing passwords)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -72,6 +217,18 @@ class UserPreferences(BaseModel):
     Allergies: List[str]
     Store_preference: Optional[str] = None
 
+class BulkGroceryListRequest(BaseModel):
+    user_id: Optional[str] = None  # Defaults to the logged-in user
+    list_name: Optional[str] = None
+    Budget: float
+    Grocery_items: List[str]
+    Dietary_preferences: str
+    Allergies: List[str]
+    Store_preference: Optional[str] = None
+
+class BulkGroceryListsRequest(BaseModel):
+    requests: List[BulkGroceryListRequest]
+
 class SaveRecipeRequest(BaseModel):
     recipe_name: str
     ingredients: List[str]
@@ -139,11 +296,36 @@ class RecipeResponse(BaseModel):
     over_budget: float
     user_id: str
 
+class MealPlanRequest(BaseModel):
+    recipe_ids: List[str]
+    user_preferences: RecipeListUserPreferences
+    list_name: Optional[str] = None
+
 class NewGroceryItem(BaseModel):
     Item_name: str
     Store_name: str
     Price: float
 
+class GroceryItemUpdate(BaseModel):
+    Item_name: Optional[str] = None
+    Price: Optional[float] = None
+
+class GroceryItemOperationType(str, Enum):
+    add = "add"
+    remove = "remove"
+    update = "update"
+
+class GroceryItemOperation(BaseModel):
+    op: GroceryItemOperationType
+    item_name: str
+    store: Optional[str] = None
+    price: Optional[float] = None
+    new_item_name: Optional[str] = None
+
+class GroceryItemBatch(BaseModel):
+    operations: List[GroceryItemOperation]
+    version: Optional[int] = None
+
 # Generate recipe with grocery list
 @app.post("/generate_recipe_with_grocery_list", response_model=RecipeResponse)
 async def generate_recipe_with_grocery_list(
@@ -152,15 +334,17 @@ async def generate_recipe_with_grocery_list(
 ):
     try:
         # Step 1: Check if the recipe exists
-        recipe = recipes_collection.find_one({"name": recipe_request.recipe_name})
+        with stage("mongo_find"):
+            recipe = recipes_collection.find_one({"name": recipe_request.recipe_name})
         if not recipe:
             raise HTTPException(status_code=404, detail="This recipe does not exist.")
 
         # Step 2: Generate the grocery list
         recipe_id = recipe["_id"]
         try:
-            grocery_list, total_cost, over_budget = generate_grocery_list_from_recipe(
-                recipe_id=recipe_id, user_preferences=recipe_request.user_preferences.dict()
+            grocery_list, total_cost, over_budget = await run_in_threadpool(
+                generate_grocery_list_from_recipe,
+                recipe_id=recipe_id, user_preferences=recipe_request.user_preferences.dict(),
             )
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error generating grocery list: {str(e)}")
@@ -177,11 +361,14 @@ async def generate_recipe_with_grocery_list(
             "user_id": current_user
         }
         try:
-            result = grocery_lists_collection.insert_one(recipe_list_document)
+            with stage("mongo_insert"):
+                result = grocery_lists_collection.insert_one(recipe_list_document)
             inserted_id = result.inserted_id
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error saving grocery list: {str(e)}")
-        print(grocery_list)
+        logger.debug("Saved recipe grocery list", extra={
+            "list_id": str(inserted_id), "items": len(grocery_list), "total_cost": total_cost,
+        })
         # Step 4: Return the response
         return RecipeResponse(
             recipe_id=str(recipe_id),
@@ -196,6 +383,43 @@ async def generate_recipe_with_grocery_list(
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+# One deduplicated grocery list, with one budget, for several recipes
+@app.post("/meal_plan")
+async def generate_meal_plan_endpoint(meal_plan_request: MealPlanRequest, current_user: str = Depends(get_current_user)):
+    recipe_ids = meal_plan_request.recipe_ids
+    if not recipe_ids:
+        raise HTTPException(status_code=400, detail="recipe_ids cannot be empty.")
+    if len(recipe_ids) > MAX_MEAL_PLAN_RECIPES:
+        raise HTTPException(status_code=400, detail=f"A meal plan can have at most {MAX_MEAL_PLAN_RECIPES} recipes.")
+    invalid = [recipe_id for recipe_id in recipe_ids if not ObjectId.is_valid(recipe_id)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid recipe IDs: {', '.join(invalid)}")
+
+    try:
+        meal_plan = await run_in_threadpool(
+            generate_meal_plan, recipe_ids, meal_plan_request.user_preferences.dict()
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error("Error generating meal plan: %s", e)
+        raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
+
+    meal_plan_document = {
+        "list_name": meal_plan_request.list_name or "Meal plan: " + ", ".join(recipe["recipe_name"] for recipe in meal_plan["recipes"]),
+        "recipe_ids": [recipe["recipe_id"] for recipe in meal_plan["recipes"]],
+        **meal_plan,
+        "created_at": datetime.utcnow(),
+        "user_id": current_user,
+    }
+    try:
+        with stage("mongo_insert"):
+            result = grocery_lists_collection.insert_one(meal_plan_document)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving meal plan: {str(e)}")
+
+    return json_response({"list_id": result.inserted_id, "user_id": current_user, **meal_plan})
+
 # Fetch saved recipe lists by name
 @app.get("/recipe_lists/")
 async def get_recipe_list_by_name(list_name: str):
@@ -207,12 +431,10 @@ async def get_recipe_list_by_name(list_name: str):
         if not recipe_list:
             raise HTTPException(status_code=404, detail="Recipe list not found")
 
-        # Convert ObjectId to string and return the recipe list
-        recipe_list["_id"] = str(recipe_list["_id"])
-        return recipe_list
+        return json_response(recipe_list)
 
     except Exception as e:
-        print(f"Error fetching recipe list by name: {e}")
+        logger.error("Error fetching recipe list by name: %s", e)
         raise HTTPException(status_code=500, detail="An unexpected error occurred.")
 
     
@@ -259,7 +481,8 @@ async def login(user: LoginUser):
     return {"message": "Login successful", "access_token": access_token, "token_type": "bearer"}
 
 @app.post("/generate_grocery_list/")
-async def generate_grocery_list_endpoint(user_preferences: UserPreferences, list_name: Optional[str] = None, current_user: str = Depends(get_current_user)):
+async def generate_grocery_list_endpoint(user_preferences: UserPreferences, list_name: Optional[str] = None, current_user: str = Depends(get_current_user),
+                                        x_request_deadline_ms: Optional[int] = Header(None)):
     try:
         # Validate input items
         if not user_preferences.Grocery_items:
@@ -268,14 +491,15 @@ async def generate_grocery_list_endpoint(user_preferences: UserPreferences, list
         # Handle the store name being None
         store_preference = user_preferences.Store_preference if user_preferences.Store_preference else None
 
-        # Generate grocery list based on preferences
-        grocery_list = generate_grocery_list({
-            "Budget": user_preferences.Budget,
-            "Grocery_items": user_preferences.Grocery_items,
-            "Dietary_preferences": user_preferences.Dietary_preferences,
-            "Allergies": user_preferences.Allergies,
-            "Store_preference": store_preference,
-        })
+        # Generate grocery list based on preferences; past the deadline the items resolved so far come back flagged partial
+        with deadline(request_budget(x_request_deadline_ms), "grocery_list"):
+            grocery_list = await run_in_threadpool(generate_grocery_list, {
+                "Budget": user_preferences.Budget,
+                "Grocery_items": user_preferences.Grocery_items,
+                "Dietary_preferences": user_preferences.Dietary_preferences,
+                "Allergies": user_preferences.Allergies,
+                "Store_preference": store_preference,
+            })
 
         # Remove _id if present before inserting into the database
         if "_id" in grocery_list:
@@ -290,38 +514,96 @@ async def generate_grocery_list_endpoint(user_preferences: UserPreferences, list
             grocery_list["list_name"] = user_preferences.list_name
 
         # Insert the grocery list into the database
-        grocery_lists_collection.insert_one(grocery_list)
+        with stage("mongo_insert"):
+            grocery_lists_collection.insert_one(grocery_list)
 
         # Return the grocery list with its new _id
-        grocery_list["_id"] = str(grocery_list["_id"])
-        print(grocery_list)
-        return {"grocery_list": grocery_list}
+        logger.debug("Saved grocery list", extra={"list_id": str(grocery_list["_id"])})
+        return json_response({"grocery_list": grocery_list})
+
+    except Exception as e:
+        logger.error("Error generating grocery list: %s", e)
+        raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
+
+# Partner integrations may generate lists on behalf of other users
+PARTNER_API_KEY = os.getenv("PARTNER_API_KEY")
+MAX_BULK_REQUESTS = int(os.getenv("MAX_BULK_REQUESTS", "1000"))
 
+@app.post("/generate_grocery_lists/bulk")
+async def generate_grocery_lists_bulk_endpoint(
+    bulk_request: BulkGroceryListsRequest,
+    x_partner_key: Optional[str] = Header(None),
+    current_user: str = Depends(get_current_user),
+):
+    if not bulk_request.requests:
+        raise HTTPException(status_code=400, detail="Requests list cannot be empty.")
+    if len(bulk_request.requests) > MAX_BULK_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_REQUESTS} requests per call.")
+
+    is_partner = PARTNER_API_KEY is not None and hmac.compare_digest(x_partner_key or "", PARTNER_API_KEY)
+    requests = []
+    for request in bulk_request.requests:
+        if not request.Grocery_items:
+            raise HTTPException(status_code=400, detail="Items list cannot be empty.")
+        user_id = request.user_id or current_user
+        if user_id != current_user and not is_partner:
+            raise HTTPException(status_code=403, detail="Generating lists for other users requires a partner key.")
+        requests.append({
+            "user_id": user_id,
+            "list_name": request.list_name,
+            "preferences": {
+                "Budget": request.Budget,
+                "Grocery_items": request.Grocery_items,
+                "Dietary_preferences": request.Dietary_preferences,
+                "Allergies": request.Allergies,
+                "Store_preference": request.Store_preference or None,
+            },
+        })
+
+    try:
+        grocery_lists = await run_in_threadpool(generate_grocery_lists_bulk, requests)
     except Exception as e:
-        print(f"Error generating grocery list: {e}")
+        logger.error("Error generating grocery lists in bulk: %s", e)
         raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
 
+    return json_response({"grocery_lists": grocery_lists})
+
+# Serve the suggestion precomputed overnight by precompute_grocery_lists.py
+@app.get("/grocery_lists/suggested")
+async def get_suggested_grocery_list(current_user: str = Depends(get_current_user)):
+    suggestion = db["suggested_grocery_lists"].find_one({"user_id": current_user}, {"_id": 0})
+    if not suggestion:
+        raise HTTPException(status_code=404, detail="No suggested grocery list yet")
+    return json_response(suggestion)
+
 # Fetch previous grocery lists for a user
 @app.get("/grocery_lists")
-async def get_grocery_lists(list_name: Optional[str] = None, current_user: str = Depends(get_current_user)):
+async def get_grocery_lists(
+    list_name: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    current_user: str = Depends(get_current_user),
+):
+    query = {"user_id": current_user}
+
+    # If a list name is provided, filter by name as well
+    if list_name:
+        query["list_name"] = list_name
+
+    projection, output_fields = build_projection(fields, None, None)
     try:
-        query = {"user_id": current_user}
-        
-        # If a list name is provided, filter by name as well
-        if list_name:
-            query["list_name"] = list_name
-        
-        grocery_lists = grocery_lists_collection.find(query)
-        
-        if not grocery_lists:
-            return {"grocery_lists": []}
-            
-        grocery_list_items = []
-        for list_item in grocery_lists:
-            list_item["_id"] = str(list_item["_id"])
-            grocery_list_items.append(list_item)
-            
-        return {"grocery_lists": grocery_list_items}
+        if wants_ndjson(stream, accept):
+            return ndjson_response(grocery_lists_collection, query, projection, lambda doc: present(doc, output_fields), cursor)
+
+        grocery_lists, next_cursor = fetch_page(grocery_lists_collection, query, projection, clamp_limit(limit), cursor)
+        grocery_list_items = [present(list_item, output_fields) for list_item in grocery_lists]
+
+        return json_response({"grocery_lists": grocery_list_items, "next_cursor": next_cursor})
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -356,32 +638,100 @@ async def delete_grocery_list(list_id: str, current_user: str = Depends(get_curr
             detail=f"An error occurred while deleting the grocery list: {str(e)}"
         )
 
+# Fields clients may request from the catalog endpoints (embeddings are never exposed)
+ITEM_FIELDS = ("_id", "Item_name", "Store_name", "Price", "Ingredients", "Calories")
+STORE_FIELDS = ("_id", "Store_name")
+
+def catalog_response(collection, allowed, default, limit, cursor, fields, stream, accept, if_none_match):
+    """
+    Shared handler for the catalog-backed list endpoints (/items/ and /stores/).
+    Returns a projected page with an ETag, or streams everything as NDJSON.
+    """
+    projection, output_fields = build_projection(fields, allowed, default)
+    if wants_ndjson(stream, accept):
+        return ndjson_response(collection, {}, projection, lambda doc: present(doc, output_fields), cursor)
+
+    docs, next_cursor = fetch_page(collection, {}, projection, clamp_limit(limit), cursor)
+    content = [present(doc, output_fields) for doc in docs]
+    response = json_response(content, headers=next_page_headers(next_cursor))
+    etag = compute_etag(response.body)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, **next_page_headers(next_cursor)})
+    response.headers["ETag"] = etag
+    return response
+
 @app.get("/items/")
-async def get_items():
-    items = list(items_collection.find())
-    return [{"Item_name": item["Item_name"], "Price": item["Price"]} for item in items]
+async def get_items(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    return catalog_response(items_collection, ITEM_FIELDS, ("Item_name", "Price"), limit, cursor, fields, stream, accept, if_none_match)
+
+# The same product at other stores (groups are computed offline by product_groups.py), cheapest first
+@app.get("/items/{item_id}/equivalents")
+async def get_item_equivalents(item_id: str):
+    if not ObjectId.is_valid(item_id):
+        raise HTTPException(status_code=400, detail="Invalid item ID")
+    projection = {field: 1 for field in ITEM_FIELDS}
+    with stage("mongo_find"):
+        item = items_collection.find_one({"_id": ObjectId(item_id)}, {**projection, "equivalence_group": 1})
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    equivalents = []
+    if item.get("equivalence_group"):
+        with stage("mongo_find"):
+            equivalents = list(items_collection.find(
+                # Groups written before product_groups.py kept stores apart may still hold the item's own store
+                {"equivalence_group": item["equivalence_group"], "_id": {"$ne": item["_id"]},
+                 "Store_name": {"$ne": item.get("Store_name")}},
+                projection,
+            ).sort("Price", 1))
+    return json_response({"item": item, "equivalents": equivalents})
 
 # Route to fetch all stores (can be useful for frontend)
 @app.get("/stores/")
-async def get_stores():
-    stores = list(stores_collection.find())
-    return [{"Store_name": store["Store_name"]} for store in stores]
+async def get_stores(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    return catalog_response(stores_collection, STORE_FIELDS, ("Store_name",), limit, cursor, fields, stream, accept, if_none_match)
+
+# Run as a background task after the response is sent; the background sync picks the recipe up later if this fails
+def index_saved_recipe(recipe):
+    try:
+        recipe_index.add(recipe)
+    except Exception as e:
+        logger.error("Error adding recipe %s to the recipe index: %s", recipe.get("_id"), e)
 
 @app.post("/generate_recipe/")
-async def generate_recipe_route(prompt: RecipePrompt):
+async def generate_recipe_route(prompt: RecipePrompt, background_tasks: BackgroundTasks):
     try:
         # Call the function directly
-        recipe = generate_recipe(prompt.recipe_prompt)
+        recipe = await run_in_threadpool(generate_recipe, prompt.recipe_prompt)
         if not recipe:
             raise HTTPException(status_code=400, detail="Failed to generate recipe. Please try again.")
         
         recipe_id = save_recipe_to_db(recipe)
         if not recipe_id:
             raise HTTPException(status_code=500, detail="Failed to save recipe to database.")
+        background_tasks.add_task(index_saved_recipe, {"_id": recipe_id, **recipe})
         return {"recipe": recipe}
 
+    except HTTPException as e:
+        raise e
+    except LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail="Recipe generation is temporarily unavailable. Please try again shortly.",
+                            headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
-        print(f"Error generating recipe: {e}")
+        logger.error("Error generating recipe: %s", e)
         raise HTTPException(status_code=500, detail="An unexpected error occurred.")
 
 # from bson import json_util
@@ -405,6 +755,40 @@ async def generate_recipe_route(prompt: RecipePrompt):
 #         print(f"Error generating recipe: {str(e)}")
 #         raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again.")
 
+# Recipes estimated to fit a budget for a diet, cheapest first (or closest to `query` first)
+@app.get("/recipes/suggestions")
+async def get_recipe_suggestions(
+    budget: float,
+    diet: str = "none",
+    allergies: Optional[str] = None,
+    query: Optional[str] = None,
+    limit: int = 10,
+):
+    allergens = [allergen.strip() for allergen in allergies.split(",") if allergen.strip()] if allergies else []
+    try:
+        await run_in_threadpool(recipe_index.ensure_ready)
+        suggestions = await run_in_threadpool(
+            recipe_index.within_budget, budget, diet, allergens, query, max(1, min(limit, 100))
+        )
+    except Exception as e:
+        logger.error("Error suggesting recipes: %s", e)
+        raise HTTPException(status_code=500, detail="An unexpected error occurred.")
+    return {"recipes": suggestions}
+
+@app.get("/recipes/{recipe_id}/similar")
+async def get_similar_recipes(recipe_id: str, limit: int = 10):
+    if not ObjectId.is_valid(recipe_id):
+        raise HTTPException(status_code=400, detail="Invalid recipe ID")
+    try:
+        await run_in_threadpool(recipe_index.ensure_ready)
+        similar = await run_in_threadpool(recipe_index.similar, recipe_id, max(1, min(limit, 100)))
+    except Exception as e:
+        logger.error("Error finding similar recipes: %s", e)
+        raise HTTPException(status_code=500, detail="An unexpected error occurred.")
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    return {"recipe_id": recipe_id, "similar": similar}
+
 @app.get("/recipes/{recipe_name}/")
 async def get_recipe_by_name(recipe_name: str):
     """
@@ -422,17 +806,14 @@ async def get_recipe_by_name(recipe_name: str):
         if not recipe:
             raise HTTPException(status_code=404, detail="No recipe found matching the query")
 
-        # Convert ObjectId to string
-        recipe["_id"] = str(recipe["_id"])
-
-        return recipe
+        return json_response(recipe)
 
     except Exception as e:
-        print(f"Error fetching recipe by name: {e}")
+        logger.error("Error fetching recipe by name: %s", e)
         raise HTTPException(status_code=500, detail="An unexpected error occurred.")
 
 @app.get("/api/user")
-async def get_current_user(user_email: str):
+async def get_user_by_email(user_email: str):
     user = users_collection.find_one({"email": user_email}) 
     if not user:
         raise HTTPException(status_code=404, detail=f"User with email {user_email} not found")
@@ -486,6 +867,7 @@ async def get_current_user(user_email: str):
 @app.post("/recipes/save")
 async def save_recipe(
     recipe: SaveRecipeRequest,
+    background_tasks: BackgroundTasks,
     current_user: str = Depends(get_current_user)
 ):
     try:
@@ -516,7 +898,8 @@ async def save_recipe(
 
         # Insert into database
         result = recipes_collection.insert_one(recipe_document)
-        
+        background_tasks.add_task(index_saved_recipe, recipe_document)
+
         return {
             "message": "Recipe saved successfully",
             "recipe_id": str(result.inserted_id)
@@ -527,97 +910,153 @@ async def save_recipe(
             status_code=500,
             detail=f"Error saving recipe: {str(e)}"
         )
+# Fields returned by /recipes/saved, in their response order
+SAVED_RECIPE_FIELDS = (
+    "name", "ingredients", "instructions", "cooking_time", "servings",
+    "dietary_preferences", "allergies", "created_at",
+)
+
+def format_saved_recipe(recipe):
+    formatted = {"recipe_id": recipe["_id"]}
+    for field in SAVED_RECIPE_FIELDS:
+        if field in ("dietary_preferences", "allergies"):
+            formatted[field] = recipe.get(field, [])
+        elif field in recipe:
+            formatted[field] = recipe[field]
+    return formatted
+
 #testing
 @app.get("/recipes/saved")
-async def get_saved_recipes(current_user: str = Depends(get_current_user)):
+async def get_saved_recipes(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    current_user: str = Depends(get_current_user),
+):
+    query = {"user_id": current_user}
+    projection, _ = build_projection(fields, SAVED_RECIPE_FIELDS, SAVED_RECIPE_FIELDS)
     try:
-        # Find all recipes saved by the current user
-        saved_recipes = recipes_collection.find({"user_id": current_user})
-        
-        # Convert cursor to list and format the response
-        recipes_list = []
-        for recipe in saved_recipes:
-            recipes_list.append({
-                "recipe_id": str(recipe["_id"]),
-                "name": recipe["name"],
-                "ingredients": recipe["ingredients"],
-                "instructions": recipe["instructions"],
-                "cooking_time": recipe["cooking_time"],
-                "servings": recipe["servings"],
-                "dietary_preferences": recipe.get("dietary_preferences", []),
-                "allergies": recipe.get("allergies", []),
-                "created_at": recipe["created_at"] 
-            })
-            
-        return {
+        if wants_ndjson(stream, accept):
+            return ndjson_response(recipes_collection, query, projection, format_saved_recipe, cursor)
+
+        # Find one page of recipes saved by the current user
+        saved_recipes, next_cursor = fetch_page(recipes_collection, query, projection, clamp_limit(limit), cursor)
+        recipes_list = [format_saved_recipe(recipe) for recipe in saved_recipes]
+
+        # Everything the user has saved, not just this page; counted once, on the first page
+        total_count = None
+        if cursor is None:
+            with stage("mongo_find"):
+                total_count = recipes_collection.count_documents(query)
+
+        return json_response({
             "recipes": recipes_list,
-            "total_count": len(recipes_list)
-        }
+            "total_count": total_count,
+            "next_cursor": next_cursor,
+        })
 
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error fetching saved recipes: {str(e)}"
         )
 
+def run_item_operations(list_id, current_user, operations, expected_version, message):
+    try:
+        updated_list = apply_item_operations(
+            grocery_lists_collection, list_id, current_user, operations, expected_version
+        )
+    except GroceryListUpdateError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        logger.error("Error updating grocery list items: %s", e)
+        raise HTTPException(status_code=500, detail=f"An error occurred while updating the grocery list: {str(e)}")
+
+    return json_response({
+        "message": message,
+        "version": updated_list.get("version"),
+        "grocery_list": updated_list,
+    })
+
+@app.post("/grocery_lists/{list_id}/items")
+async def add_item_to_grocery_list(
+    list_id: str,
+    new_item: NewGroceryItem,
+    version: Optional[int] = None,
+    current_user: str = Depends(get_current_user)
+):
+    operation = {
+        "op": "add",
+        "store": new_item.Store_name,
+        "item": {"Item_name": new_item.Item_name, "Price": new_item.Price},
+    }
+    return run_item_operations(
+        list_id, current_user, [operation], version,
+        f"Item '{new_item.Item_name}' added to the grocery list successfully",
+    )
+
+@app.patch("/grocery_lists/{list_id}/items/{item_name}")
+async def update_item_in_grocery_list(
+    list_id: str,
+    item_name: str,
+    item_update: GroceryItemUpdate,
+    store: Optional[str] = None,
+    version: Optional[int] = None,
+    current_user: str = Depends(get_current_user)
+):
+    changes = {key: value for key, value in item_update.dict().items() if value is not None}
+    operation = {"op": "update", "store": store, "item_name": item_name, "changes": changes}
+    return run_item_operations(
+        list_id, current_user, [operation], version,
+        f"Item '{item_name}' updated successfully",
+    )
+
 @app.delete("/grocery_lists/{list_id}/items/{item_name}")
 async def delete_item_from_grocery_list(
     list_id: str,
     item_name: str,
-    current_user: dict = Depends(get_current_user)
+    store: Optional[str] = None,
+    version: Optional[int] = None,
+    current_user: str = Depends(get_current_user)
 ):
-    try:
-        current_user_id = current_user.get('id')
-        # print(f"Attempting to delete item '{item_name}' from list '{list_id}' for user ID '{current_user_id}'")
-        
-        if not ObjectId.is_valid(list_id):
-            raise HTTPException(status_code=400, detail="Invalid list ID")
-
-        grocery_list = grocery_lists_collection.find_one({"_id": ObjectId(list_id)})
-        
-        if not grocery_list:
-            print(f"No list found with id '{list_id}'")
-            raise HTTPException(status_code=404, detail="Grocery list not found")
-
-        # print(f"Found grocery list: {grocery_list}")
-        
-        list_user_id = grocery_list.get('user_id')
-        # print(f"List user_id: {list_user_id}, Current user ID: {current_user_id}")
-        
-        if str(list_user_id) != str(current_user_id):
-            print(f"User '{current_user_id}' doesn't have permission. List user_id: {list_user_id}")
-            raise HTTPException(status_code=403, detail="You don't have permission to modify this list")
-
-        # Find and remove the item from the grocery list
-        item_removed = False
-        for store in ["Trader Joe's", "Whole Foods Market"]:
-            result = grocery_lists_collection.update_one(
-                {"_id": ObjectId(list_id)},
-                {"$pull": {f"{store}.items": {"Item_name": item_name}}}
-            )
-            if result.modified_count > 0:
-                item_removed = True
-                break
-
-        if not item_removed:
-            raise HTTPException(status_code=404, detail=f"Item '{item_name}' not found in the grocery list")
-
-        # Update the total cost for each store
-        updated_list = grocery_lists_collection.find_one({"_id": ObjectId(list_id)})
-        if updated_list:
-            for store in ["Trader Joe's", "Whole Foods Market"]:
-                if store in updated_list:
-                    new_total_cost = sum(item.get('Price', 0) for item in updated_list[store].get('items', []))
-                    grocery_lists_collection.update_one(
-                        {"_id": ObjectId(list_id)},
-                        {"$set": {f"{store}.Total_Cost": new_total_cost}}
-                    )
+    operation = {"op": "remove", "store": store, "item_name": item_name}
+    return run_item_operations(
+        list_id, current_user, [operation], version,
+        f"Item '{item_name}' removed from the grocery list successfully",
+    )
+
+@app.post("/grocery_lists/{list_id}/items/batch")
+async def batch_update_grocery_list_items(
+    list_id: str,
+    batch: GroceryItemBatch,
+    current_user: str = Depends(get_current_user)
+):
+    operations = []
+    for operation in batch.operations:
+        if operation.op == "add":
+            if not operation.store or operation.price is None:
+                raise HTTPException(status_code=400, detail="Adding an item requires a store and a price")
+            operations.append({
+                "op": "add",
+                "store": operation.store,
+                "item": {"Item_name": operation.item_name, "Price": operation.price},
+            })
+        elif operation.op == "update":
+            changes = {"Item_name": operation.new_item_name, "Price": operation.price}
+            operations.append({
+                "op": "update",
+                "store": operation.store,
+                "item_name": operation.item_name,
+                "changes": {key: value for key, value in changes.items() if value is not None},
+            })
         else:
-            print(f"Warning: Updated list not found. List ID: {list_id}")
+            operations.append({"op": operation.op.value, "store": operation.store, "item_name": operation.item_name})
 
-        return {"message": f"Item '{item_name}' removed from the grocery list successfully"}
-    except HTTPException as he:
-        raise he
-    except Exception as e:
-        print(f"Error in delete_item_from_grocery_list: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"An error occurred while removing the item: {str(e)}")
+    return run_item_operations(
+        list_id, current_user, operations, batch.version,
+        f"{len(operations)} grocery list operations applied successfully",
+    )
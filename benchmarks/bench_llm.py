@@ -0,0 +1,105 @@
+"""
+Behaviour of the guarded OpenAI client (llm_client.py) against the local fake server:
+
+    python -m benchmarks.bench_llm
+
+Scenarios:
+- healthy: every call succeeds; latency and tokens are recorded.
+- transient 503s: the first attempts fail and the retries succeed.
+- slow upstream: attempts time out, the circuit opens and later calls fail fast.
+- recovery: once the reset period is over, one probe closes the circuit again.
+- bulkhead: more concurrent calls than slots; the excess is rejected after the queue timeout.
+
+Timings are scaled down (sub-second timeouts and reset periods) so the run takes seconds.
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from benchmarks.fake_openai import FakeOpenAIServer
+
+MESSAGES = [{"role": "user", "content": "Create a detailed recipe based on the following request: tomato pasta."}]
+
+
+def run_calls(client, calls, concurrency):
+    from llm_client import LLMUnavailable
+
+    def call(_):
+        started = time.perf_counter()
+        try:
+            client.chat("benchmark", MESSAGES, model="gpt-3.5-turbo", max_tokens=1000)
+            result = "ok"
+        except LLMUnavailable as e:
+            result = type(e).__name__
+        except Exception as e:
+            result = type(e).__name__
+        return result, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(call, range(calls)))
+
+
+def summarize(results):
+    outcomes = {}
+    for result, _ in results:
+        outcomes[result] = outcomes.get(result, 0) + 1
+    latencies = np.array([seconds for _, seconds in results]) * 1000
+    return {
+        "outcomes": ", ".join(f"{name}={count}" for name, count in sorted(outcomes.items())),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exercise the OpenAI bulkhead, retries and circuit breaker.")
+    parser.add_argument("--calls", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with FakeOpenAIServer() as server:
+        os.environ["OPENAI_API_KEY"] = "benchmark"
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        from llm_client import LLMClient, CircuitBreaker
+        import metrics
+
+        def client(**options):
+            settings = dict(max_concurrency=4, queue_timeout=1.0, timeout=0.5, max_retries=2,
+                            retry_base=0.05, retry_max=0.2, breaker=CircuitBreaker(failures=3, reset_seconds=1.0))
+            settings.update(options)
+            return LLMClient(**settings)
+
+        rows = {}
+        rows["healthy"] = summarize(run_calls(client(), args.calls, 4))
+
+        server.fail(503, count=2)
+        rows["transient 503s"] = summarize(run_calls(client(), 1, 1))
+
+        slow = client()
+        server.latency = 2.0
+        rows["slow upstream"] = summarize(run_calls(slow, args.calls, 1))
+        server.latency = 0.0
+        rows["circuit open (fails fast)"] = summarize(run_calls(slow, args.calls, 4))
+        time.sleep(slow.breaker.reset_seconds)
+        rows["recovery"] = summarize(run_calls(slow, args.calls, 1))
+
+        server.latency = 0.3
+        rows["bulkhead (2 slots, 12 callers)"] = summarize(
+            run_calls(client(max_concurrency=2, queue_timeout=0.1), 12, 12)
+        )
+        server.latency = 0.0
+
+    print(f"\n{'scenario':<34}{'p50 ms':>10}{'max ms':>10}  outcomes")
+    for name, row in rows.items():
+        print(f"{name:<34}{row['p50_ms']:>10.1f}{row['max_ms']:>10.1f}  {row['outcomes']}")
+    print()
+    for line in metrics.render_latest().splitlines():
+        if line.startswith(("chopnshop_llm_calls_total", "chopnshop_llm_tokens_total")):
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Latency and hit quality of the item retrieval modes on the benchmark catalog:
+
+    python -m benchmarks.bench_retrieval --items 5000
+    python -m benchmarks.bench_retrieval --mongo-uri mongodb://localhost:27017
+
+Modes: "vector" (FAISS only, as before), "hybrid" (BM25 + FAISS fused, no fast path)
+and "hybrid+fast" (the default: lexical answer alone when it is confident).
+An item is relevant to a query when its base product is one of the labelled products.
+Uses the offline hashing encoder; run encoders-level comparisons with compare_encoders.
+"""
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+from benchmarks.run import configure_environment, prepare_data
+
+# query -> base products from benchmarks.fixtures.PRODUCTS that satisfy it
+LABELLED_QUERIES = {
+    "almond milk": {"Almond Milk"},
+    "chips": {"Potato Chips"},
+    "pizza": {"Frozen Cheese Pizza", "Vegan Pizza"},
+    "vegan pizza": {"Vegan Pizza"},
+    "cheddar": {"Cheddar Cheese"},
+    "olive oil": {"Extra Virgin Olive Oil"},
+    "spaghetti": {"Spaghetti Pasta"},
+    "orange juice": {"Orange Juice"},
+    "bananas": {"Organic Bananas"},
+    "yogurt": {"Greek Yogurt"},
+    "peanut butter": {"Peanut Butter"},
+    "rice": {"Brown Rice"},
+    "chicken": {"Chicken Breast"},
+    "sourdough": {"Sourdough Bread"},
+    "basil": {"Fresh Basil"},
+    "garlic": {"Garlic Bulb"},
+    "onion": {"Yellow Onion"},
+    "tomatoes": {"Tomato"},
+}
+
+
+def evaluate(retriever, products_by_position, k, repeats):
+    latencies = []
+    precision = []
+    reciprocal_ranks = []
+    for query, relevant in LABELLED_QUERIES.items():
+        for _ in range(repeats):
+            started = time.perf_counter()
+            positions = retriever.search(query, k)
+            latencies.append(time.perf_counter() - started)
+        hits = [products_by_position.get(int(position)) in relevant for position in positions]
+        precision.append(np.mean(hits[:10]) if hits else 0.0)
+        first = next((rank for rank, hit in enumerate(hits, 1) if hit), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+    latencies = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "precision_at_10": float(np.mean(precision)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark vector vs hybrid item retrieval.")
+    parser.add_argument("--mongo-uri", default="mongomock://")
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, workdir, "http://127.0.0.1:9")
+        prepare_data(args.items)
+
+        import main
+        from benchmarks.fixtures import PRODUCTS
+        from hybrid_retriever import HybridRetriever
+
+        index, ids = main.load_faiss_index(main.FAISS_INDEX_FILE, main.FAISS_IDS_FILE)
+        base_products = {}
+        for item in main.items_collection.find({}, {"Item_name": 1}):
+            base_products[str(item["_id"])] = next(
+                (product for product, _, _ in PRODUCTS if product in item["Item_name"]), None
+            )
+        products_by_position = {position: base_products.get(item_id) for position, item_id in enumerate(ids)}
+
+        modes = {
+            "vector": HybridRetriever(index, ids, main.items_collection, mode="vector"),
+            "hybrid": HybridRetriever(index, ids, main.items_collection, fast_path_min_hits=len(ids) + 1),
+            "hybrid+fast": HybridRetriever(index, ids, main.items_collection),
+        }
+        print(f"{len(ids)} items, {len(LABELLED_QUERIES)} queries, k={args.k}")
+        print(f"\n{'mode':<14}{'p50 ms':>9}{'p95 ms':>9}{'P@10':>8}{'MRR':>8}")
+        for name, retriever in modes.items():
+            if retriever.mode != "vector":
+                retriever.lexical  # built once up front, not inside the timings
+            result = evaluate(retriever, products_by_position, args.k, args.repeats)
+            print(f"{name:<14}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+                  f"{result['precision_at_10']:>8.3f}{result['mrr']:>8.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Serialization and compression cost of the API responses, by response size:
+
+    python -m benchmarks.bench_serialization
+    python -m benchmarks.bench_serialization --sizes 10 100 1000 10000 --repeat 20
+
+Each size is a /grocery_lists-style page of that many saved lists (ObjectIds, datetimes,
+nested store baskets). "stdlib" is the previous path: _id converted to a string per
+document, FastAPI's jsonable_encoder, then json.dumps as in Starlette's JSONResponse.
+"orjson" is responses.json_response on the raw documents. The gzip and br columns are
+the time to compress the orjson body at the levels the middleware uses, and the ratio
+is the compressed size over the uncompressed size.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from benchmarks.fixtures import PRODUCTS
+import responses
+
+STORES = ("Whole Foods Market", "Trader Joe's", "Safeway", "Costco")
+
+
+def grocery_lists(count, seed=0):
+    rng = random.Random(seed)
+    created = datetime(2024, 1, 1)
+    documents = []
+    for i in range(count):
+        document = {"_id": ObjectId(), "user_id": str(ObjectId()), "list_name": f"List {i}"}
+        for store in rng.sample(STORES, 2):
+            items = [{"Item_name": rng.choice(PRODUCTS)[0], "Price": round(rng.uniform(0.5, 20), 2)}
+                     for _ in range(rng.randint(3, 10))]
+            document[store] = {"items": items, "Total_Cost": round(sum(item["Price"] for item in items), 2)}
+        document["created_at"] = created + timedelta(minutes=i)
+        documents.append(document)
+    return documents
+
+
+def stdlib_body(documents):
+    converted = []
+    for document in documents:
+        document = dict(document)
+        document["_id"] = str(document["_id"])
+        converted.append(document)
+    content = jsonable_encoder({"grocery_lists": converted, "next_cursor": None})
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def orjson_body(documents):
+    return responses.json_response({"grocery_lists": documents, "next_cursor": None}).body
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time JSON serialization and compression per response size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="documents per response")
+    parser.add_argument("--repeat", type=int, default=10, help="runs per measurement (the fastest is reported)")
+    args = parser.parse_args(argv)
+
+    print(f"{'docs':>7}{'body KB':>10}{'stdlib ms':>11}{'orjson ms':>11}{'speedup':>9}"
+          f"{'gzip ms':>9}{'ratio':>7}{'br ms':>9}{'ratio':>7}")
+    for size in args.sizes:
+        documents = grocery_lists(size)
+        stdlib_ms, expected = best_of(lambda: stdlib_body(documents), args.repeat)
+        orjson_ms, body = best_of(lambda: orjson_body(documents), args.repeat)
+        if json.loads(body) != json.loads(expected):
+            raise SystemExit(f"The two encoders disagree for {size} documents")
+
+        row = f"{size:>7}{len(body) / 1024:>10.1f}{stdlib_ms:>11.2f}{orjson_ms:>11.2f}{stdlib_ms / orjson_ms:>8.1f}x"
+        for encoding in ("gzip", "br"):
+            if encoding == "br" and responses.brotli is None:
+                row += f"{'-':>9}{'-':>7}"
+                continue
+            compress_ms, compressed = best_of(
+                lambda: responses.COMPRESSORS[encoding]().compress(body, True), args.repeat
+            )
+            row += f"{compress_ms:>9.2f}{len(compressed) / len(body):>7.2f}"
+        print(row)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Throughput and memory per worker of serve.py as the worker count grows:
+
+    python -m benchmarks.bench_workers --workers 1 2 4
+    python -m benchmarks.bench_workers --mongo-uri mongodb://localhost:27017 --workers 1 2 4 --compare-no-preload
+
+Each configuration starts serve.py in its own process on a free port, sends concurrent
+POST /generate_grocery_list/ requests and reads Rss and Pss of every worker from
+/proc/<pid>/smaps_rollup (Linux only). Pss splits shared pages between the processes
+that map them, so it is the number that drops when the workers share the preloaded
+model and index.
+
+With the in-memory Mongo fake the data lives in the server process, which therefore
+imports the app before forking; --compare-no-preload needs a real mongod.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.run import configure_environment, prepare_data, print_table
+from benchmarks.scenarios import GROCERY_PREFERENCES
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def memory_kb(pid):
+    """
+    Rss and Pss of a process in kB.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                values[name.lower()] = int(rest.split()[0])
+    return values
+
+
+def run_server(args):
+    """
+    Server side of one configuration (runs in its own process).
+    """
+    configure_environment(args, args.workdir, args.openai_url, import_app=args.seed)
+    if args.seed:
+        prepare_data(args.items)
+    import serve
+    from bson import ObjectId
+    from api import create_access_token
+
+    token = create_access_token({"sub": str(ObjectId())})
+
+    def ready(pids):
+        print(json.dumps({"token": token, "workers": pids}), flush=True)
+
+    return serve.serve(args.workers[0], args.threads, "127.0.0.1", args.port, preload_app=not args.no_preload,
+                       ready=ready)
+
+
+def wait_until_up(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"The server at {url} did not come up within {timeout}s")
+
+
+def load(base_url, token, requests, concurrency):
+    body = json.dumps(GROCERY_PREFERENCES).encode()
+
+    def call(_):
+        request = urllib.request.Request(
+            base_url + "/generate_grocery_list/", data=body, method="POST",
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"},
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                failed = response.status >= 400
+        except OSError:
+            failed = True
+        return time.perf_counter() - started, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    wall = time.perf_counter() - started
+    latencies = np.array([seconds for seconds, _ in results]) * 1000
+    return {
+        "count": len(results),
+        "errors": sum(failed for _, failed in results),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "throughput_rps": len(results) / wall,
+    }
+
+
+def run_configuration(args, workdir, openai_url, workers, preload_app):
+    port = free_port()
+    command = [
+        sys.executable, "-m", "benchmarks.bench_workers", "--serve",
+        "--workdir", workdir, "--openai-url", openai_url, "--port", str(port),
+        "--mongo-uri", args.mongo_uri, "--items", str(args.items),
+        "--workers", str(workers), "--threads", str(args.threads),
+    ]
+    if not preload_app:
+        command.append("--no-preload")
+    if args.mongo_uri.startswith("mongomock://"):
+        command.append("--seed")
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    try:
+        line = server.stdout.readline()
+        if not line:
+            raise SystemExit(f"The server exited with status {server.wait()}")
+        started = json.loads(line)
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_up(base_url + "/metrics", args.startup_timeout)
+        # Every worker serves a few requests before measuring, so lazy state is built
+        load(base_url, started["token"], args.warmup * workers, workers)
+        result = load(base_url, started["token"], args.requests, args.concurrency)
+        memory = [memory_kb(pid) for pid in started["workers"]]
+        parent = memory_kb(server.pid)
+        result.update({
+            "worker_rss_mb": float(np.mean([m["rss"] for m in memory])) / 1024,
+            "worker_pss_mb": float(np.mean([m["pss"] for m in memory])) / 1024,
+            "total_pss_mb": (parent["pss"] + sum(m["pss"] for m in memory)) / 1024,
+        })
+        return result
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark serve.py with a growing number of workers.")
+    parser.add_argument("--mongo-uri", default="mongomock://", help="mongomock:// or a local mongod URI")
+    parser.add_argument("--items", type=int, default=2000, help="catalog size to seed")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=1, help="torch/FAISS threads per worker")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=4, help="warm-up requests per worker")
+    parser.add_argument("--compare-no-preload", action="store_true", help="also run every worker count without preloading")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--output", help="write the results as JSON")
+    # Internal: the server side of one configuration
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--seed", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--no-preload", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--openai-url", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        return run_server(args)
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        raise SystemExit("bench_workers reads /proc/<pid>/smaps_rollup and needs Linux.")
+    if args.compare_no_preload and args.mongo_uri.startswith("mongomock://"):
+        raise SystemExit("--compare-no-preload needs a real mongod (--mongo-uri).")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir, FakeOpenAIServer() as openai_server:
+        if not args.mongo_uri.startswith("mongomock://"):
+            # Seed once from a separate process, so the server processes never import the app themselves
+            subprocess.run([sys.executable, "-c", (
+                "import sys; from benchmarks import bench_workers as b; b.seed_only(sys.argv[1:])"
+            ), args.mongo_uri, workdir, openai_server.base_url, str(args.items)], check=True)
+        modes = [True, False] if args.compare_no_preload else [True]
+        for preload_app in modes:
+            for workers in args.workers:
+                name = f"{workers} worker{'s' if workers > 1 else ''}{'' if preload_app else ', no preload'}"
+                print(f"Running {name}...", flush=True)
+                results[name] = run_configuration(args, workdir, openai_server.base_url, workers, preload_app)
+
+    print_table(f"POST /generate_grocery_list/ ({args.requests} requests, concurrency {args.concurrency})", {
+        name: {key: value for key, value in result.items() if not key.endswith("_mb")}
+        for name, result in results.items()
+    })
+    print(f"\n{'Memory (MB)':40} {'rss/worker':>10} {'pss/worker':>10} {'pss total':>10}")
+    for name, result in results.items():
+        print(f"{name:40} {result['worker_rss_mb']:10.1f} {result['worker_pss_mb']:10.1f} {result['total_pss_mb']:10.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+def seed_only(argv):
+    mongo_uri, workdir, openai_url, items = argv
+    configure_environment(argparse.Namespace(mongo_uri=mongo_uri), workdir, openai_url)
+    prepare_data(int(items))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
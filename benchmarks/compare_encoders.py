@@ -0,0 +1,121 @@
+"""
+Compare embedding backends against the current full-precision model on the catalog:
+
+    python encoders.py export                                       # once, for the onnx backends
+    python -m benchmarks.compare_encoders                           # catalog from MONGO_URI
+    python -m benchmarks.compare_encoders --synthetic 5000          # generated catalog, no database
+    python -m benchmarks.compare_encoders --backends torch-int8 onnx-int8 --k 100
+
+For every backend it reports catalog encode throughput, single-query encode latency,
+the cosine similarity of its embeddings to the reference ones, and how many of the
+reference top-k items it returns when its query embeddings search the reference index
+(i.e. what changes if only the query encoder is swapped, as in production).
+"""
+import sys
+import time
+import argparse
+import faiss
+import numpy as np
+
+from encoders import BACKENDS, load_encoder
+
+DEFAULT_QUERIES = [
+    "pizza", "chips", "juice", "bread", "cheese", "pasta", "olive oil", "tomato", "basil", "garlic",
+    "onion", "almond milk", "greek yogurt", "peanut butter", "brown rice", "chicken breast", "bananas",
+    "vegan cheese", "gluten free bread", "orange juice",
+]
+
+
+def load_catalog(args):
+    if args.synthetic:
+        from benchmarks.fixtures import build_items
+        return [item["Item_name"] for item in build_items(args.synthetic)]
+
+    from db import get_database
+    cursor = get_database()["items"].find({}, {"Item_name": 1, "_id": 0}).limit(args.items)
+    return [item["Item_name"] for item in cursor if item.get("Item_name")]
+
+
+def measure(encoder, catalog, queries, batch_size, repeats):
+    # Warm up (lazy initialisation, allocator, thread pools)
+    encoder.encode(catalog[:batch_size], batch_size=batch_size)
+    encoder.encode(queries[0])
+
+    started = time.perf_counter()
+    catalog_embeddings = np.asarray(encoder.encode(catalog, batch_size=batch_size), dtype=np.float32)
+    catalog_seconds = time.perf_counter() - started
+
+    latencies = []
+    query_embeddings = []
+    for _ in range(repeats):
+        for query in queries:
+            started = time.perf_counter()
+            embedding = encoder.encode(query)
+            latencies.append(time.perf_counter() - started)
+            if len(query_embeddings) < len(queries):
+                query_embeddings.append(embedding)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "catalog_embeddings": catalog_embeddings,
+        "query_embeddings": np.asarray(query_embeddings, dtype=np.float32),
+        "throughput": len(catalog) / catalog_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def top_k_agreement(reference_hits, hits):
+    overlaps = [len(set(expected) & set(found)) / len(expected) for expected, found in zip(reference_hits, hits)]
+    top1 = [expected[0] == found[0] for expected, found in zip(reference_hits, hits)]
+    return float(np.mean(overlaps)), float(np.mean(top1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare embedding backends on speed and retrieval agreement.")
+    parser.add_argument("--reference", default="torch", help="backend the others are compared to")
+    parser.add_argument("--backends", nargs="+", default=[backend for backend in BACKENDS if backend != "torch"])
+    parser.add_argument("--items", type=int, default=5000, help="catalog items to read from MongoDB")
+    parser.add_argument("--synthetic", type=int, help="use this many generated items instead of MongoDB")
+    parser.add_argument("--queries", help="file with one query per line (defaults to common grocery items)")
+    parser.add_argument("--k", type=int, default=100, help="search depth, as in generate_grocery_list")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=5, help="times each query is encoded for latency")
+    args = parser.parse_args(argv)
+
+    catalog = load_catalog(args)
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = DEFAULT_QUERIES
+    k = min(args.k, len(catalog))
+    print(f"{len(catalog)} catalog items, {len(queries)} queries, k={k}")
+
+    reference = measure(load_encoder(args.reference), catalog, queries, args.batch_size, args.repeats)
+    index = faiss.IndexFlatL2(reference["catalog_embeddings"].shape[1])
+    index.add(reference["catalog_embeddings"])
+    _, reference_hits = index.search(reference["query_embeddings"], k)
+
+    print(f"\n{'backend':<12}{'items/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'speedup':>9}{'cosine':>9}"
+          f"{'top-k':>8}{'top-1':>8}")
+    print(f"{args.reference:<12}{reference['throughput']:>10.1f}{reference['p50_ms']:>9.2f}"
+          f"{reference['p95_ms']:>9.2f}{1.0:>9.2f}{1.0:>9.3f}{1.0:>8.3f}{1.0:>8.3f}")
+
+    for backend in args.backends:
+        try:
+            encoder = load_encoder(backend)
+        except Exception as e:
+            print(f"{backend:<12}unavailable: {e}")
+            continue
+        result = measure(encoder, catalog, queries, args.batch_size, args.repeats)
+        cosine = float(np.mean(np.sum(result["catalog_embeddings"] * reference["catalog_embeddings"], axis=1)))
+        _, hits = index.search(result["query_embeddings"], k)
+        overlap, top1 = top_k_agreement(reference_hits, hits)
+        print(f"{backend:<12}{result['throughput']:>10.1f}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+              f"{reference['p50_ms'] / result['p50_ms']:>9.2f}{cosine:>9.3f}{overlap:>8.3f}{top1:>8.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ingredients handed out by the fake recipe generator; they match the benchmark catalog
+FAKE_INGREDIENTS = ["tomato", "onion", "garlic", "olive oil", "pasta", "cheese", "basil", "bread"]
+
+
+def fake_recipe(prompt):
+    """
+    Build a deterministic recipe for a prompt, in the JSON shape generate_recipe asks for.
+    """
+    match = re.search(r"recipe for (.+?)(?:\.|$)", prompt, re.IGNORECASE)
+    name = (match.group(1) if match else prompt).strip().title() or "Benchmark Recipe"
+    seed = sum(prompt.encode())
+    ingredients = [FAKE_INGREDIENTS[(seed + i) % len(FAKE_INGREDIENTS)] for i in range(5)]
+    simplified = list(dict.fromkeys(ingredients))
+    return {
+        "name": name,
+        "ingredients": [f"1 cup {ingredient}" for ingredient in ingredients],
+        "simplified_ingredients": simplified,
+        "instructions": [f"Prepare the {ingredient}." for ingredient in simplified] + ["Serve."],
+        "prep_time": "10 minutes",
+        "cook_time": "20 minutes",
+        "total_time": "30 minutes",
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        # Simulated upstream latency and injected failures, configured on the server
+        time.sleep(self.server.latency)
+        status = self.server.next_failure()
+        if status is not None:
+            self._send(status, {"error": {"message": f"Injected failure ({status})", "type": "server_error"}})
+            return
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        content = json.dumps(fake_recipe(prompt))
+        prompt_tokens = sum(len(message.get("content", "").split()) for message in body.get("messages", []))
+        completion_tokens = len(content.split())
+        self._send(200, {
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-3.5-turbo"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up first
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the OpenAI chat completions API, served from a background thread.
+    Point the client at `base_url` (e.g. through OPENAI_BASE_URL).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.httpd = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+        self.httpd.latency = latency
+        self.httpd.daemon_threads = True
+        self.httpd.failures = []
+        self.httpd.failures_lock = threading.Lock()
+        self.httpd.next_failure = self._next_failure
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def latency(self):
+        return self.httpd.latency
+
+    @latency.setter
+    def latency(self, seconds):
+        self.httpd.latency = seconds
+
+    def fail(self, status=503, count=1):
+        """
+        Answer the next `count` requests with an error `status` instead of a recipe.
+        """
+        with self.httpd.failures_lock:
+            self.httpd.failures.extend([status] * count)
+
+    def _next_failure(self):
+        with self.httpd.failures_lock:
+            return self.httpd.failures.pop(0) if self.httpd.failures else None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
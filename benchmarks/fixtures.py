@@ -0,0 +1,72 @@
+import pickle
+import numpy as np
+from bson.binary import Binary
+
+STORES = ["Trader Joe's", "Whole Foods Market"]
+
+# (product, ingredients, typical price) used to build the benchmark catalog
+PRODUCTS = [
+    ("Tomato", ["tomato"], 0.8),
+    ("Yellow Onion", ["onion"], 0.9),
+    ("Garlic Bulb", ["garlic"], 0.6),
+    ("Extra Virgin Olive Oil", ["olive oil"], 8.5),
+    ("Spaghetti Pasta", ["wheat flour", "water"], 1.8),
+    ("Cheddar Cheese", ["milk", "salt", "cheese cultures"], 4.5),
+    ("Fresh Basil", ["basil"], 2.5),
+    ("Sourdough Bread", ["wheat flour", "water", "salt"], 4.0),
+    ("Almond Milk", ["almonds", "water"], 3.5),
+    ("Frozen Cheese Pizza", ["wheat flour", "tomato", "mozzarella"], 5.0),
+    ("Vegan Pizza", ["wheat flour", "tomato", "cashew cheese"], 6.0),
+    ("Potato Chips", ["potatoes", "sunflower oil", "salt"], 2.5),
+    ("Orange Juice", ["oranges"], 3.8),
+    ("Organic Bananas", ["bananas"], 0.3),
+    ("Chicken Breast", ["chicken"], 7.0),
+    ("Greek Yogurt", ["milk", "live active cultures"], 1.5),
+    ("Peanut Butter", ["peanuts", "salt"], 3.0),
+    ("Brown Rice", ["brown rice"], 2.2),
+]
+
+VARIANTS = ["", "Organic ", "Family Size ", "Mini ", "Classic ", "Reduced Sodium "]
+
+
+def build_items(count, seed=0):
+    """
+    Deterministically generate `count` catalog items spread across the benchmark stores.
+    """
+    rng = np.random.default_rng(seed)
+    items = []
+    for i in range(count):
+        product, ingredients, price = PRODUCTS[i % len(PRODUCTS)]
+        variant = VARIANTS[(i // len(PRODUCTS)) % len(VARIANTS)]
+        items.append({
+            "Item_name": f"{variant}{product}".strip() + ("" if i < len(PRODUCTS) * len(VARIANTS) else f" #{i}"),
+            "Store_name": STORES[i % len(STORES)],
+            "Price": round(float(price * rng.lognormal(0, 0.25)), 2),
+            "Ingredients": list(ingredients),
+            "Calories": int(rng.integers(20, 600)),
+        })
+    return items
+
+
+def seed_database(db, model, item_count=2000, seed=0):
+    """
+    Reset the benchmark database and fill it with stores, embedded items and a recipe.
+    """
+    for name in ("users", "stores", "items", "recipes", "grocery_lists"):
+        db[name].delete_many({})
+
+    db["stores"].insert_many([{"Store_name": store} for store in STORES])
+
+    items = build_items(item_count, seed)
+    embeddings = model.encode([item["Item_name"] for item in items])
+    for item, embedding in zip(items, embeddings):
+        item["embedding"] = Binary(pickle.dumps(np.asarray(embedding, dtype=np.float32).tolist()))
+    db["items"].insert_many(items)
+
+    db["recipes"].insert_one({
+        "name": "Tomato Basil Pasta",
+        "ingredients": ["2 cups pasta", "3 tomatoes", "1 onion", "2 cloves garlic", "fresh basil"],
+        "simplified_ingredients": ["pasta", "tomato", "onion", "garlic", "basil"],
+        "instructions": ["Boil the pasta.", "Make the sauce.", "Combine."],
+    })
+    return len(items)
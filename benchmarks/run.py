@@ -0,0 +1,220 @@
+"""
+End-to-end benchmark for the API routes, runnable without Atlas, OpenAI or the MPNet download.
+
+    python -m benchmarks.run                                  # in-memory Mongo fake
+    python -m benchmarks.run --mongo-uri mongodb://localhost:27017
+    python -m benchmarks.run --save-baseline                  # record benchmarks/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from benchmarks.fake_openai import FakeOpenAIServer
+
+BENCHMARK_DB = "chop-n-shop-bench"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, failed=False):
+        with self._lock:
+            self.samples[name].append(seconds)
+            if failed:
+                self.errors[name] += 1
+
+    def summary(self, wall_seconds=None):
+        results = {}
+        for name, samples in sorted(self.samples.items()):
+            values = np.array(samples) * 1000
+            result = {
+                "count": len(samples),
+                "errors": self.errors.get(name, 0),
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+            }
+            if wall_seconds:
+                result["throughput_rps"] = len(samples) / wall_seconds
+            results[name] = result
+        return results
+
+
+def configure_environment(args, workdir, openai_url, import_app=True):
+    # Everything the modules read at import time must be set before the first import
+    os.environ["MONGO_URI"] = args.mongo_uri
+    os.environ["MONGO_DB_NAME"] = BENCHMARK_DB
+    os.environ["EMBEDDING_MODEL"] = "hashing"
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["OPENAI_BASE_URL"] = openai_url
+    os.environ["FAISS_INDEX_FILE"] = os.path.join(workdir, "faiss_index_file.index")
+    os.environ["FAISS_IDS_FILE"] = os.path.join(workdir, "ids_list.pkl")
+    os.environ["METRICS_SAMPLE_RATE"] = "1"
+    expected = dict(os.environ)
+    if not import_app:
+        return
+
+    import main  # noqa: F401  (loads .env)
+
+    # A .env file is loaded with override=True; refuse to benchmark against a real deployment
+    for name in ("MONGO_URI", "MONGO_DB_NAME", "EMBEDDING_MODEL", "OPENAI_BASE_URL"):
+        if os.environ.get(name) != expected[name]:
+            raise SystemExit(f"{name} is overridden by a .env file; move it aside to run the benchmarks.")
+
+
+def prepare_data(item_count):
+    import main
+    from benchmarks.fixtures import seed_database
+
+    seeded = seed_database(main.db, main.model, item_count=item_count)
+    index, ids = main.build_faiss_index()
+    main.save_faiss_index(index, ids, main.FAISS_INDEX_FILE, main.FAISS_IDS_FILE)
+    return seeded
+
+
+def run_scenarios(app, scenarios, iterations, concurrency, endpoint_recorder):
+    from fastapi.testclient import TestClient
+
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = TestClient(app)
+        return local.client
+
+    def run_once(scenario):
+        context = {}
+        for step in scenario.steps:
+            started = time.perf_counter()
+            try:
+                response = step.run(client(), context)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            endpoint_recorder.record(step.label, time.perf_counter() - started, failed)
+            if failed:
+                break
+
+    jobs = [scenario for _ in range(iterations) for scenario in scenarios]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_once, jobs))
+    return time.perf_counter() - started
+
+
+def compare_to_baseline(results, baseline, tolerance, min_delta_ms):
+    """
+    Flag every endpoint or stage whose p95 grew by more than `tolerance` (and by at least `min_delta_ms`).
+    """
+    regressions = []
+    for section in ("endpoints", "stages"):
+        for name, current in results.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous:
+                continue
+            delta = current["p95_ms"] - previous["p95_ms"]
+            if delta > min_delta_ms and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{section[:-1]} {name}: p95 {previous['p95_ms']:.2f}ms -> {current['p95_ms']:.2f}ms")
+    return regressions
+
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"{'name':<55}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    for name, row in rows.items():
+        throughput = f"{row['throughput_rps']:.1f}" if "throughput_rps" in row else "-"
+        print(f"{name:<55}{row['count']:>7}{row['errors']:>5}{row['p50_ms']:>10.2f}"
+              f"{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{throughput:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Chop N' Shop API with offline stand-ins.")
+    parser.add_argument("--mongo-uri", default="mongomock://", help="mongomock:// or a local mongod URI")
+    parser.add_argument("--items", type=int, default=2000, help="catalog size to seed")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--scenario", action="append", help="only run these scenarios")
+    parser.add_argument("--openai-latency", type=float, default=0.0, help="seconds added by the fake OpenAI server")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 growth over the baseline")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir, FakeOpenAIServer(latency=args.openai_latency) as openai_server:
+        configure_environment(args, workdir, openai_server.base_url)
+        seeded = prepare_data(args.items)
+
+        import api
+        from benchmarks.scenarios import build_scenarios
+
+        scenarios = build_scenarios(api.app)
+        if args.scenario:
+            scenarios = [scenario for scenario in scenarios if scenario.name in args.scenario]
+        if args.mongo_uri.startswith("mongomock://"):
+            skipped = [scenario.name for scenario in scenarios if scenario.needs_real_mongo]
+            scenarios = [scenario for scenario in scenarios if not scenario.needs_real_mongo]
+            if skipped:
+                print(f"Skipping {', '.join(skipped)} (needs a real mongod)")
+
+        print(f"Seeded {seeded} items; running {len(scenarios)} scenarios x {args.iterations} "
+              f"iterations at concurrency {args.concurrency}")
+
+        if args.warmup:
+            run_scenarios(api.app, scenarios, args.warmup, 1, LatencyRecorder())
+
+        import metrics
+
+        endpoint_recorder = LatencyRecorder()
+        stage_recorder = LatencyRecorder()
+        # Per-stage samples come from the same instrumentation that feeds /metrics
+        metrics.stage_observers.append(stage_recorder.record)
+        wall_seconds = run_scenarios(api.app, scenarios, args.iterations, args.concurrency, endpoint_recorder)
+
+    results = {
+        "config": {"items": args.items, "iterations": args.iterations, "concurrency": args.concurrency,
+                   "mongo": "mongomock" if args.mongo_uri.startswith("mongomock://") else "mongod"},
+        "endpoints": endpoint_recorder.summary(wall_seconds),
+        "stages": stage_recorder.summary(),
+    }
+    print_table("Endpoints", results["endpoints"])
+    print_table("Stages", results["stages"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import json
+import uuid
+from urllib.parse import urlsplit
+
+POSTMAN_COLLECTION = "Chop-N-Shop API.postman_collection (2).json"
+
+
+class Step:
+    """
+    One HTTP call in a scenario. `label` groups results per endpoint (method + route template).
+    `body`/`params` may be callables taking the scenario context, for values from earlier steps.
+    `after` receives (context, response) to store values for later steps.
+    """
+
+    def __init__(self, label, method, path, body=None, params=None, after=None, auth=False):
+        self.label = label
+        self.method = method
+        self.path = path
+        self.body = body
+        self.params = params
+        self.after = after
+        self.auth = auth
+
+    def run(self, client, context):
+        resolve = lambda value: value(context) if callable(value) else value
+        headers = {"Authorization": f"Bearer {context['token']}"} if self.auth else {}
+        response = client.request(
+            self.method, resolve(self.path), json=resolve(self.body), params=resolve(self.params), headers=headers
+        )
+        if self.after and response.status_code < 400:
+            self.after(context, response)
+        return response
+
+
+class Scenario:
+    def __init__(self, name, steps, needs_real_mongo=False):
+        self.name = name
+        self.steps = steps
+        # Some routes use server features (pipeline updates) the in-memory fake lacks
+        self.needs_real_mongo = needs_real_mongo
+
+
+def postman_steps(app, path=POSTMAN_COLLECTION):
+    """
+    Turn the requests in the bundled Postman collection into steps, keeping only
+    the ones that match a route the app actually serves.
+    """
+    from starlette.routing import Match
+
+    with open(path) as f:
+        collection = json.load(f)
+
+    def walk(entries):
+        for entry in entries:
+            if "item" in entry:
+                yield from walk(entry["item"])
+            else:
+                yield entry
+
+    steps = []
+    for entry in walk(collection.get("item", [])):
+        request = entry["request"]
+        url = request["url"] if isinstance(request["url"], str) else request["url"].get("raw", "")
+        route_path = urlsplit(url).path
+        method = request["method"]
+        scope = {"type": "http", "path": route_path, "method": method}
+        for route in app.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                raw_body = (request.get("body") or {}).get("raw")
+                body = json.loads(raw_body) if raw_body else None
+                steps.append(Step(f"{method} {route.path}", method, route_path, body=body))
+                break
+    return steps
+
+
+def register_and_login_steps():
+    def new_user(context):
+        context["email"] = f"bench-{uuid.uuid4().hex}@example.com"
+        return {"first_name": "Bench", "email": context["email"], "password": "benchmark-password"}
+
+    def keep_token(context, response):
+        context["token"] = response.json()["access_token"]
+
+    return [
+        Step("POST /register/", "POST", "/register/", body=new_user),
+        Step("POST /login/", "POST", "/login/",
+             body=lambda context: {"email": context["email"], "password": "benchmark-password"},
+             after=keep_token),
+    ]
+
+
+GROCERY_PREFERENCES = {
+    "list_name": "Benchmark list",
+    "Budget": 40.0,
+    "Grocery_items": ["pizza", "chips", "juice", "bread", "cheese", "pasta"],
+    "Dietary_preferences": "vegetarian",
+    "Allergies": ["peanuts"],
+    "Store_preference": None,
+}
+
+
+def keep_list_id(context, response):
+    context["list_id"] = response.json()["grocery_list"]["_id"]
+
+
+def build_scenarios(app):
+    return [
+        Scenario("catalog", postman_steps(app) + [Step("GET /stores/", "GET", "/stores/")]),
+        Scenario("auth", register_and_login_steps()),
+        Scenario("grocery_list", register_and_login_steps() + [
+            Step("POST /generate_grocery_list/", "POST", "/generate_grocery_list/",
+                 body=GROCERY_PREFERENCES, auth=True, after=keep_list_id),
+            Step("GET /grocery_lists", "GET", "/grocery_lists", auth=True),
+        ]),
+        Scenario("recipe", register_and_login_steps() + [
+            Step("POST /generate_recipe/", "POST", "/generate_recipe/",
+                 body={"recipe_prompt": "I want a recipe for tomato pasta."}),
+            Step("POST /generate_recipe_with_grocery_list", "POST", "/generate_recipe_with_grocery_list",
+                 body={
+                     "recipe_name": "Tomato Basil Pasta",
+                     "user_preferences": {"Budget": 30.0, "Dietary_preferences": "vegan", "Allergies": []},
+                 },
+                 auth=True),
+        ]),
+        Scenario("list_edit", register_and_login_steps() + [
+            Step("POST /generate_grocery_list/", "POST", "/generate_grocery_list/",
+                 body=GROCERY_PREFERENCES, auth=True, after=keep_list_id),
+            Step("POST /grocery_lists/{list_id}/items", "POST",
+                 lambda context: f"/grocery_lists/{context['list_id']}/items",
+                 body={"Item_name": "Benchmark Apples", "Store_name": "Trader Joe's", "Price": 2.5}, auth=True),
+            Step("DELETE /grocery_lists/{list_id}/items/{item_name}", "DELETE",
+                 lambda context: f"/grocery_lists/{context['list_id']}/items/Benchmark Apples", auth=True),
+        ], needs_real_mongo=True),
+    ]
@@ -0,0 +1,148 @@
+import numpy as np
+from datetime import datetime
+from bson.objectid import ObjectId
+from metrics import stage
+from openai_grocerylist import items_collection, grocery_lists_collection, is_item_valid, index_manager
+
+# Same stores and search depth as generate_grocery_list
+STORES = ["Trader Joe's", "Whole Foods Market"]
+SEARCH_K = 100
+
+# Fields needed to filter and format candidates (never the embedding)
+CANDIDATE_PROJECTION = {"Item_name": 1, "Price": 1, "Store_name": 1, "Ingredients": 1, "Category": 1}
+HYDRATE_CHUNK_SIZE = 5000
+
+
+class CandidateTable:
+    """
+    Hydrated search results for a batch of queries, stored column-wise so the
+    per-user filters and budgets can be evaluated with NumPy masks.
+    """
+
+    def __init__(self, docs, candidates):
+        self.docs = docs
+        # query -> positions into docs, in search rank order
+        self.candidates = candidates
+        self.prices = np.array([float(doc.get("Price", 0)) for doc in docs], dtype=np.float64)
+        self.store_names = np.array([doc.get("Store_name") or "" for doc in docs], dtype=object)
+        self._valid_masks = {}
+
+    def valid_mask(self, dietary_preferences, allergies):
+        # Validity only depends on the diet and allergens, so it is computed once per combination
+        key = (dietary_preferences, tuple(sorted(allergies)))
+        if key not in self._valid_masks:
+            self._valid_masks[key] = np.array(
+                [is_item_valid(doc, dietary_preferences, list(allergies)) for doc in self.docs], dtype=bool
+            )
+        return self._valid_masks[key]
+
+
+def hydrate_items(positions, ids):
+    """
+    Load the items at the given index positions with one $in query per chunk.
+    Returns a dict of index position -> item document.
+    """
+    object_ids = {}
+    for position in positions:
+        if 0 <= position < len(ids):
+            object_ids[ObjectId(ids[position])] = position
+
+    items = {}
+    keys = list(object_ids)
+    for start in range(0, len(keys), HYDRATE_CHUNK_SIZE):
+        chunk = keys[start:start + HYDRATE_CHUNK_SIZE]
+        with stage("hydrate"):
+            for item in items_collection.find({"_id": {"$in": chunk}}, CANDIDATE_PROJECTION):
+                items[object_ids[item["_id"]]] = item
+    return items
+
+
+def search_candidates(queries, retriever=None, k=SEARCH_K):
+    """
+    Rank every distinct query once (one batched embedding and FAISS search for the
+    queries that need it) and hydrate the union of hits. Uses the active index
+    version unless a retriever is given.
+    """
+    if retriever is None:
+        with index_manager.acquire() as version:
+            return search_candidates(queries, version.retriever, k)
+
+    rankings = retriever.search_many(queries, k)
+    if not rankings:
+        return CandidateTable([], {})
+
+    hits_union = np.unique(np.concatenate(list(rankings.values())))
+    items = hydrate_items(hits_union.tolist(), retriever.ids)
+    positions = {index_position: row for row, index_position in enumerate(items)}
+    docs = list(items.values())
+
+    candidates = {}
+    for query, hits in rankings.items():
+        candidates[query] = np.array(
+            [positions[hit] for hit in hits if hit in positions], dtype=np.int64
+        )
+    return CandidateTable(docs, candidates)
+
+
+def select_items(table, preferences):
+    """
+    Pick items for one set of preferences, with the same rules as generate_grocery_list:
+    for each store and requested item, the first ranked hit from that store that passes
+    the diet/allergen checks and still fits in the budget.
+    """
+    valid = table.valid_mask(preferences["Dietary_preferences"], preferences["Allergies"])
+    budget = preferences["Budget"]
+
+    formatted_lists = {}
+    for store in STORES:
+        store_mask = table.store_names == store
+        selected = []
+        total_cost = 0
+        for request in preferences["Grocery_items"]:
+            candidates = table.candidates.get(request)
+            if candidates is None or len(candidates) == 0:
+                continue
+            eligible = store_mask[candidates] & valid[candidates] & (total_cost + table.prices[candidates] <= budget)
+            hits = np.flatnonzero(eligible)
+            if len(hits) == 0:
+                continue
+            position = candidates[hits[0]]
+            selected.append(table.docs[position])
+            total_cost += table.prices[position]
+
+        formatted_lists[store] = {
+            "items": [{"Item_name": item["Item_name"], "Price": item["Price"]} for item in selected],
+            "Total_Cost": round(float(total_cost), 2),
+        }
+
+    if preferences.get("Store_preference"):
+        store = preferences["Store_preference"]
+        return {store: formatted_lists.get(store, {"message": f"No items found for {store}."})}
+    return formatted_lists
+
+
+def generate_grocery_lists_bulk(requests, retriever=None, persist=True):
+    """
+    Generate grocery lists for many users or preference sets in one pass.
+    Each request is {"user_id": ..., "list_name": ..., "preferences": {...}} where
+    preferences has the same keys generate_grocery_list takes.
+    All lists are saved with a single insert_many and returned in request order.
+    """
+    queries = [query for request in requests for query in request["preferences"]["Grocery_items"]]
+    table = search_candidates(queries, retriever)
+
+    documents = []
+    created_at = datetime.utcnow()
+    for request in requests:
+        with stage("select"):
+            document = select_items(table, request["preferences"])
+        document["user_id"] = request.get("user_id")
+        document["created_at"] = created_at
+        if request.get("list_name"):
+            document["list_name"] = request["list_name"]
+        documents.append(document)
+
+    if persist and documents:
+        with stage("mongo_insert"):
+            grocery_lists_collection.insert_many(documents, ordered=False)
+    return documents
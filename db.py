@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+import pymongo
+from pymongo import monitoring
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv(override=True)
+
+DATABASE_NAME = os.getenv("MONGO_DB_NAME", "chop-n-shop")
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Collects connection pool statistics per server address from PyMongo's CMAP events.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._servers = {}
+
+    def _server(self, address):
+        key = f"{address[0]}:{address[1]}"
+        if key not in self._servers:
+            self._servers[key] = {
+                "open_connections": 0,
+                "checked_out": 0,
+                "waiting": 0,
+                "connections_created": 0,
+                "connections_closed": 0,
+                "checkouts": 0,
+                "checkout_failures": 0,
+                "checkout_wait_seconds_total": 0.0,
+                "pool_clears": 0,
+            }
+        return self._servers[key]
+
+    def _update(self, address, **deltas):
+        with self._lock:
+            server = self._server(address)
+            for field, delta in deltas.items():
+                server[field] += delta
+
+    def pool_created(self, event):
+        with self._lock:
+            self._server(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(event.address, pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event.address, open_connections=1, connections_created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event.address, open_connections=-1, connections_closed=1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        self._update(event.address, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event.address, waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        waited = time.perf_counter() - started if started is not None else 0.0
+        self._update(event.address, waiting=-1, checked_out=1, checkouts=1, checkout_wait_seconds_total=waited)
+
+    def connection_checked_in(self, event):
+        self._update(event.address, checked_out=-1)
+
+    def snapshot(self):
+        with self._lock:
+            return {address: dict(stats) for address, stats in self._servers.items()}
+
+
+pool_stats_listener = PoolStatsListener()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _int_env(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def client_options():
+    """
+    Build the MongoClient keyword arguments from the environment.
+    Unset variables fall back to PyMongo's defaults.
+    """
+    options = {
+        "maxPoolSize": _int_env("MONGO_MAX_POOL_SIZE"),
+        "minPoolSize": _int_env("MONGO_MIN_POOL_SIZE"),
+        "maxIdleTimeMS": _int_env("MONGO_MAX_IDLE_TIME_MS"),
+        "maxConnecting": _int_env("MONGO_MAX_CONNECTING"),
+        "waitQueueTimeoutMS": _int_env("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "connectTimeoutMS": _int_env("MONGO_CONNECT_TIMEOUT_MS"),
+        "socketTimeoutMS": _int_env("MONGO_SOCKET_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": _int_env("MONGO_SERVER_SELECTION_TIMEOUT_MS"),
+        # e.g. "zstd,snappy" - the server picks the first one it also supports
+        "compressors": os.getenv("MONGO_COMPRESSORS"),
+        "zlibCompressionLevel": _int_env("MONGO_ZLIB_COMPRESSION_LEVEL"),
+        # e.g. "secondaryPreferred"
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE"),
+        "appname": os.getenv("MONGO_APP_NAME", "chop-n-shop-api"),
+    }
+
+    write_concern = os.getenv("MONGO_WRITE_CONCERN")
+    if write_concern:
+        options["w"] = int(write_concern) if write_concern.isdigit() else write_concern
+    journal = os.getenv("MONGO_WRITE_CONCERN_JOURNAL")
+    if journal:
+        options["journal"] = journal.lower() in ("1", "true", "yes")
+    options["wTimeoutMS"] = _int_env("MONGO_WRITE_CONCERN_TIMEOUT_MS")
+
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def get_client():
+    """
+    Return the process-wide MongoClient, creating it on first use.
+    Every module shares this one client so each worker has a single connection pool.
+    MONGO_URI=mongomock:// uses an in-memory fake instead (needs the mongomock package).
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None and (os.getenv("MONGO_URI") or "").startswith("mongomock://"):
+                import mongomock
+                _client = mongomock.MongoClient()
+            elif _client is None:
+                _client = pymongo.MongoClient(
+                    os.getenv("MONGO_URI"),
+                    event_listeners=[pool_stats_listener],
+                    **client_options(),
+                )
+    return _client
+
+
+def get_database():
+    return get_client()[DATABASE_NAME]
+
+
+def close_client():
+    """
+    Close the shared client at process exit (the API's shutdown hook). Modules keep the
+    handles from get_database() they took at import, and PyMongo cannot reuse a closed
+    client, so nothing may touch the database afterwards. A forked child does not need
+    this: PyMongo resets the inherited client's pools and monitors itself.
+    """
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+
+
+POOL_GAUGES = {
+    field: metrics.gauge(f"chopnshop_mongo_pool_{field}", f"MongoDB connection pool {field.replace('_', ' ')}.", ("server",))
+    for field in ("open_connections", "checked_out", "waiting")
+}
+POOL_COUNTERS = {
+    field: metrics.counter(f"chopnshop_mongo_pool_{field}_total", f"MongoDB connection pool {field.replace('_', ' ')} since start.", ("server",))
+    for field in ("connections_created", "connections_closed", "checkouts", "checkout_failures", "checkout_wait_seconds", "pool_clears")
+}
+
+
+def collect_pool_metrics():
+    for address, stats in pool_stats_listener.snapshot().items():
+        for field, gauge in POOL_GAUGES.items():
+            gauge.set(stats[field], address)
+        for field, counter in POOL_COUNTERS.items():
+            counter.set(stats[field + "_total" if field == "checkout_wait_seconds" else field], address)
+
+
+metrics.REGISTRY.register_collector(collect_pool_metrics)
+
+
+def pool_stats():
+    """
+    Connection pool statistics plus the configured limits, for the metrics endpoint.
+    """
+    options = client_options()
+    return {
+        "max_pool_size": options.get("maxPoolSize", 100),
+        "min_pool_size": options.get("minPoolSize", 0),
+        "servers": pool_stats_listener.snapshot(),
+    }
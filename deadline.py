@@ -0,0 +1,128 @@
+"""
+Per-request deadlines. The API sets a deadline around an operation; the stages below it
+(embedding, FAISS search, hydration, filtering) call check() between units of work and
+bound their own waits by remaining(), so a request that runs out of time stops instead
+of holding its worker:
+
+    with deadline(2.0, "grocery_list"):
+        generate_grocery_list(preferences)   # raises DeadlineExceeded from check() once expired
+
+The deadline lives in a context variable, so it follows run_in_threadpool into the worker thread.
+"""
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+import pymongo
+from pymongo.errors import PyMongoError
+from metrics import counter
+
+# Default time budget of a grocery list request (0 turns the deadline off)
+GROCERY_LIST_DEADLINE_MS = int(os.getenv("GROCERY_LIST_DEADLINE_MS", "5000"))
+# Upper bound on the budget a client can ask for with the X-Request-Deadline-Ms header
+MAX_REQUEST_DEADLINE_MS = int(os.getenv("MAX_REQUEST_DEADLINE_MS", "30000"))
+
+DEADLINE_EXCEEDED = counter(
+    "chopnshop_deadline_exceeded_total", "Requests that ran out of their deadline, by the stage that hit it.",
+    ("operation", "stage"),
+)
+
+_deadline = contextvars.ContextVar("chopnshop_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    __slots__ = ("operation", "budget", "expires_at", "exceeded")
+
+    def __init__(self, seconds, operation):
+        self.operation = operation
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.exceeded = None
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expire(self, stage):
+        # Counted once per request, under the stage that noticed first
+        if self.exceeded is None:
+            self.exceeded = stage
+            DEADLINE_EXCEEDED.inc(self.operation, stage)
+        return DeadlineExceeded(stage)
+
+
+def request_budget(header_ms=None, default_ms=GROCERY_LIST_DEADLINE_MS):
+    """
+    Seconds of budget for a request: the client's X-Request-Deadline-Ms value (capped),
+    else the default. None when neither sets a deadline.
+    """
+    ms = header_ms if header_ms is not None and header_ms > 0 else default_ms
+    if ms <= 0:
+        return None
+    return min(ms, MAX_REQUEST_DEADLINE_MS) / 1000
+
+
+@contextmanager
+def deadline(seconds, operation):
+    """
+    Run the block under a deadline `seconds` from now (no deadline when seconds is None).
+    """
+    if seconds is None:
+        yield None
+        return
+    current = Deadline(seconds, operation)
+    token = _deadline.set(current)
+    try:
+        yield current
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    Seconds left before the current deadline, or None without one.
+    """
+    current = _deadline.get()
+    return None if current is None else current.remaining()
+
+
+def check(stage):
+    """
+    Raise DeadlineExceeded if the current deadline has passed.
+    """
+    current = _deadline.get()
+    if current is not None and time.monotonic() >= current.expires_at:
+        raise current.expire(stage)
+
+
+def exceeded(stage):
+    """
+    The DeadlineExceeded to raise when a wait bounded by remaining() timed out.
+    """
+    current = _deadline.get()
+    return current.expire(stage) if current is not None else DeadlineExceeded(stage)
+
+
+@contextmanager
+def mongo_timeout(stage):
+    """
+    Bound the MongoDB operations of the block by the current deadline (PyMongo's
+    client-side operation timeout); a timeout surfaces as DeadlineExceeded.
+    """
+    current = _deadline.get()
+    if current is None:
+        yield
+        return
+    check(stage)
+    try:
+        with pymongo.timeout(current.remaining()):
+            yield
+    except PyMongoError as e:
+        if not e.timeout:
+            raise
+        raise current.expire(stage) from e
@@ -0,0 +1,116 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+import numpy as np
+from metrics import REGISTRY, gauge, counter, histogram
+
+logger = logging.getLogger(__name__)
+
+# Turn the shared batching thread off to encode on the caller's thread, one text at a time
+EMBEDDING_MICROBATCH = os.getenv("EMBEDDING_MICROBATCH", "true").lower() in ("1", "true", "yes")
+# Largest number of texts encoded in one forward pass
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+# How long the first text of a batch may wait for others to join it
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "2"))
+
+QUEUE_DEPTH = gauge("chopnshop_embedding_queue_depth", "Texts waiting for the embedding batcher.")
+BATCH_SIZE = histogram(
+    "chopnshop_embedding_batch_size", "Texts per batched encode call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+QUEUE_WAIT = histogram(
+    "chopnshop_embedding_queue_wait_seconds", "Time from submitting a text to the start of its batch."
+)
+ENCODE_DURATION = histogram("chopnshop_embedding_encode_seconds", "Duration of one batched encode call.")
+ENCODE_ERRORS = counter("chopnshop_embedding_encode_errors_total", "Batched encode calls that raised.")
+
+
+class EmbeddingBatcher:
+    """
+    Collects encode calls from concurrent requests and runs them as one batched forward pass.
+
+    A background thread takes the first queued text, waits up to `max_wait_ms` for more
+    (or until `max_batch_size` texts), encodes the distinct texts together and resolves
+    every caller's future with its own row.
+    """
+
+    def __init__(self, encode, max_batch_size=EMBEDDING_BATCH_MAX_SIZE, max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS):
+        self._encode = encode
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        REGISTRY.register_collector(lambda: QUEUE_DEPTH.set(self._queue.qsize()))
+
+    def _ensure_running(self):
+        # Started lazily, and again in a forked child (threads do not survive fork)
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, text):
+        self._ensure_running()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, text, timeout=None):
+        """
+        Same result as encode(text) on the model, computed in a shared batch.
+        """
+        return self.submit(text).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        # Whatever is already queued joins without waiting
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for _, _, submitted in batch:
+                QUEUE_WAIT.observe(started - submitted)
+
+            # Identical texts (e.g. the same item in several lists) are encoded once
+            rows = {}
+            for text, _, _ in batch:
+                rows.setdefault(text, len(rows))
+            BATCH_SIZE.observe(len(rows))
+            try:
+                embeddings = np.asarray(self._encode(list(rows), batch_size=len(rows)))
+            except Exception as e:
+                ENCODE_ERRORS.inc()
+                logger.error("Batched encode of %d texts failed: %s", len(rows), e)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            ENCODE_DURATION.observe(time.perf_counter() - started)
+            for text, future, _ in batch:
+                future.set_result(embeddings[rows[text]])
@@ -0,0 +1,235 @@
+"""
+Embedding backends behind main.generate_embedding. Every encoder exposes the subset of
+SentenceTransformer used by this project: encode(sentences, batch_size) and
+get_sentence_embedding_dimension().
+
+    EMBEDDING_BACKEND=torch        sentence-transformers in full precision (default)
+    EMBEDDING_BACKEND=torch-int8   same model with its Linear layers dynamically quantized to int8
+    EMBEDDING_BACKEND=onnx         ONNX Runtime export of the model (see `python encoders.py export`)
+    EMBEDDING_BACKEND=onnx-int8    ONNX export with int8 weights
+    EMBEDDING_MODEL=hashing        deterministic offline stand-in, whatever the backend
+"""
+import os
+import re
+import sys
+import hashlib
+import argparse
+import numpy as np
+
+# Same output size as all-MPNet-base-v2, so indexes built with either are interchangeable in shape
+EMBEDDING_DIMENSION = 768
+
+DEFAULT_MODEL = "all-MPNet-base-v2"
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Where `export` writes, and the onnx backends read, the exported model and tokenizer
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "onnx_model")
+# Intra-op threads for torch / ONNX Runtime (0 keeps the library default)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# all-MPNet-base-v2 truncates at 384 tokens
+MAX_SEQ_LENGTH = 384
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model-int8.onnx"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class HashingEncoder:
+    """
+    Deterministic stand-in for the sentence-transformers model, used for offline
+    benchmarks and synthetic data. Words and character trigrams are hashed into a
+    fixed-size vector, so similar strings still land close to each other.
+    Exposes the subset of SentenceTransformer.encode that this project uses.
+    """
+
+    def __init__(self, dimension=EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def _features(self, text):
+        words = TOKEN_PATTERN.findall(text.lower())
+        features = list(words)
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def _encode_one(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.dimension] += sign
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        if isinstance(sentences, str):
+            return self._encode_one(sentences)
+        if not sentences:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.stack([self._encode_one(sentence) for sentence in sentences])
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+
+class TorchEncoder:
+    """
+    The sentence-transformers model on CPU. With quantize=True its Linear layers are
+    replaced by dynamically quantized int8 versions (activations stay float), which
+    is where almost all of the encode time goes.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, quantize=False):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if EMBEDDING_THREADS:
+            torch.set_num_threads(EMBEDDING_THREADS)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.model.eval()
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self._inference_mode = torch.inference_mode
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        with self._inference_mode():
+            return self.model.encode(sentences, batch_size=batch_size, convert_to_numpy=True, **kwargs)
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+
+class OnnxEncoder:
+    """
+    ONNX Runtime session over a model exported with `python encoders.py export`.
+    Reproduces the sentence-transformers pipeline of all-MPNet-base-v2:
+    mean pooling over the attention mask, then L2 normalization.
+    """
+
+    def __init__(self, model_dir=EMBEDDING_ONNX_DIR, quantized=False):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        model_file = os.path.join(model_dir, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(f"{model_file} not found; run `python encoders.py export` first.")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if EMBEDDING_THREADS:
+            options.intra_op_num_threads = EMBEDDING_THREADS
+        self.session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+
+    def _encode_batch(self, sentences):
+        tokens = self.tokenizer(
+            sentences, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np"
+        )
+        feed = {name: tokens[name].astype(np.int64) for name in ("input_ids", "attention_mask", "token_type_ids")
+                if name in self.input_names and name in tokens}
+        token_embeddings = self.session.run(None, feed)[0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        if not sentences:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        # Batch sentences of similar length together to keep padding small
+        order = np.argsort([len(sentence) for sentence in sentences])
+        embeddings = np.empty((len(sentences), self.dimension), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            positions = order[start:start + batch_size]
+            embeddings[positions] = self._encode_batch([sentences[i] for i in positions])
+        return embeddings[0] if single else embeddings
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+
+def load_encoder(backend=None, model_name=None):
+    """
+    Create the encoder selected by EMBEDDING_BACKEND / EMBEDDING_MODEL (or the arguments).
+    """
+    backend = backend or EMBEDDING_BACKEND
+    model_name = model_name or os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL)
+    if model_name == "hashing" or backend == "hashing":
+        return HashingEncoder()
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend == "torch-int8":
+        return TorchEncoder(model_name, quantize=True)
+    if backend == "onnx":
+        return OnnxEncoder()
+    if backend == "onnx-int8":
+        return OnnxEncoder(quantized=True)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def export_onnx(model_name=DEFAULT_MODEL, output_dir=EMBEDDING_ONNX_DIR, quantize=True):
+    """
+    Export the transformer of a sentence-transformers model to ONNX (dynamic batch and
+    sequence axes), save its tokenizer next to it, and optionally write an int8 copy.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    transformer = SentenceTransformer(model_name, device="cpu")[0]
+    transformer.tokenizer.save_pretrained(output_dir)
+    auto_model = transformer.auto_model.eval()
+
+    sample = transformer.tokenizer(["an example grocery item"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    model_file = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.inference_mode():
+        torch.onnx.export(
+            auto_model,
+            tuple(sample[name] for name in input_names),
+            model_file,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    written = [model_file]
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        int8_file = os.path.join(output_dir, ONNX_INT8_MODEL_FILE)
+        quantize_dynamic(model_file, int8_file, weight_type=QuantType.QInt8)
+        written.append(int8_file)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the embedding backends.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="export the model to ONNX (and an int8 copy)")
+    export.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL))
+    export.add_argument("--output-dir", default=EMBEDDING_ONNX_DIR)
+    export.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        for path in export_onnx(args.model, args.output_dir, quantize=not args.no_quantize):
+            print(f"Wrote {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
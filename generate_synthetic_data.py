@@ -0,0 +1,461 @@
+"""
+Seeded synthetic users, stores, items and recipes for load and scaling tests:
+
+    python generate_synthetic_data.py --items 1000000 --stores 50 --users 200000 --recipes 50000
+    python generate_synthetic_data.py --items 5000000 --output-dir synthetic/ --no-embeddings
+
+Documents follow the schemas of DataPopulation.py / users_sample_data.csv and of the
+recipes saved by openai_json_recipe.py. The same seed always produces the same data,
+_ids included. Item embeddings come from the offline HashingEncoder, so the FAISS
+index written next to the data matches what EMBEDDING_MODEL=hashing serves.
+
+With --mongo-uri the documents are inserted in batches into a dedicated database
+(chop-n-shop-synthetic unless --db says otherwise); collections that already hold
+documents are only emptied with --drop. With --output-dir they are written as extended JSON lines that
+`mongoimport` accepts. Stores do not embed their Items list: at millions of items it
+would exceed MongoDB's 16 MB document limit, so each store gets an Item_count instead.
+"""
+import os
+import sys
+import gzip
+import time
+import pickle
+import argparse
+import numpy as np
+import faiss
+from bson import json_util
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from encoders import HashingEncoder
+from ingest_catalog import save_index_atomically
+
+SYNTHETIC_BATCH_SIZE = int(os.getenv("SYNTHETIC_BATCH_SIZE", "10000"))
+COLLECTIONS = ("stores", "items", "users", "recipes")
+# Never the serving database or index files by default: the index watcher would hot-swap them in
+SYNTHETIC_DB = "chop-n-shop-synthetic"
+SYNTHETIC_INDEX_DIR = "synthetic-index"
+RANDOM_BLOCK_SIZE = 4096
+
+# (product, simplified ingredient, ingredients, typical price, calories)
+PRODUCTS = [
+    ("Bananas", "banana", ["bananas"], 0.3, 105),
+    ("Apples", "apple", ["apples"], 0.9, 95),
+    ("Oranges", "orange", ["oranges"], 0.8, 62),
+    ("Lemons", "lemon", ["lemons"], 0.7, 17),
+    ("Avocado", "avocado", ["avocado"], 1.5, 240),
+    ("Strawberries", "strawberries", ["strawberries"], 3.5, 50),
+    ("Blueberries", "blueberries", ["blueberries"], 4.0, 85),
+    ("Tomatoes", "tomato", ["tomatoes"], 2.0, 22),
+    ("Yellow Onion", "onion", ["onion"], 0.9, 44),
+    ("Garlic", "garlic", ["garlic"], 0.6, 5),
+    ("Potatoes", "potato", ["potatoes"], 3.0, 160),
+    ("Carrots", "carrot", ["carrots"], 1.5, 25),
+    ("Broccoli", "broccoli", ["broccoli"], 2.2, 55),
+    ("Spinach", "spinach", ["spinach"], 3.0, 7),
+    ("Bell Pepper", "bell pepper", ["bell pepper"], 1.2, 30),
+    ("Mushrooms", "mushrooms", ["mushrooms"], 2.8, 20),
+    ("Fresh Basil", "basil", ["basil"], 2.5, 1),
+    ("Cilantro", "cilantro", ["cilantro"], 1.0, 1),
+    ("Chicken Breast", "chicken", ["chicken"], 7.0, 165),
+    ("Ground Beef", "ground beef", ["beef"], 6.5, 250),
+    ("Pork Chops", "pork", ["pork"], 6.0, 230),
+    ("Bacon", "bacon", ["pork", "salt", "sugar", "sodium nitrite"], 5.5, 45),
+    ("Salmon Fillet", "salmon", ["salmon"], 10.0, 208),
+    ("Tuna", "tuna", ["tuna", "water", "salt"], 1.8, 100),
+    ("Shrimp", "shrimp", ["shrimp"], 9.0, 85),
+    ("Tofu", "tofu", ["soybeans", "water", "calcium sulfate"], 2.5, 80),
+    ("Large Eggs", "eggs", ["eggs"], 3.5, 70),
+    ("Whole Milk", "milk", ["milk", "vitamin d"], 3.2, 150),
+    ("Almond Milk", "almond milk", ["almonds", "water"], 3.5, 60),
+    ("Oat Milk", "oat milk", ["oats", "water", "sunflower oil"], 4.0, 120),
+    ("Greek Yogurt", "yogurt", ["milk", "live active cultures"], 1.5, 100),
+    ("Butter", "butter", ["cream", "salt"], 4.5, 100),
+    ("Cheddar Cheese", "cheddar", ["milk", "salt", "cheese cultures", "enzymes"], 4.5, 110),
+    ("Mozzarella", "mozzarella", ["milk", "salt", "enzymes"], 4.0, 85),
+    ("Parmesan", "parmesan", ["milk", "salt", "rennet"], 6.0, 110),
+    ("Sourdough Bread", "bread", ["wheat flour", "water", "salt"], 4.0, 120),
+    ("Whole Wheat Bread", "bread", ["whole wheat", "yeast", "water"], 3.0, 120),
+    ("Tortillas", "tortillas", ["wheat flour", "water", "vegetable oil"], 2.5, 140),
+    ("Spaghetti", "pasta", ["semolina", "water"], 1.8, 200),
+    ("Penne", "pasta", ["semolina", "water"], 1.8, 200),
+    ("Brown Rice", "rice", ["brown rice"], 2.2, 215),
+    ("Jasmine Rice", "rice", ["jasmine rice"], 3.0, 205),
+    ("Quinoa", "quinoa", ["quinoa"], 5.0, 220),
+    ("Rolled Oats", "oats", ["oats"], 3.5, 150),
+    ("All-Purpose Flour", "flour", ["wheat flour"], 3.0, 110),
+    ("Granulated Sugar", "sugar", ["sugar"], 2.8, 15),
+    ("Honey", "honey", ["honey"], 6.0, 64),
+    ("Extra Virgin Olive Oil", "olive oil", ["olive oil"], 8.5, 120),
+    ("Vegetable Oil", "vegetable oil", ["soybean oil"], 4.0, 120),
+    ("Black Beans", "black beans", ["black beans", "water", "salt"], 1.2, 110),
+    ("Chickpeas", "chickpeas", ["chickpeas", "water", "salt"], 1.2, 120),
+    ("Lentils", "lentils", ["lentils"], 2.0, 230),
+    ("Peanut Butter", "peanut butter", ["peanuts", "salt"], 3.0, 190),
+    ("Almonds", "almonds", ["almonds"], 7.0, 160),
+    ("Marinara Sauce", "tomato sauce", ["tomatoes", "olive oil", "garlic", "basil", "salt"], 4.0, 70),
+    ("Soy Sauce", "soy sauce", ["water", "soybeans", "wheat", "salt"], 3.0, 10),
+    ("Chicken Broth", "chicken broth", ["chicken stock", "salt", "onion"], 2.5, 10),
+    ("Vegetable Broth", "vegetable broth", ["water", "carrots", "celery", "onion", "salt"], 2.5, 10),
+    ("Frozen Peas", "peas", ["peas"], 2.0, 60),
+    ("Frozen Cheese Pizza", "pizza", ["wheat flour", "tomatoes", "mozzarella"], 5.0, 300),
+    ("Potato Chips", "chips", ["potatoes", "sunflower oil", "salt"], 2.5, 160),
+    ("Tortilla Chips", "chips", ["corn", "vegetable oil", "salt"], 3.0, 140),
+    ("Dark Chocolate", "chocolate", ["cocoa mass", "sugar", "cocoa butter"], 3.5, 170),
+    ("Orange Juice", "orange juice", ["oranges"], 3.8, 110),
+    ("Ground Coffee", "coffee", ["coffee"], 8.0, 2),
+    ("Black Pepper", "black pepper", ["black pepper"], 4.0, 1),
+    ("Sea Salt", "salt", ["sea salt"], 2.0, 0),
+    ("Cinnamon", "cinnamon", ["cinnamon"], 3.5, 6),
+]
+
+# Every axis value must be distinct (including the single ""), so that slot names are unique
+BRANDS = ["", "Store Brand", "365", "Kirkland", "Good & Gather", "Simple Truth", "Great Value",
+          "O Organics", "Market Pantry", "Signature Select", "Nature's Promise", "Happy Farms"]
+
+# (modifier, price multiplier, extra ingredients)
+VARIANTS = [
+    ("", 1.0, []), ("Organic", 1.35, []), ("Classic", 1.0, []), ("Family Size", 1.8, []),
+    ("Reduced Sodium", 1.1, []), ("Spicy", 1.05, ["chili pepper"]), ("Honey Roasted", 1.15, ["honey"]),
+    ("Garlic Herb", 1.1, ["garlic", "parsley"]), ("Lightly Salted", 1.0, ["salt"]), ("Gluten-Free", 1.4, []),
+    ("Fresh", 1.1, []), ("Frozen", 0.9, ["water"]), ("Smoked", 1.2, ["natural smoke flavor"]),
+]
+
+# (size label, price multiplier)
+SIZES = [("", 1.0), ("Small", 0.7), ("Large", 1.4), ("2 Pack", 1.9), ("Value Pack", 2.6)]
+
+# Ingredients added to a share of processed items, like real labels
+ADDITIVES = ["citric acid", "natural flavors", "sea salt", "ascorbic acid", "xanthan gum", "canola oil",
+             "sunflower lecithin", "vinegar", "cane sugar", "rosemary extract"]
+ADDITIVE_RATE = 0.3
+
+STORE_CHAINS = ["Trader Joes", "Whole Foods", "Wegmans", "Safeway", "Kroger", "Aldi", "Costco", "Publix",
+                "Target", "Walmart", "Sprouts", "Giant", "Food Lion", "Stop & Shop", "H-E-B", "Meijer"]
+
+FIRST_NAMES = ["Bob", "Emma", "Liam", "Olivia", "Noah", "Ava", "Sophia", "Mason", "Isabella", "Lucas",
+               "Mia", "Ethan", "Amelia", "James", "Harper", "Aiden", "Evelyn", "Elijah", "Abigail", "Logan",
+               "Priya", "Wei", "Fatima", "Mateo", "Yuki", "Omar", "Chloe", "Diego", "Aisha", "Ravi"]
+DIETARY_RESTRICTIONS = ["Vegan", "Vegetarian", "Kosher", "Halal", "Gluten-free", "Lactose-free", "Pescetarian"]
+ALLERGIES = ["Peanuts", "Fish", "Dairy", "Shellfish", "Soy", "Eggs", "Tree nuts", "Wheat"]
+FOOD_REQUESTS = ["pizza", "sandwich", "pasta", "snacks", "salad", "soup", "tacos", "stir fry", "curry",
+                 "breakfast", "smoothie", "burrito", "rice bowl", "dessert", "grilled chicken"]
+
+DISHES = ["Pasta", "Salad", "Soup", "Stir Fry", "Tacos", "Curry", "Bowl", "Casserole", "Skillet", "Wraps",
+          "Frittata", "Sandwiches", "Risotto", "Chili", "Sheet Pan Dinner"]
+UNITS = ["1 cup", "2 cups", "1/2 cup", "1 tbsp", "2 tbsp", "1 tsp", "200 g", "1 lb", "2", "3", "1 pinch"]
+STEPS = ["Prep and chop the {0}.", "Heat a pan over medium heat and cook the {0}.", "Add the {1} and stir.",
+         "Season to taste.", "Simmer for {2} minutes.", "Combine everything and serve."]
+
+# Fixed _id timestamp: _ids depend only on the seed, collection and position
+ID_TIMESTAMP = 0x65000000
+COLLECTION_TAGS = {"stores": 1, "items": 2, "users": 3, "recipes": 4}
+
+
+def synthetic_id(collection, seed, position):
+    return ObjectId(f"{ID_TIMESTAMP:08x}{COLLECTION_TAGS[collection]:02x}{seed % 256:02x}{position:012x}")
+
+
+class CatalogGenerator:
+    """
+    Items are laid out store-major within each catalog slot: item i is slot i // stores at
+    store i % stores, so every store carries (roughly) the same product line, as real chains
+    do, at its own price level. Slot names are unique, so (Item_name, Store_name) is unique.
+    """
+
+    def __init__(self, stores, seed=0):
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.stores = make_stores(stores, seed)
+        # Chains differ in overall price level by roughly +-10%
+        self.store_price_levels = self.rng.lognormal(0, 0.1, len(self.stores)).clip(0.8, 1.25)
+        # Each axis is shuffled once so that small catalogs still mix products, brands and variants
+        self.axes = [self.rng.permutation(len(axis)) for axis in (PRODUCTS, BRANDS, VARIANTS, SIZES)]
+        self.combinations = len(PRODUCTS) * len(BRANDS) * len(VARIANTS) * len(SIZES)
+
+    def slot(self, slot):
+        """
+        Decode a catalog slot into (name, base price, ingredients, calories).
+        """
+        base, repeat = slot % self.combinations, slot // self.combinations
+        indices = []
+        for axis in self.axes:
+            base, index = divmod(base, len(axis))
+            indices.append(axis[index])
+        product, _, ingredients, price, calories = PRODUCTS[indices[0]]
+        brand = BRANDS[indices[1]]
+        variant, variant_price, extras = VARIANTS[indices[2]]
+        size, size_price = SIZES[indices[3]]
+        name = " ".join(part for part in (brand, variant, product, size) if part)
+        if repeat:
+            name += f" #{repeat}"
+        ingredients = list(ingredients) + [extra for extra in extras if extra not in ingredients]
+        return name, price * variant_price * size_price, ingredients, calories
+
+    def _draws(self, start, count):
+        # Random draws come from fixed-size blocks seeded by their position, so an item
+        # gets the same price whatever batch size it was generated with
+        first, last = start // RANDOM_BLOCK_SIZE, (start + count - 1) // RANDOM_BLOCK_SIZE
+        draws = []
+        for block in range(first, last + 1):
+            rng = np.random.default_rng([self.seed, 0, block])
+            draws.append((rng.lognormal(0, 0.12, RANDOM_BLOCK_SIZE),
+                          rng.normal(1.0, 0.1, RANDOM_BLOCK_SIZE).clip(0.5, 1.5),
+                          rng.random(RANDOM_BLOCK_SIZE) < ADDITIVE_RATE,
+                          rng.integers(0, len(ADDITIVES), RANDOM_BLOCK_SIZE)))
+        offset = start - first * RANDOM_BLOCK_SIZE
+        return [np.concatenate(column)[offset:offset + count] for column in zip(*draws)]
+
+    def items(self, start, count):
+        """
+        Items [start, start + count) of the catalog. Batches can be produced independently
+        and in any order.
+        """
+        positions = np.arange(start, start + count)
+        store_indices = positions % len(self.stores)
+        noise, calorie_noise, additives, additive_choices = self._draws(start, count)
+        noise = noise * self.store_price_levels[store_indices]
+
+        items = []
+        for j, position in enumerate(positions):
+            store = self.stores[store_indices[j]]
+            name, price, ingredients, calories = self.slot(int(position) // len(self.stores))
+            if additives[j] and len(ingredients) > 1 and ADDITIVES[additive_choices[j]] not in ingredients:
+                ingredients.append(ADDITIVES[additive_choices[j]])
+            items.append({
+                "_id": synthetic_id("items", self.seed, int(position)),
+                "Item_id": str(position + 1),
+                "Item_name": name,
+                "Store_id": store["Store_id"],
+                "Store_name": store["Name"],
+                "Price": round(max(float(price * noise[j]), 0.1), 2),
+                "Ingredients": ingredients,
+                "Calories": int(calories * calorie_noise[j]),
+            })
+        return items
+
+
+def make_stores(count, seed=0):
+    stores = []
+    for i in range(count):
+        chain = STORE_CHAINS[i % len(STORE_CHAINS)]
+        name = chain if i < len(STORE_CHAINS) else f"{chain} #{i // len(STORE_CHAINS) + 1}"
+        stores.append({"_id": synthetic_id("stores", seed, i), "Store_id": str(i + 1), "Name": name})
+    return stores
+
+
+def generate_users(start, count, store_names, seed=0):
+    users = []
+    for position in range(start, start + count):
+        # One generator per record keeps every user independent of the batch size
+        rng = np.random.default_rng([seed, 1, position])
+        first_name = FIRST_NAMES[int(rng.integers(len(FIRST_NAMES)))]
+        # About a third of users have a dietary restriction and a fifth an allergy
+        restrictions = list(rng.choice(DIETARY_RESTRICTIONS, int(rng.random() < 0.33) + int(rng.random() < 0.05), replace=False))
+        allergies = list(rng.choice(ALLERGIES, int(rng.random() < 0.2) + int(rng.random() < 0.05), replace=False))
+        users.append({
+            "_id": synthetic_id("users", seed, position),
+            "First_name": first_name,
+            "Email": f"{first_name.lower()}.{position}@example.com",
+            "Budget": float(round(rng.lognormal(np.log(60), 0.5), 0)),
+            "Dietary_restrictions": [str(restriction) for restriction in restrictions],
+            "Allergies": [str(allergy) for allergy in allergies],
+            "Food_request": [str(request) for request in rng.choice(FOOD_REQUESTS, int(rng.integers(1, 4)), replace=False)],
+            "Preferred_stores": [str(store) for store in rng.choice(store_names, min(int(rng.integers(0, 3)), len(store_names)), replace=False)],
+        })
+    return users
+
+
+def generate_recipes(start, count, seed=0):
+    simplified = sorted({product[1] for product in PRODUCTS})
+    recipes = []
+    for position in range(start, start + count):
+        rng = np.random.default_rng([seed, 2, position])
+        ingredients = [str(ingredient) for ingredient in rng.choice(simplified, int(rng.integers(4, 11)), replace=False)]
+        name = f"{ingredients[0].title()} and {ingredients[1].title()} {DISHES[int(rng.integers(len(DISHES)))]}"
+        prep, cook = int(rng.integers(1, 7)) * 5, int(rng.integers(1, 13)) * 5
+        recipes.append({
+            "_id": synthetic_id("recipes", seed, position),
+            "Recipe_id": str(position + 1),
+            "name": name,
+            "ingredients": [f"{UNITS[int(rng.integers(len(UNITS)))]} {ingredient}" for ingredient in ingredients],
+            "simplified_ingredients": ingredients,
+            "instructions": [step.format(ingredients[0], ingredients[1], cook) for step in STEPS],
+            "prep_time": f"{prep} mins",
+            "cook_time": f"{cook} mins",
+            "total_time": f"{prep + cook} mins",
+            "link": "Unknown",
+        })
+    return recipes
+
+
+class MongoSink:
+    def __init__(self, db, drop=False):
+        self.db = db
+        self.drop = drop
+
+    def non_empty(self):
+        return [collection for collection in COLLECTIONS if self.db[collection].count_documents({}, limit=1)]
+
+    def reset(self, collection):
+        # main() refuses to write into collections that hold documents unless --drop is given
+        if self.drop:
+            self.db[collection].delete_many({})
+
+    def write(self, collection, documents):
+        self.db[collection].insert_many(documents, ordered=False)
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """
+    One <collection>.jsonl(.gz) per collection, in MongoDB extended JSON.
+    """
+
+    def __init__(self, output_dir, compress=False):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.compress = compress
+        self.files = {}
+
+    def reset(self, collection):
+        path = os.path.join(self.output_dir, f"{collection}.jsonl" + (".gz" if self.compress else ""))
+        self.files[collection] = gzip.open(path, "wt", encoding="utf-8") if self.compress else open(path, "w", encoding="utf-8")
+
+    def write(self, collection, documents):
+        self.files[collection].writelines(json_util.dumps(document) + "\n" for document in documents)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def embed_items(items, encoder):
+    """
+    Embed item names; every slot's name repeats once per store, so each distinct name is encoded once.
+    """
+    names = list(dict.fromkeys(item["Item_name"] for item in items))
+    vectors = dict(zip(names, encoder.encode(names)))
+    return np.stack([vectors[item["Item_name"]] for item in items]).astype(np.float32)
+
+
+def generate(sink, items=0, stores=1, users=0, recipes=0, seed=0, batch_size=SYNTHETIC_BATCH_SIZE,
+             encoder=None, embed_documents=True, index=None, ids=None, progress=None):
+    """
+    Write the synthetic collections to `sink`. With an `encoder`, item embeddings are
+    stored on the documents (if `embed_documents`) and appended to `index`/`ids` when given.
+    Returns {collection: documents written}.
+    """
+    catalog = CatalogGenerator(stores, seed)
+    store_names = [store["Name"] for store in catalog.stores]
+    counts = dict.fromkeys(COLLECTIONS, 0)
+
+    sink.reset("stores")
+    per_store = np.bincount(np.arange(items) % len(catalog.stores), minlength=len(catalog.stores)) if items else None
+    store_documents = [dict(store, Item_count=int(per_store[i]) if items else 0) for i, store in enumerate(catalog.stores)]
+    sink.write("stores", store_documents)
+    counts["stores"] = len(store_documents)
+
+    sink.reset("items")
+    for start in range(0, items, batch_size):
+        batch = catalog.items(start, min(batch_size, items - start))
+        if encoder is not None:
+            embeddings = embed_items(batch, encoder)
+            if embed_documents:
+                for item, embedding in zip(batch, embeddings):
+                    item["embedding"] = Binary(pickle.dumps(embedding.tolist()))
+            if index is not None:
+                index.add(embeddings)
+                ids.extend(str(item["_id"]) for item in batch)
+        sink.write("items", batch)
+        counts["items"] += len(batch)
+        if progress:
+            progress("items", counts["items"], items)
+
+    for collection, total, make in (
+        ("users", users, lambda start, count: generate_users(start, count, store_names, seed)),
+        ("recipes", recipes, lambda start, count: generate_recipes(start, count, seed)),
+    ):
+        sink.reset(collection)
+        for start in range(0, total, batch_size):
+            batch = make(start, min(batch_size, total - start))
+            sink.write(collection, batch)
+            counts[collection] += len(batch)
+            if progress:
+                progress(collection, counts[collection], total)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate seeded synthetic data for load and scaling tests.")
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--stores", type=int, default=10)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--recipes", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=SYNTHETIC_BATCH_SIZE)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--mongo-uri", help="insert into this MongoDB (the collections must be empty, see --drop)")
+    target.add_argument("--output-dir", help="write <collection>.jsonl files here instead")
+    parser.add_argument("--db", default=SYNTHETIC_DB, help="database name with --mongo-uri")
+    parser.add_argument("--drop", action="store_true", help="with --mongo-uri, empty collections that hold documents first")
+    parser.add_argument("--compress", action="store_true", help="gzip the output files")
+    parser.add_argument("--no-embeddings", action="store_true", help="skip item embeddings and the FAISS index")
+    parser.add_argument("--index-file", help=f"FAISS index path (default: faiss_index_file.index in --output-dir or {SYNTHETIC_INDEX_DIR}/)")
+    parser.add_argument("--ids-file", help="FAISS ids path (default: ids_list.pkl next to the index)")
+    args = parser.parse_args(argv)
+
+    if args.stores < 1:
+        parser.error("--stores must be at least 1")
+
+    index_file = args.index_file or os.path.join(args.output_dir or SYNTHETIC_INDEX_DIR, "faiss_index_file.index")
+    ids_file = args.ids_file or os.path.join(os.path.dirname(index_file), "ids_list.pkl")
+    serving_files = {os.path.abspath(os.getenv(name, default)) for name, default in
+                     (("FAISS_INDEX_FILE", "faiss_index_file.index"), ("FAISS_IDS_FILE", "ids_list.pkl"))}
+    if not args.no_embeddings and serving_files & {os.path.abspath(index_file), os.path.abspath(ids_file)}:
+        parser.error("the FAISS index would overwrite the files the API serves; pick another --index-file/--ids-file")
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        sink = MongoSink(MongoClient(args.mongo_uri)[args.db], args.drop)
+        existing = sink.non_empty()
+        if existing and not args.drop:
+            parser.error(f"{', '.join(existing)} in {args.db} already hold documents; pass --drop to empty them first")
+    else:
+        sink = FileSink(args.output_dir, args.compress)
+
+    encoder = index = ids = None
+    if not args.no_embeddings:
+        encoder = HashingEncoder()
+        index, ids = faiss.IndexFlatL2(encoder.get_sentence_embedding_dimension()), []
+    # The files carry the index instead of per-document embeddings, which would dominate their size
+    embed_documents = bool(args.mongo_uri)
+
+    started = time.perf_counter()
+    reported = {}
+
+    def progress(collection, done, total):
+        if done == total or done - reported.get(collection, 0) >= 100_000:
+            reported[collection] = done
+            print(f"{collection}: {done}/{total} ({time.perf_counter() - started:.1f}s)")
+
+    try:
+        counts = generate(sink, args.items, args.stores, args.users, args.recipes, args.seed, args.batch_size,
+                          encoder, embed_documents, index, ids, progress)
+    finally:
+        sink.close()
+
+    if args.mongo_uri:
+        from indexes import ensure_indexes
+        ensure_indexes(sink.db)
+    if index is not None and ids:
+        os.makedirs(os.path.dirname(index_file) or ".", exist_ok=True)
+        save_index_atomically(index, ids, index_file, ids_file)
+        print(f"FAISS index of {index.ntotal} items written to {index_file} and {ids_file}.")
+    print(", ".join(f"{count} {collection}" for collection, count in counts.items())
+          + f" in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
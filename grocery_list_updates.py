@@ -0,0 +1,255 @@
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+
+class GroceryListUpdateError(Exception):
+    """
+    Raised when an item mutation cannot be applied. `status_code` maps onto the HTTP response.
+    """
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+# Top-level fields of grocery lists and meal plans that are not store sections
+RESERVED_FIELDS = {
+    "_id", "user_id", "list_name", "created_at", "updated_at", "version",
+    "grocery_list", "recipes", "recipe_ids", "total_cost", "over_budget", "left_out", "unmatched",
+}
+
+
+def validate_store_name(store):
+    # Store names are used as top-level field names in the grocery list document
+    if not store or store.startswith("$") or "." in store or store in RESERVED_FIELDS:
+        raise GroceryListUpdateError(400, f"Invalid store name '{store}'")
+    return store
+
+
+def _is_store_section(path):
+    return {"$and": [
+        {"$eq": [{"$type": path}, "object"]},
+        {"$eq": [{"$type": path + ".items"}, "array"]},
+    ]}
+
+
+def store_section_filter(store):
+    """
+    Filter that only matches lists where `store` is a store section or not set yet, so an
+    add never lands on some other field of the document.
+    """
+    return {"$expr": {"$or": [
+        {"$eq": [{"$type": "$" + store}, "missing"]},
+        _is_store_section("$" + store),
+    ]}}
+
+
+def _map_store_lists(new_items, store=None):
+    """
+    Pipeline stage that rewrites the `items` array of every store section
+    ({"items": [...], "Total_Cost": ...}) of the list, or of one store only.
+    `new_items(items_expr)` returns the expression for the new array.
+    """
+    is_store_section = _is_store_section("$$entry.v")
+    if store:
+        is_store_section = {"$and": [is_store_section, {"$eq": ["$$entry.k", {"$literal": store}]}]}
+
+    return {"$replaceWith": {"$arrayToObject": {"$map": {
+        "input": {"$objectToArray": "$$ROOT"},
+        "as": "entry",
+        "in": {"$cond": [
+            is_store_section,
+            {"k": "$$entry.k", "v": {"$mergeObjects": ["$$entry.v", {"items": new_items("$$entry.v.items")}]}},
+            "$$entry",
+        ]},
+    }}}}
+
+
+def add_item_stages(store, item):
+    store = validate_store_name(store)
+    return [
+        # Create the store section if this list has no items from that store yet
+        {"$set": {store: {"$ifNull": ["$" + store, {"items": [], "Total_Cost": 0}]}}},
+        _map_store_lists(lambda items: {"$concatArrays": [items, [{"$literal": item}]]}, store),
+    ]
+
+
+def remove_item_stages(item_name, store=None):
+    if store:
+        validate_store_name(store)
+    return [_map_store_lists(
+        lambda items: {"$filter": {
+            "input": items,
+            "as": "item",
+            "cond": {"$ne": ["$$item.Item_name", {"$literal": item_name}]},
+        }},
+        store,
+    )]
+
+
+def update_item_stages(item_name, changes, store=None):
+    if store:
+        validate_store_name(store)
+    return [_map_store_lists(
+        lambda items: {"$map": {
+            "input": items,
+            "as": "item",
+            "in": {"$cond": [
+                {"$eq": ["$$item.Item_name", {"$literal": item_name}]},
+                {"$mergeObjects": ["$$item", {"$literal": changes}]},
+                "$$item",
+            ]},
+        }},
+        store,
+    )]
+
+
+def recompute_totals_stages():
+    # Totals are summed server-side from the items that are actually in the list
+    return [
+        {"$replaceWith": {"$arrayToObject": {"$map": {
+            "input": {"$objectToArray": "$$ROOT"},
+            "as": "entry",
+            "in": {"$cond": [
+                _is_store_section("$$entry.v"),
+                {"k": "$$entry.k", "v": {"$mergeObjects": [
+                    "$$entry.v",
+                    {"Total_Cost": {"$round": [{"$sum": "$$entry.v.items.Price"}, 2]}},
+                ]}},
+                "$$entry",
+            ]},
+        }}}},
+        {"$set": {
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+            "updated_at": "$$NOW",
+        }},
+    ]
+
+
+def item_present_filter(item_name, store=None):
+    """
+    Filter that only matches lists containing the item (in `store`, or in any store).
+    """
+    if store:
+        return {f"{store}.items.Item_name": item_name}
+    return {"$expr": {"$anyElementTrue": [{"$map": {
+        "input": {"$objectToArray": "$$ROOT"},
+        "as": "entry",
+        "in": {"$in": [{"$literal": item_name}, {"$ifNull": ["$$entry.v.items.Item_name", []]}]},
+    }}]}}
+
+
+def build_update(operations):
+    """
+    Turn a list of operations into one update pipeline and the extra filters it needs.
+    Operations look like:
+      {"op": "add", "store": ..., "item": {"Item_name": ..., "Price": ...}}
+      {"op": "remove", "item_name": ..., "store": optional}
+      {"op": "update", "item_name": ..., "changes": {...}, "store": optional}
+
+    The filters check the list as it is before the update, so an item added (or renamed to)
+    earlier in the same batch needs no presence filter, and one removed (or renamed away)
+    earlier in the batch cannot be updated or removed again (400).
+    """
+    pipeline = []
+    filters = []
+    # (store, item name) in the list, or gone from it, at this point of the batch; a None
+    # store means "in some store" for `present` and "from every store" for `removed`
+    present = set()
+    removed = set()
+
+    def is_present(item_name, store):
+        return any(name == item_name and (store is None or entry_store == store) for entry_store, name in present)
+
+    def is_removed(item_name, store):
+        return (None, item_name) in removed or (store, item_name) in removed
+
+    for operation in operations:
+        op = operation.get("op")
+        store = operation.get("store")
+        if op == "add":
+            item_name = operation["item"].get("Item_name")
+            pipeline.extend(add_item_stages(store, operation["item"]))
+            filters.append(store_section_filter(store))
+            present.add((store, item_name))
+            continue
+        if op not in ("remove", "update"):
+            raise GroceryListUpdateError(400, f"Unknown operation '{op}'")
+
+        item_name = operation["item_name"]
+        if not is_present(item_name, store):
+            if is_removed(item_name, store):
+                raise GroceryListUpdateError(400, f"Item '{item_name}' is removed earlier in this batch")
+            filters.append(item_present_filter(item_name, store))
+        if op == "remove":
+            pipeline.extend(remove_item_stages(item_name, store))
+            present = {entry for entry in present if entry[1] != item_name or (store is not None and entry[0] != store)}
+            removed.add((store, item_name))
+        else:
+            changes = operation.get("changes") or {}
+            if not changes:
+                raise GroceryListUpdateError(400, "Nothing to update")
+            pipeline.extend(update_item_stages(item_name, changes, store))
+            new_name = changes.get("Item_name")
+            if new_name and new_name != item_name:
+                renamed = {entry for entry in present if entry[1] == item_name and (store is None or entry[0] == store)}
+                present = (present - renamed) | {(entry[0], new_name) for entry in renamed} | {(store, new_name)}
+                removed.add((store, item_name))
+
+    if not pipeline:
+        raise GroceryListUpdateError(400, "No operations given")
+
+    pipeline.extend(recompute_totals_stages())
+    return pipeline, filters
+
+
+def version_filter(expected_version):
+    # Lists created before versioning have no version field, which counts as 0
+    if expected_version == 0:
+        return {"version": {"$in": [None, 0]}}
+    return {"version": expected_version}
+
+
+def apply_item_operations(collection, list_id, user_id, operations, expected_version=None):
+    """
+    Apply item operations to a grocery list as a single atomic update and return the updated list.
+    Only lists made of store sections can be edited; lists with a `grocery_list` array are rejected (400).
+    Pass `expected_version` to reject the write if the list changed since it was read.
+    """
+    if not ObjectId.is_valid(list_id):
+        raise GroceryListUpdateError(400, "Invalid list ID")
+
+    pipeline, filters = build_update(operations)
+
+    # Only store-section lists: recipe lists and meal plans keep their items in a grocery_list array
+    query = {"_id": ObjectId(list_id), "user_id": user_id, "grocery_list": {"$exists": False}}
+    if expected_version is not None:
+        query.update(version_filter(expected_version))
+    if filters:
+        query["$and"] = filters
+
+    updated = collection.find_one_and_update(query, pipeline, return_document=ReturnDocument.AFTER)
+    if updated is not None:
+        return updated
+
+    # Nothing matched: one extra read (only on the failure path) to explain why
+    existing = collection.find_one({"_id": ObjectId(list_id)}, {"user_id": 1, "version": 1})
+    if not existing:
+        raise GroceryListUpdateError(404, "Grocery list not found")
+    if str(existing.get("user_id")) != str(user_id):
+        raise GroceryListUpdateError(403, "You don't have permission to modify this list")
+    if collection.find_one({"_id": ObjectId(list_id), "grocery_list": {"$exists": True}}, {"_id": 1}):
+        raise GroceryListUpdateError(
+            400, "Items can only be edited on store-section grocery lists, not on recipe lists or meal plans"
+        )
+    if expected_version is not None and existing.get("version", 0) != expected_version:
+        raise GroceryListUpdateError(409, f"Grocery list was modified (current version {existing.get('version', 0)})")
+    stores = [operation["store"] for operation in operations if operation.get("op") == "add"]
+    if stores:
+        sections = collection.find_one({"_id": ObjectId(list_id)}, {store: 1 for store in stores}) or {}
+        for store in stores:
+            section = sections.get(store)
+            if store in sections and not (isinstance(section, dict) and isinstance(section.get("items"), list)):
+                raise GroceryListUpdateError(400, f"'{store}' is not a store section of this list")
+    raise GroceryListUpdateError(404, "Item not found in the grocery list")
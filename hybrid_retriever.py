@@ -0,0 +1,292 @@
+import os
+import re
+import math
+import logging
+import itertools
+import threading
+from collections import defaultdict
+import numpy as np
+from main import generate_embedding, generate_embeddings
+from bson.objectid import ObjectId
+from metrics import stage, counter
+import deadline
+from query_cache import query_cache, normalize_query, QueryResultCache
+
+logger = logging.getLogger(__name__)
+
+# "hybrid" fuses BM25 and FAISS results; "vector" keeps the plain FAISS search
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Skip the embedding when at least this many item names contain every query term
+LEXICAL_FAST_PATH_MIN_HITS = int(os.getenv("LEXICAL_FAST_PATH_MIN_HITS", "20"))
+# Reciprocal rank fusion constant (score = sum of 1 / (RRF_K + rank))
+RRF_K = 60
+# BM25 parameters; name terms count more than ingredient terms
+BM25_K1 = 1.2
+BM25_B = 0.75
+NAME_WEIGHT = 2
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Every retriever gets its own version, so cached rankings never outlive the index they came from
+_versions = itertools.count(1)
+
+RETRIEVALS = counter(
+    "chopnshop_retrievals_total", "Item searches by the path that answered them.", ("path",)
+)
+
+
+def tokenize(text):
+    # Lower-cased words with a plural "s" dropped, so "chips" matches "Potato Chip"
+    tokens = []
+    for token in TOKEN_PATTERN.findall(str(text).lower()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-memory inverted index over Item_name and Ingredients. Documents are identified
+    by their FAISS index position, so lexical and vector hits can be fused directly.
+    """
+
+    def __init__(self, documents, size):
+        """
+        documents: iterable of (position, item_name, ingredients); size: number of FAISS positions.
+        """
+        self.size = size
+        term_counts = defaultdict(dict)
+        name_postings = defaultdict(list)
+        lengths = np.zeros(size, dtype=np.float32)
+
+        for position, name, ingredients in documents:
+            counts = defaultdict(float)
+            name_tokens = tokenize(name)
+            for token in name_tokens:
+                counts[token] += NAME_WEIGHT
+            for ingredient in ingredients or []:
+                for token in tokenize(ingredient):
+                    counts[token] += 1
+            for token in set(name_tokens):
+                name_postings[token].append(position)
+            for token, count in counts.items():
+                term_counts[token][position] = count
+            lengths[position] = sum(counts.values())
+
+        self.document_count = int(np.count_nonzero(lengths))
+        average_length = lengths.sum() / max(self.document_count, 1)
+
+        # Term weights are static, so each posting stores its final BM25 contribution
+        self.postings = {}
+        for token, documents_tf in term_counts.items():
+            positions = np.fromiter(documents_tf.keys(), dtype=np.int64, count=len(documents_tf))
+            tf = np.fromiter(documents_tf.values(), dtype=np.float32, count=len(documents_tf))
+            idf = math.log(1 + (self.document_count - len(positions) + 0.5) / (len(positions) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[positions] / average_length)
+            self.postings[token] = (positions, (idf * tf * (BM25_K1 + 1) / (tf + norm)).astype(np.float32))
+        self.name_postings = {token: np.array(sorted(positions), dtype=np.int64)
+                              for token, positions in name_postings.items()}
+
+    def search(self, query, k):
+        """
+        Returns (positions, scores) of the best k documents, best first.
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is not None:
+                np.add.at(scores, posting[0], posting[1])
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = np.argsort(-scores[candidates], kind="stable")
+        return candidates[order], scores[candidates[order]]
+
+    def name_matches(self, query):
+        """
+        Positions of items whose name contains every query term.
+        """
+        tokens = set(tokenize(query))
+        if not tokens:
+            return np.zeros(0, dtype=np.int64)
+        matches = None
+        for token in tokens:
+            positions = self.name_postings.get(token)
+            if positions is None:
+                return np.zeros(0, dtype=np.int64)
+            matches = positions if matches is None else np.intersect1d(matches, positions, assume_unique=True)
+        return matches
+
+
+def reciprocal_rank_fusion(rankings, k):
+    """
+    Returns the fused positions and their RRF scores, best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            scores[int(position)] += 1.0 / (RRF_K + rank + 1)
+    fused = sorted(scores, key=scores.get, reverse=True)[:k]
+    return np.array(fused, dtype=np.int64), np.array([scores[position] for position in fused], dtype=np.float32)
+
+
+class HybridRetriever:
+    """
+    Ranks FAISS positions for a query. A query whose terms all appear in enough item
+    names is answered from the BM25 index alone; otherwise BM25 and FAISS rankings
+    are merged with reciprocal rank fusion. The lexical index is built from the
+    catalog on first use. Rankings are cached per normalized query (see query_cache.py).
+    """
+
+    def __init__(self, index, ids, items_collection, mode=RETRIEVAL_MODE,
+                 fast_path_min_hits=LEXICAL_FAST_PATH_MIN_HITS, cache=query_cache):
+        self.index = index
+        self.ids = ids
+        self.items_collection = items_collection
+        self.mode = mode
+        self.fast_path_min_hits = fast_path_min_hits
+        self.cache = cache
+        self.version = next(_versions)
+        self._lexical = None
+        self._lock = threading.Lock()
+
+    @property
+    def index_version(self):
+        # Appending to the index (ntotal changes) invalidates cached rankings as well
+        return (self.version, self.index.ntotal)
+
+    @property
+    def lexical(self):
+        if self._lexical is None:
+            with self._lock:
+                if self._lexical is None:
+                    self._lexical = self._build_lexical()
+        return self._lexical
+
+    def _build_lexical(self):
+        positions = {item_id: position for position, item_id in enumerate(self.ids)}
+        cursor = self.items_collection.find({}, {"Item_name": 1, "Ingredients": 1})
+        documents = (
+            (positions[str(item["_id"])], item.get("Item_name", ""), item.get("Ingredients"))
+            for item in cursor if str(item["_id"]) in positions
+        )
+        lexical = BM25Index(documents, len(self.ids))
+        logger.info("BM25 index built over %d items and %d terms.", lexical.document_count, len(lexical.postings))
+        return lexical
+
+    def _vector_rankings(self, embeddings, k):
+        deadline.check("faiss_search")
+        with stage("faiss_search"):
+            distances, indices = self.index.search(np.asarray(embeddings, dtype=np.float32), k)
+        rankings = []
+        for row_distances, row in zip(distances, indices):
+            valid = (row >= 0) & (row < len(self.ids))
+            rankings.append((row[valid], row_distances[valid]))
+        return rankings
+
+    def _lexical_ranking(self, query, k):
+        """
+        Returns the BM25 ranking (positions, scores), and whether it is confident
+        enough to skip the vector search.
+        """
+        with stage("lexical_search"):
+            positions, scores = self.lexical.search(query, k)
+            matches = self.lexical.name_matches(query)
+        if len(matches) < self.fast_path_min_hits:
+            return (positions, scores), False
+        # Items naming every term first (in BM25 order), then the other lexical hits
+        full = np.isin(positions, matches)
+        order = np.concatenate([np.flatnonzero(full), np.flatnonzero(~full)])[:k]
+        return (positions[order], scores[order]), True
+
+    def _cache_key(self, query, k):
+        return QueryResultCache.key(query, k, self.mode, self.index_version)
+
+    def search(self, query, k=100):
+        """
+        FAISS positions of the best k items for one query, best first.
+        """
+        query = normalize_query(query)
+        key = self._cache_key(query, k)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached[0]
+
+        ranking = self._rank(query, k)
+        if ranking is None:
+            return np.zeros(0, dtype=np.int64)
+        self.cache.put(key, *ranking)
+        return ranking[0]
+
+    def _rank(self, query, k):
+        if self.mode == "vector":
+            RETRIEVALS.inc("vector")
+            embedding = generate_embedding(query)
+            if embedding is None:
+                return None
+            return self._vector_rankings([embedding], k)[0]
+
+        lexical, confident = self._lexical_ranking(query, k)
+        if confident:
+            RETRIEVALS.inc("lexical")
+            return lexical
+        embedding = generate_embedding(query)
+        if embedding is None:
+            # Not cached: the next request should try the embedding again
+            RETRIEVALS.inc("lexical")
+            return None if len(lexical[0]) == 0 else lexical
+        RETRIEVALS.inc("hybrid")
+        return reciprocal_rank_fusion([self._vector_rankings([embedding], k)[0][0], lexical[0]], k)
+
+    def search_many(self, queries, k=100):
+        """
+        Like search for every distinct query, with a single batched embedding and FAISS
+        call for the queries neither the cache nor the lexical index can answer.
+        Returns a dict of query -> positions, keyed by the queries as given.
+        """
+        normalized = {query: normalize_query(query) for query in dict.fromkeys(queries)}
+        rankings = {}
+        lexical = {}
+        pending = []
+        for query in dict.fromkeys(normalized.values()):
+            cached = self.cache.get(self._cache_key(query, k))
+            if cached is not None:
+                rankings[query] = cached[0]
+                continue
+            if self.mode == "vector":
+                pending.append(query)
+                continue
+            lexical[query], confident = self._lexical_ranking(query, k)
+            if confident:
+                RETRIEVALS.inc("lexical")
+                self.cache.put(self._cache_key(query, k), *lexical[query])
+                rankings[query] = lexical[query][0]
+            else:
+                pending.append(query)
+
+        if pending:
+            embeddings = generate_embeddings(pending)
+            if embeddings is None:
+                raise ValueError("Failed to generate embeddings for the grocery item queries.")
+            for query, ranking in zip(pending, self._vector_rankings(embeddings, k)):
+                if self.mode == "vector":
+                    RETRIEVALS.inc("vector")
+                else:
+                    RETRIEVALS.inc("hybrid")
+                    ranking = reciprocal_rank_fusion([ranking[0], lexical[query][0]], k)
+                self.cache.put(self._cache_key(query, k), *ranking)
+                rankings[query] = ranking[0]
+        return {query: rankings[normalized[query]] for query in normalized}
+
+    def hydrate(self, positions, projection=None):
+        """
+        Load the items at the given positions with one $in query, in rank order.
+        """
+        object_ids = [ObjectId(self.ids[position]) for position in positions]
+        if not object_ids:
+            return []
+        projection = projection or {"embedding": 0}
+        with deadline.mongo_timeout("hydrate"):
+            found = {item["_id"]: item for item in self.items_collection.find({"_id": {"$in": object_ids}}, projection)}
+        return [found[object_id] for object_id in object_ids if object_id in found]
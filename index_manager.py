@@ -0,0 +1,308 @@
+"""
+Versioned FAISS index + ID map with zero-downtime reloads.
+
+Searches take a handle on the active version for the duration of one search and
+hydration:
+
+    with index_manager.acquire() as version:
+        positions = version.retriever.search(query, k=100)
+        items = version.retriever.hydrate(positions)
+
+A reload (admin endpoint or file watcher) loads and validates the new files on its
+own thread, then swaps the active version under a lock. In-flight searches keep
+using the version they acquired; a retired version is released once its last
+reader is done.
+"""
+import os
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import faiss
+from metrics import REGISTRY, counter, gauge
+
+logger = logging.getLogger(__name__)
+
+# Poll interval of the index file watcher (0 turns the watcher off)
+INDEX_WATCH_SECONDS = float(os.getenv("INDEX_WATCH_SECONDS", "10"))
+CHECKSUM_SUFFIX = ".sha256"
+CHECKSUM_CHUNK_BYTES = 1 << 20
+
+RELOADS = counter("chopnshop_index_reloads_total", "FAISS index reload attempts by outcome.", ("result",))
+INDEX_SIZE = gauge("chopnshop_index_vectors", "Vectors in the active FAISS index.")
+INDEX_VERSION = gauge("chopnshop_index_version", "Version number of the active FAISS index.")
+RETIRING_VERSIONS = gauge("chopnshop_index_retiring_versions", "Replaced index versions still held by searches.")
+
+
+class IndexValidationError(ValueError):
+    pass
+
+
+def file_checksum(*paths):
+    """
+    SHA-256 over the contents of the given files, in order.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_BYTES), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checksum_path(index_file):
+    return index_file + CHECKSUM_SUFFIX
+
+
+def write_checksum(index_file, ids_file):
+    """
+    Record the checksum of an index and ID map next to the index; written last by the
+    index writers, so a reload can tell a complete pair from one that is mid-replace.
+    """
+    with open(checksum_path(index_file) + ".tmp", "w") as f:
+        f.write(file_checksum(index_file, ids_file) + "\n")
+    os.replace(checksum_path(index_file) + ".tmp", checksum_path(index_file))
+
+
+class IndexVersion:
+    """
+    One loaded index, its ID map and the retriever over them. `version` is the
+    retriever's version, so query cache entries are scoped to it.
+    """
+
+    def __init__(self, index, ids, retriever, checksum, index_file, ids_file):
+        self.index = index
+        self.ids = ids
+        self.retriever = retriever
+        self.version = retriever.version
+        self.checksum = checksum
+        self.index_file = index_file
+        self.ids_file = ids_file
+        self.loaded_at = datetime.utcnow()
+        self.readers = 0
+        self.retired = False
+
+    def status(self):
+        return {
+            "version": self.version,
+            "vectors": self.index.ntotal if self.index is not None else None,
+            "dimension": self.index.d if self.index is not None else None,
+            "checksum": self.checksum,
+            "index_file": self.index_file,
+            "ids_file": self.ids_file,
+            "loaded_at": self.loaded_at.isoformat(),
+            "readers": self.readers,
+        }
+
+    def _release_memory(self):
+        self.index = None
+        self.ids = None
+        self.retriever = None
+
+
+def load_index_version(index_file, ids_file, items_collection, dimension=None, read_index=faiss.read_index,
+                       warm=True, verify_checksum=True):
+    """
+    Load and validate an index and its ID map. Raises IndexValidationError when the
+    dimension, size or (with verify_checksum) recorded checksum does not match.
+    """
+    # Imported here so the index writers can use the checksum helpers without loading the model
+    from hybrid_retriever import HybridRetriever
+
+    checksum = file_checksum(index_file, ids_file) if verify_checksum else None
+    if checksum is not None and os.path.exists(checksum_path(index_file)):
+        with open(checksum_path(index_file)) as f:
+            expected = f.read().strip()
+        if expected != checksum:
+            raise IndexValidationError(f"Checksum mismatch for {index_file}: expected {expected}, got {checksum}")
+
+    index = read_index(index_file)
+    with open(ids_file, "rb") as f:
+        ids = pickle.load(f)
+    if dimension is not None and index.d != dimension:
+        raise IndexValidationError(f"Index dimension {index.d} does not match the embedding dimension {dimension}")
+    if index.ntotal != len(ids):
+        raise IndexValidationError(f"Index holds {index.ntotal} vectors but the ID map has {len(ids)} entries")
+    if index.ntotal == 0:
+        raise IndexValidationError(f"{index_file} is empty")
+
+    retriever = HybridRetriever(index, ids, items_collection)
+    if warm and retriever.mode != "vector":
+        # Build the lexical index before the swap, not on the first search after it
+        retriever.lexical
+    return IndexVersion(index, ids, retriever, checksum, index_file, ids_file)
+
+
+class IndexManager:
+    """
+    Holds the active IndexVersion and swaps in reloaded ones.
+    """
+
+    def __init__(self, index_file, ids_file, items_collection, dimension=None, watch_seconds=INDEX_WATCH_SECONDS):
+        self.index_file = index_file
+        self.ids_file = ids_file
+        self.items_collection = items_collection
+        self.dimension = dimension
+        self.watch_seconds = watch_seconds
+        self.last_error = None
+        self.last_reload_at = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._retiring = []
+        self._watcher = None
+        self._pid = None
+        # Loaded on first use: the API does that at start-up, so a broken index still fails it
+        # loudly, and processes that bring their own retriever (precompute workers) never read it
+        self._active = None
+        self._signature = None
+        REGISTRY.register_collector(self._collect_metrics)
+
+    def _ensure_loaded(self):
+        if self._active is not None:
+            return
+        with self._load_lock:
+            if self._active is None:
+                signature = self._file_signature()
+                # Warmed like a reload: the BM25 build scans the whole items collection, which
+                # must not happen inside the first search request
+                self._active = load_index_version(self.index_file, self.ids_file, self.items_collection, self.dimension)
+                self._signature = signature
+
+    @property
+    def active(self):
+        self._ensure_loaded()
+        return self._active
+
+    @property
+    def index_version(self):
+        return self.active.retriever.index_version
+
+    @contextmanager
+    def acquire(self):
+        """
+        The active version, kept alive until the block exits even if a reload replaces it.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            version = self._active
+            version.readers += 1
+        try:
+            yield version
+        finally:
+            self._release(version)
+
+    def _release(self, version):
+        with self._lock:
+            version.readers -= 1
+            drained = version.retired and version.readers == 0
+            if drained:
+                self._retiring.remove(version)
+        if drained:
+            version._release_memory()
+            logger.info("Index version %d released.", version.version)
+
+    def reload(self, force=False):
+        """
+        Load the index files into a new version and make it active. Returns True when
+        the active version changed, False when the files are unchanged (unless
+        `force`) or another reload is already running. Raises when the new files
+        fail to load or validate; the active version stays in place.
+        """
+        self._ensure_loaded()
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            signature = self._file_signature()
+            started = time.perf_counter()
+            try:
+                candidate = load_index_version(self.index_file, self.ids_file, self.items_collection, self.dimension)
+            except Exception as e:
+                RELOADS.inc("failed")
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            self.last_error = None
+            self.last_reload_at = datetime.utcnow()
+            self._signature = signature
+            if candidate.checksum == self._active.checksum and not force:
+                RELOADS.inc("unchanged")
+                return False
+
+            with self._lock:
+                previous, self._active = self._active, candidate
+                previous.retired = True
+                drained = previous.readers == 0
+                if not drained:
+                    self._retiring.append(previous)
+            if drained:
+                previous._release_memory()
+            RELOADS.inc("swapped")
+            logger.info("Index version %d (%d vectors) replaced version %d in %.1fs.",
+                        candidate.version, candidate.index.ntotal, previous.version, time.perf_counter() - started)
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def status(self):
+        self._ensure_loaded()
+        with self._lock:
+            return {
+                "active": self._active.status(),
+                "retiring": [version.status() for version in self._retiring],
+                "index_version": list(self.index_version),
+                "last_reload_at": self.last_reload_at.isoformat() if self.last_reload_at else None,
+                "last_error": self.last_error,
+                "watching": self._watcher is not None and self._watcher.is_alive() and self._pid == os.getpid(),
+            }
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.index_file, self.ids_file, checksum_path(self.index_file)):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def start_watching(self):
+        # Started on demand, and again in a forked child (threads do not survive fork)
+        if self.watch_seconds <= 0:
+            return
+        if self._watcher is not None and self._watcher.is_alive() and self._pid == os.getpid():
+            return
+        self._ensure_loaded()
+        self._pid = os.getpid()
+        self._watcher = threading.Thread(target=self._watch, name="index-watcher", daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        pending = None
+        while True:
+            time.sleep(self.watch_seconds)
+            signature = self._file_signature()
+            if signature == self._signature:
+                pending = None
+                continue
+            # Reload only once the files have stopped changing for a full interval
+            if signature != pending:
+                pending = signature
+                continue
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error("Error reloading the FAISS index: %s", e)
+                # Do not retry the same broken files until they change again
+                self._signature = signature
+            pending = None
+
+    def _collect_metrics(self):
+        active = self._active
+        if active is None:
+            return
+        INDEX_SIZE.set(active.index.ntotal)
+        INDEX_VERSION.set(active.version)
+        RETIRING_VERSIONS.set(len(self._retiring))
@@ -0,0 +1,266 @@
+import os
+import sys
+import argparse
+from collections import namedtuple
+import pymongo
+from pymongo import IndexModel, ASCENDING
+from pymongo.errors import OperationFailure
+from bson import ObjectId
+from dotenv import load_dotenv
+
+# Name of the partial index that covers every item with an embedding.
+# build_faiss_index hints it so the scan only touches embedded items.
+ITEMS_WITH_EMBEDDING_INDEX = "items_with_embedding"
+
+# One item per (Item_name, Store_name): ingest_catalog.py upserts on this key
+ITEMS_NAME_STORE_INDEX = "items_name_store"
+
+# Index definitions for every collection the API queries
+INDEXES = {
+    "users": [
+        # Login and registration look users up by email; emails must be unique
+        IndexModel(
+            [("email", ASCENDING)],
+            name="users_email_unique",
+            unique=True,
+            partialFilterExpression={"email": {"$exists": True}},
+        ),
+    ],
+    "grocery_lists": [
+        # /grocery_lists pages through a user's lists in _id order
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="grocery_lists_user_id"),
+        IndexModel([("user_id", ASCENDING), ("list_name", ASCENDING)], name="grocery_lists_user_id_list_name"),
+        # /recipe_lists/ looks lists up by name only
+        IndexModel([("list_name", ASCENDING)], name="grocery_lists_list_name"),
+    ],
+    "suggested_grocery_lists": [
+        # One precomputed suggestion per user, upserted by precompute_grocery_lists.py
+        IndexModel([("user_id", ASCENDING)], name="suggested_grocery_lists_user_id_unique", unique=True),
+    ],
+    "recipes": [
+        IndexModel([("name", ASCENDING)], name="recipes_name"),
+        # A user can only save one recipe per name (generated recipes have no user_id)
+        IndexModel(
+            [("user_id", ASCENDING), ("name", ASCENDING)],
+            name="recipes_user_id_name_unique",
+            unique=True,
+            partialFilterExpression={"user_id": {"$exists": True}},
+        ),
+    ],
+    "items": [
+        IndexModel(
+            [("Item_name", ASCENDING)],
+            name=ITEMS_WITH_EMBEDDING_INDEX,
+            partialFilterExpression={"embedding": {"$exists": True}},
+        ),
+        # ingest_catalog.py upserts items by name and store; concurrent upserts must not duplicate an item
+        IndexModel([("Item_name", ASCENDING), ("Store_name", ASCENDING)], name=ITEMS_NAME_STORE_INDEX, unique=True),
+        # /items/{item_id}/equivalents looks up the other items of a product group (set by product_groups.py)
+        IndexModel(
+            [("equivalence_group", ASCENDING), ("Price", ASCENDING)],
+            name="items_equivalence_group",
+            partialFilterExpression={"equivalence_group": {"$exists": True}},
+        ),
+    ],
+}
+
+# The query shapes issued by the API routes, used to verify the query plans
+QueryShape = namedtuple("QueryShape", ["route", "collection", "filter", "sort", "hint"])
+
+# GET /recipes/{recipe_name}/ is not listed: its unanchored, case-insensitive regex has to
+# read every key of recipes_name, so no B-tree index can serve it (it needs a text index).
+
+QUERY_SHAPES = [
+    QueryShape("POST /register/", "users", {"email": "user@example.com"}, None, None),
+    QueryShape("POST /login/", "users", {"email": "user@example.com"}, None, None),
+    QueryShape("GET /grocery_lists", "grocery_lists", {"user_id": "user"}, [("_id", ASCENDING)], None),
+    QueryShape("GET /grocery_lists?list_name", "grocery_lists", {"user_id": "user", "list_name": "Weekly"}, [("_id", ASCENDING)], None),
+    QueryShape("DELETE /grocery_lists/{list_id}", "grocery_lists", {"_id": ObjectId(), "user_id": "user"}, None, None),
+    QueryShape("GET /grocery_lists/suggested", "suggested_grocery_lists", {"user_id": "user"}, None, None),
+    QueryShape("GET /recipe_lists/", "grocery_lists", {"list_name": "Weekly"}, None, None),
+    QueryShape("POST /generate_recipe_with_grocery_list", "recipes", {"name": "Cheese Pizza"}, None, None),
+    QueryShape("POST /recipes/save", "recipes", {"name": "Cheese Pizza", "user_id": "user"}, None, None),
+    QueryShape("GET /recipes/saved", "recipes", {"user_id": "user"}, [("_id", ASCENDING)], None),
+    QueryShape("GET /items/{item_id}/equivalents", "items", {"equivalence_group": str(ObjectId()), "Store_name": {"$ne": "Safeway"}}, [("Price", ASCENDING)], None),
+    QueryShape("ingest_catalog.py", "items", {"Item_name": "Almond Milk", "Store_name": "Trader Joe's"}, None, None),
+    QueryShape("build_faiss_index", "items", {"embedding": {"$exists": True}}, None, ITEMS_WITH_EMBEDDING_INDEX),
+]
+
+
+class DuplicateItemsError(Exception):
+    """
+    Raised when items_name_store cannot be made unique because items share a name and store.
+    """
+
+
+def find_duplicate_items(items_collection):
+    """
+    Item _ids that repeat an (Item_name, Store_name) of another item. Per pair the item
+    kept is the oldest one with an embedding (the one the FAISS index refers to), or
+    the oldest one.
+    """
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {"Item_name": "$Item_name", "Store_name": "$Store_name"},
+            "items": {"$push": {"_id": "$_id", "embedded": {"$cond": [{"$ifNull": ["$embedding", False]}, True, False]}}},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    duplicates = []
+    for group in items_collection.aggregate(pipeline, allowDiskUse=True):
+        items = group["items"]
+        kept = next((item for item in items if item["embedded"]), items[0])
+        duplicates.extend(item["_id"] for item in items if item is not kept)
+    return duplicates
+
+
+def dedupe_items(items_collection, batch_size=1000):
+    """
+    Delete the duplicate items found by find_duplicate_items. Returns how many were deleted.
+    """
+    duplicates = find_duplicate_items(items_collection)
+    for start in range(0, len(duplicates), batch_size):
+        items_collection.delete_many({"_id": {"$in": duplicates[start:start + batch_size]}})
+    return len(duplicates)
+
+
+def _drop_indexes_becoming_unique(collection, models):
+    # create_indexes refuses to change the options of an existing index, so an index
+    # declared unique since it was created is dropped first and rebuilt
+    existing = collection.index_information()
+    for model in models:
+        name = model.document["name"]
+        if not model.document.get("unique") or name not in existing or existing[name].get("unique"):
+            continue
+        if name == ITEMS_NAME_STORE_INDEX:
+            count = len(find_duplicate_items(collection))
+            if count:
+                raise DuplicateItemsError(
+                    f"{count} items repeat the name and store of another item; "
+                    "run `python indexes.py dedupe-items` before making items_name_store unique"
+                )
+        collection.drop_index(name)
+
+
+def ensure_indexes(db, collections=None):
+    """
+    Create the declared indexes. Safe to run repeatedly: existing indexes with
+    the same definition are left alone. Returns the index names per collection.
+    """
+    created = {}
+    for collection_name, models in INDEXES.items():
+        if collections and collection_name not in collections:
+            continue
+        _drop_indexes_becoming_unique(db[collection_name], models)
+        created[collection_name] = db[collection_name].create_indexes(models)
+    return created
+
+
+def find_collscans(plan):
+    """
+    Walk an explain() plan tree and return every COLLSCAN stage in it.
+    """
+    found = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            found.append(plan)
+        for value in plan.values():
+            found.extend(find_collscans(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            found.extend(find_collscans(value))
+    return found
+
+
+# Index bounds that cover every value of a field: an IXSCAN with them on the leading
+# field reads every key, which costs as much as a collection scan
+FULL_RANGE_BOUNDS = ("[MinKey, MaxKey]", '["", {})')
+
+
+def find_full_index_scans(plan):
+    """
+    Walk an explain() plan tree and return every IXSCAN stage whose leading field is unbounded
+    (e.g. an unanchored or case-insensitive $regex, or a sort-only index walk). Partial
+    indexes are exempt: walking one reads only the documents its filter selects.
+    """
+    found = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "IXSCAN" and not plan.get("isPartial"):
+            leading_field = next(iter(plan.get("keyPattern", {})), None)
+            bounds = plan.get("indexBounds", {}).get(leading_field, [])
+            if any(bound in FULL_RANGE_BOUNDS for bound in bounds):
+                found.append(plan)
+        for value in plan.values():
+            found.extend(find_full_index_scans(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            found.extend(find_full_index_scans(value))
+    return found
+
+
+def explain_shape(db, shape):
+    cursor = db[shape.collection].find(shape.filter)
+    if shape.sort:
+        cursor = cursor.sort(shape.sort)
+    if shape.hint:
+        cursor = cursor.hint(shape.hint)
+    return cursor.explain()
+
+
+def check_query_plans(db, shapes=QUERY_SHAPES):
+    """
+    Explain every route's query shape and return (shape, problem) for each one whose
+    winning plan scans the whole collection or a whole index.
+    """
+    failures = []
+    for shape in shapes:
+        explanation = explain_shape(db, shape)
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        if find_collscans(winning_plan):
+            failures.append((shape, "COLLSCAN"))
+        elif find_full_index_scans(winning_plan):
+            failures.append((shape, "full index scan"))
+    return failures
+
+
+def main(argv=None):
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description="Manage the Chop N' Shop MongoDB indexes.")
+    parser.add_argument("command", choices=["ensure", "check", "dedupe-items"],
+                        help="create the indexes, verify the query plans, or delete duplicate items and create the indexes")
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI") or "mongodb://localhost:27017")
+    parser.add_argument("--db", default="chop-n-shop")
+    args = parser.parse_args(argv)
+
+    client = pymongo.MongoClient(args.uri)
+    db = client[args.db]
+
+    if args.command == "dedupe-items":
+        print(f"Deleted {dedupe_items(db['items'])} duplicate items.")
+
+    try:
+        created = ensure_indexes(db)
+    except DuplicateItemsError as e:
+        print(e)
+        return 1
+    except OperationFailure as e:
+        print(f"Error creating indexes: {e}")
+        return 1
+    for collection_name, names in created.items():
+        print(f"{collection_name}: {', '.join(names)}")
+
+    if args.command == "check":
+        failures = check_query_plans(db)
+        for shape, problem in failures:
+            print(f"{problem}: {shape.route} on {shape.collection} with filter {shape.filter}")
+        if failures:
+            return 1
+        print(f"All {len(QUERY_SHAPES)} query shapes use a bounded index scan.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,329 @@
+"""
+Load a store price feed into the items collection:
+
+    python ingest_catalog.py feed.csv
+    python ingest_catalog.py feed.jsonl.gz --store "Trader Joe's" --batch-size 10000
+
+Rows are streamed in batches, so memory stays bounded by the batch size (plus the FAISS index).
+Each batch is upserted by (Item_name, Store_name) with one unordered bulk_write; upserts that
+lose a race with another writer inserting the same item are retried as updates. Only names
+without a stored embedding are embedded, and those embeddings are appended to the FAISS
+index, which is saved once at the end.
+"""
+import os
+import re
+import csv
+import sys
+import gzip
+import json
+import time
+import pickle
+import argparse
+from itertools import islice
+import faiss
+import numpy as np
+from bson.binary import Binary
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from index_manager import write_checksum
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+PROGRESS_EVERY_ROWS = 100_000
+# Rounds of retrying upserts rejected by the unique (Item_name, Store_name) index
+UPSERT_RETRIES = 3
+DUPLICATE_KEY = 11000
+
+# Feed column -> items field; feeds use a mix of spellings
+FIELD_ALIASES = {
+    "item_name": "Item_name", "name": "Item_name", "product": "Item_name", "product_name": "Item_name",
+    "store_name": "Store_name", "store": "Store_name",
+    "price": "Price",
+    "ingredients": "Ingredients",
+    "category": "Category",
+    "calories": "Calories",
+}
+
+# Quantities and notes that are not part of the ingredient, e.g. "sugar (organic)" or "salt, 2%"
+INGREDIENT_NOISE = re.compile(r"\([^)]*\)|\[[^\]]*\]|\d+(\.\d+)?\s*%|\*")
+INGREDIENT_SEPARATORS = re.compile(r"[;,|]")
+
+
+class IngestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.rejected = 0
+        self.upserted = 0
+        self.modified = 0
+        self.embedded = 0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return (f"{self.rows} rows ({self.rejected} rejected), {self.upserted} new items, "
+                f"{self.modified} updated, {self.embedded} embedded in {self.elapsed:.1f}s "
+                f"({self.rows_per_second:.0f} rows/s)")
+
+
+def open_feed(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def read_rows(path, feed_format=None):
+    """
+    Stream the rows of a CSV or JSONL feed as dicts.
+    """
+    feed_format = feed_format or ("jsonl" if ".jsonl" in path or ".ndjson" in path else "csv")
+    with open_feed(path) as f:
+        if feed_format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def normalize_ingredients(value):
+    """
+    Lower-case, de-noised and de-duplicated ingredient names, from a list or a delimited string.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("["):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                value = INGREDIENT_SEPARATORS.split(value.strip("[]"))
+        else:
+            value = INGREDIENT_SEPARATORS.split(value)
+    ingredients = []
+    for ingredient in value:
+        ingredient = " ".join(INGREDIENT_NOISE.sub(" ", str(ingredient)).lower().split()).strip(" .:-")
+        if ingredient and ingredient not in ingredients:
+            ingredients.append(ingredient)
+    return ingredients
+
+
+def normalize_row(row, default_store=None):
+    """
+    Map a feed row onto the items schema. Returns None for rows without a name, store or valid price.
+    """
+    item = {}
+    for key, value in row.items():
+        field = FIELD_ALIASES.get(str(key).strip().lower())
+        if field and value not in (None, ""):
+            item[field] = value
+
+    name = " ".join(str(item.get("Item_name", "")).split())
+    store = " ".join(str(item.get("Store_name") or default_store or "").split())
+    try:
+        price = round(float(str(item.get("Price", "")).replace("$", "").replace(",", "")), 2)
+    except ValueError:
+        return None
+    if not name or not store or price < 0:
+        return None
+
+    document = {
+        "Item_name": name,
+        "Store_name": store,
+        "Price": price,
+        "Ingredients": normalize_ingredients(item.get("Ingredients")),
+    }
+    if item.get("Category"):
+        document["Category"] = str(item["Category"]).strip()
+    if item.get("Calories") not in (None, ""):
+        try:
+            document["Calories"] = int(float(item["Calories"]))
+        except ValueError:
+            pass
+    return document
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def keys_with_embeddings(items_collection, documents):
+    """
+    (Item_name, Store_name) pairs of the batch that already have an embedding.
+    """
+    names = list({document["Item_name"] for document in documents})
+    cursor = items_collection.find(
+        {"Item_name": {"$in": names}, "embedding": {"$exists": True}}, {"Item_name": 1, "Store_name": 1, "_id": 0}
+    )
+    return {(item["Item_name"], item.get("Store_name")) for item in cursor}
+
+
+def bulk_upsert(items_collection, operations):
+    """
+    Run the upserts unordered. Two writers upserting the same new item both try to insert
+    it, and the unique items_name_store index rejects the second insert (E11000); those
+    operations are run again, and then update the item the other writer inserted.
+    Returns (upserted count, modified count, {operation position: upserted _id}).
+    """
+    upserted = modified = 0
+    upserted_ids = {}
+    positions = list(range(len(operations)))
+    for attempt in range(UPSERT_RETRIES + 1):
+        try:
+            result = items_collection.bulk_write([operations[p] for p in positions], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            retry = [error["index"] for error in errors if error.get("code") == DUPLICATE_KEY]
+            if not retry or len(retry) < len(errors) or e.details.get("writeConcernErrors") or attempt == UPSERT_RETRIES:
+                raise
+            upserted += e.details.get("nUpserted", 0)
+            modified += e.details.get("nModified", 0)
+            for item in e.details.get("upserted", []):
+                upserted_ids[positions[item["index"]]] = item["_id"]
+            positions = [positions[i] for i in retry]
+            continue
+        upserted += result.upserted_count
+        modified += result.modified_count
+        for i, item_id in result.upserted_ids.items():
+            upserted_ids[positions[i]] = item_id
+        break
+    return upserted, modified, upserted_ids
+
+
+def ingest_batch(items_collection, documents, stats, encode=None, index=None, ids=None):
+    # The last row wins when a feed repeats an item within a batch
+    unique = {}
+    for document in documents:
+        unique[(document["Item_name"], document["Store_name"])] = document
+    documents = list(unique.values())
+
+    embedded = keys_with_embeddings(items_collection, documents)
+    to_embed = [document for document in documents
+                if (document["Item_name"], document["Store_name"]) not in embedded] if encode else []
+    if to_embed:
+        embeddings = encode([document["Item_name"] for document in to_embed])
+        if embeddings is None:
+            raise ValueError(f"Failed to embed {len(to_embed)} item names.")
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        for document, embedding in zip(to_embed, embeddings):
+            document["embedding"] = Binary(pickle.dumps(embedding.tolist()))
+        stats.embedded += len(to_embed)
+
+    operations = [
+        UpdateOne({"Item_name": document["Item_name"], "Store_name": document["Store_name"]},
+                  {"$set": document}, upsert=True)
+        for document in documents
+    ]
+    upserted, modified, upserted_ids = bulk_upsert(items_collection, operations)
+    stats.upserted += upserted
+    stats.modified += modified
+
+    if to_embed and index is not None:
+        # New items get their _id from the upsert; existing items without an embedding are looked up
+        new_ids = {}
+        for position, item_id in upserted_ids.items():
+            document = documents[position]
+            new_ids[(document["Item_name"], document["Store_name"])] = item_id
+        missing = [document for document in to_embed if (document["Item_name"], document["Store_name"]) not in new_ids]
+        if missing:
+            cursor = items_collection.find(
+                {"Item_name": {"$in": [document["Item_name"] for document in missing]}},
+                {"Item_name": 1, "Store_name": 1},
+            )
+            for item in cursor:
+                new_ids.setdefault((item["Item_name"], item.get("Store_name")), item["_id"])
+
+        rows = [i for i, document in enumerate(to_embed) if (document["Item_name"], document["Store_name"]) in new_ids]
+        if rows:
+            index.add(embeddings[rows])
+            ids.extend(str(new_ids[(to_embed[i]["Item_name"], to_embed[i]["Store_name"])]) for i in rows)
+
+
+def ingest(rows, items_collection, encode=None, index=None, ids=None, batch_size=INGEST_BATCH_SIZE,
+           default_store=None, progress=None):
+    """
+    Normalize and upsert feed rows in batches. With `encode`, names without a stored
+    embedding are embedded; with `index` and `ids`, those embeddings are also appended
+    to the FAISS index. Returns the IngestStats.
+    """
+    stats = IngestStats()
+    next_report = PROGRESS_EVERY_ROWS
+    for batch in batched(rows, batch_size):
+        stats.rows += len(batch)
+        documents = []
+        for row in batch:
+            document = normalize_row(row, default_store)
+            if document is None:
+                stats.rejected += 1
+            else:
+                documents.append(document)
+        if documents:
+            ingest_batch(items_collection, documents, stats, encode, index, ids)
+        if progress and stats.rows >= next_report:
+            progress(stats)
+            next_report += PROGRESS_EVERY_ROWS
+    return stats
+
+
+def save_index_atomically(index, ids, index_file, ids_file):
+    # Written next to the targets and renamed, so readers never see a half-written index
+    faiss.write_index(index, index_file + ".tmp")
+    with open(ids_file + ".tmp", "wb") as f:
+        pickle.dump(ids, f)
+    os.replace(ids_file + ".tmp", ids_file)
+    os.replace(index_file + ".tmp", index_file)
+    write_checksum(index_file, ids_file)
+
+
+def main(argv=None):
+    from main import items_collection, generate_embeddings, model, load_faiss_index, FAISS_INDEX_FILE, FAISS_IDS_FILE
+    from indexes import ensure_indexes
+    from db import get_database
+
+    parser = argparse.ArgumentParser(description="Stream a CSV/JSONL price feed into the items collection.")
+    parser.add_argument("feed", help="CSV or JSONL file (optionally .gz)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    parser.add_argument("--store", help="store name for feeds without a store column")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--no-embed", action="store_true", help="only update prices and fields")
+    parser.add_argument("--no-index", action="store_true", help="do not append to the FAISS index")
+    parser.add_argument("--index-file", default=FAISS_INDEX_FILE)
+    parser.add_argument("--ids-file", default=FAISS_IDS_FILE)
+    args = parser.parse_args(argv)
+
+    ensure_indexes(get_database(), collections=["items"])
+
+    index = ids = None
+    if not args.no_embed and not args.no_index:
+        if os.path.exists(args.index_file) and os.path.exists(args.ids_file):
+            index, ids = load_faiss_index(args.index_file, args.ids_file)
+        if index is None:
+            index, ids = faiss.IndexFlatL2(model.get_sentence_embedding_dimension()), []
+    index_size = len(ids) if ids is not None else 0
+
+    stats = ingest(
+        read_rows(args.feed, args.format), items_collection,
+        encode=None if args.no_embed else generate_embeddings,
+        index=index, ids=ids, batch_size=args.batch_size, default_store=args.store,
+        progress=lambda stats: print(f"{stats.rows} rows, {stats.rows_per_second:.0f} rows/s"),
+    )
+    if index is not None and len(ids) > index_size:
+        save_index_atomically(index, ids, args.index_file, args.ids_file)
+        print(f"Appended {len(ids) - index_size} items to the FAISS index ({index.ntotal} total).")
+    print(stats.summary())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from metrics import REGISTRY, counter, gauge, histogram, stage
+from query_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# Turn the table off to run the search for every recipe ingredient on every request
+INGREDIENT_TABLE = os.getenv("INGREDIENT_TABLE", "true").lower() in ("1", "true", "yes")
+# Rebuild at least this often, so price and catalog edits that leave the index alone are picked up
+INGREDIENT_TABLE_REFRESH_SECONDS = float(os.getenv("INGREDIENT_TABLE_REFRESH_SECONDS", "300"))
+# Same search depth as the live path
+CANDIDATES_PER_INGREDIENT = 100
+# How often the background thread compares the table with the index version
+INDEX_CHECK_SECONDS = 5.0
+HYDRATE_CHUNK_SIZE = 5000
+
+# Everything the recipe list and is_item_valid read (never the embedding)
+CANDIDATE_PROJECTION = {"Item_name": 1, "Price": 1, "Store_name": 1, "Ingredients": 1, "Simplified Ingredients": 1}
+
+LOOKUPS = counter(
+    "chopnshop_ingredient_table_lookups_total", "Recipe ingredient lookups by whether the table answered them.", ("result",)
+)
+TABLE_INGREDIENTS = gauge("chopnshop_ingredient_table_ingredients", "Ingredients in the candidate table.")
+REFRESH_DURATION = histogram(
+    "chopnshop_ingredient_table_refresh_seconds", "Duration of a full candidate table rebuild.",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+REFRESH_ERRORS = counter("chopnshop_ingredient_table_refresh_errors_total", "Candidate table rebuilds that raised.")
+
+
+class IngredientCandidateTable:
+    """
+    Materialized ranking of catalog items for every distinct simplified ingredient of the
+    saved recipes. Each entry is the hydrated item plus the diets it satisfies, so building
+    a recipe list is a lookup and a scan for the first eligible item.
+
+    A background thread rebuilds the table every `refresh_seconds`, and as soon as the
+    index version changes (an index reload or append). Until then, and for
+    ingredients of recipes saved since the last build, lookups fall back to a live search
+    whose result is added to the table.
+    """
+
+    def __init__(self, indexes, recipes_collection, is_item_valid, diets,
+                 refresh_seconds=INGREDIENT_TABLE_REFRESH_SECONDS, k=CANDIDATES_PER_INGREDIENT):
+        self.indexes = indexes
+        self.recipes_collection = recipes_collection
+        self.is_item_valid = is_item_valid
+        self.diets = tuple(diets)
+        self.refresh_seconds = refresh_seconds
+        self.k = k
+        self.built_at = None
+        self._table = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        REGISTRY.register_collector(lambda: TABLE_INGREDIENTS.set(len(self._table)))
+
+    def start(self):
+        # Started lazily, and again in a forked child (threads do not survive fork)
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="ingredient-table", daemon=True)
+            self._thread.start()
+
+    def invalidate(self):
+        """
+        Drop the table and rebuild it in the background; lookups go live meanwhile.
+        """
+        self._version = None
+        self._wake.set()
+
+    @property
+    def current(self):
+        return self._version is not None and self._version == self.indexes.index_version
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                REFRESH_ERRORS.inc()
+                logger.error("Error rebuilding the ingredient candidate table: %s", e)
+            # Wake up early on invalidate() or when the index changes under the table
+            deadline = time.monotonic() + self.refresh_seconds
+            while time.monotonic() < deadline:
+                if self._wake.wait(INDEX_CHECK_SECONDS):
+                    self._wake.clear()
+                    break
+                if self._version is not None and not self.current:
+                    break
+
+    def ingredients(self):
+        return sorted({normalize_query(ingredient)
+                       for ingredient in self.recipes_collection.distinct("simplified_ingredients")
+                       if isinstance(ingredient, str) and ingredient.strip()})
+
+    def refresh(self):
+        """
+        Rebuild the whole table and swap it in.
+        """
+        started = time.perf_counter()
+        ingredients = self.ingredients()
+        with self.indexes.acquire() as handle:
+            version = handle.retriever.index_version
+            table = self._resolve(handle.retriever, ingredients)
+        with self._lock:
+            self._table = table
+            self._version = version
+            self.built_at = time.time()
+        elapsed = time.perf_counter() - started
+        REFRESH_DURATION.observe(elapsed)
+        logger.info("Ingredient candidate table built for %d ingredients in %.1fs.", len(table), elapsed)
+
+    def _resolve(self, retriever, ingredients):
+        """
+        Entries for normalized ingredients: one batched search, then hydration of the union of hits.
+        """
+        if not ingredients:
+            return {}
+        rankings = retriever.search_many(ingredients, self.k)
+        hits = np.unique(np.concatenate(list(rankings.values()))) if rankings else []
+        entries = {}
+        with stage("hydrate"):
+            for start in range(0, len(hits), HYDRATE_CHUNK_SIZE):
+                chunk = hits[start:start + HYDRATE_CHUNK_SIZE]
+                for item in retriever.hydrate(chunk, CANDIDATE_PROJECTION):
+                    entries[str(item["_id"])] = self._entry(item)
+        return {
+            ingredient: [entries[retriever.ids[position]] for position in positions if retriever.ids[position] in entries]
+            for ingredient, positions in rankings.items()
+        }
+
+    def _entry(self, item):
+        return item, frozenset(diet for diet in self.diets if self.is_item_valid(item, diet, []))
+
+    def _live(self, ingredient):
+        with self.indexes.acquire() as handle:
+            version = handle.retriever.index_version
+            positions = handle.retriever.search(ingredient, k=self.k)
+            with stage("hydrate"):
+                items = handle.retriever.hydrate(positions, CANDIDATE_PROJECTION)
+        return version, [self._entry(item) for item in items]
+
+    def candidates(self, ingredient):
+        """
+        Ranked (item, diets) entries for an ingredient, from the table when it is current.
+        """
+        if INGREDIENT_TABLE:
+            self.start()
+        ingredient = normalize_query(ingredient)
+        if self.current:
+            entries = self._table.get(ingredient)
+            if entries is not None:
+                LOOKUPS.inc("hit")
+                return entries
+        LOOKUPS.inc("miss")
+        version, entries = self._live(ingredient)
+        with self._lock:
+            if self._version == version:
+                self._table[ingredient] = entries
+        return entries
+
+    def candidates_many(self, ingredients):
+        """
+        candidates for several ingredients at once, keyed by normalized ingredient. The ones
+        the table cannot answer are resolved together, with one batched search and hydration.
+        """
+        if INGREDIENT_TABLE:
+            self.start()
+        found = {}
+        missing = []
+        current, table = self.current, self._table
+        for ingredient in dict.fromkeys(normalize_query(ingredient) for ingredient in ingredients):
+            entries = table.get(ingredient) if current else None
+            if entries is None:
+                missing.append(ingredient)
+            else:
+                found[ingredient] = entries
+        LOOKUPS.inc("hit", amount=len(found))
+        if missing:
+            LOOKUPS.inc("miss", amount=len(missing))
+            with self.indexes.acquire() as handle:
+                version = handle.retriever.index_version
+                live = self._resolve(handle.retriever, missing)
+            with self._lock:
+                if self._version == version:
+                    self._table.update(live)
+            found.update(live)
+        return found
+
+    def eligible(self, entries, dietary_preferences, allergens, store=None):
+        """
+        Items of the candidate entries that suit the diet and allergens (and store, if given), best first.
+        """
+        for item, diets in entries:
+            if store is not None and item.get("Store_name") != store:
+                continue
+            if dietary_preferences in self.diets and dietary_preferences not in diets:
+                continue
+            # Diets are settled by the flags; only the allergens are checked per request
+            if allergens and not self.is_item_valid(item, None, allergens):
+                continue
+            yield item
@@ -0,0 +1,233 @@
+"""
+Guarded access to the OpenAI chat completions API. Every call goes through:
+
+- a bulkhead: at most OPENAI_MAX_CONCURRENCY calls in flight; a caller waits up to
+  OPENAI_QUEUE_TIMEOUT_SECONDS for a slot, then gets LLMBusy instead of piling up;
+- a per-attempt timeout (OPENAI_TIMEOUT_SECONDS, or less when the request deadline is closer);
+- retries with full jitter on timeouts, connection errors, 429s and 5xx responses;
+- a circuit breaker that opens after OPENAI_BREAKER_FAILURES failed calls in a row and
+  fails fast with LLMCircuitOpen for OPENAI_BREAKER_RESET_SECONDS, then lets one probe through.
+
+Latency, outcomes and prompt/completion tokens are recorded per operation.
+
+    response = llm.chat("recipe", messages, model="gpt-3.5-turbo", max_tokens=1000)
+"""
+import os
+import time
+import random
+import logging
+import threading
+import openai
+from metrics import REGISTRY, counter, gauge, histogram, stage
+import deadline
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+# How long a call may wait for a free slot before it is rejected
+OPENAI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("OPENAI_QUEUE_TIMEOUT_SECONDS", "2"))
+# Per attempt, connect and read together
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+# Retries after the first attempt (0 turns retries off)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_RETRY_BASE_SECONDS = float(os.getenv("OPENAI_RETRY_BASE_SECONDS", "0.5"))
+OPENAI_RETRY_MAX_SECONDS = float(os.getenv("OPENAI_RETRY_MAX_SECONDS", "8"))
+# Consecutive failed calls (after their retries) that open the circuit
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+OPENAI_BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+
+RETRYABLE_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+CALLS = counter("chopnshop_llm_calls_total", "OpenAI calls by operation and outcome.", ("operation", "result"))
+ATTEMPTS = counter("chopnshop_llm_attempts_total", "OpenAI HTTP attempts by operation and outcome.", ("operation", "result"))
+CALL_DURATION = histogram(
+    "chopnshop_llm_call_seconds", "Duration of an OpenAI call, retries included.", ("operation",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+TOKENS = counter("chopnshop_llm_tokens_total", "Tokens billed by OpenAI, by operation and kind.", ("operation", "kind"))
+IN_FLIGHT = gauge("chopnshop_llm_in_flight", "OpenAI calls holding a bulkhead slot.")
+BREAKER_STATE = gauge("chopnshop_llm_circuit_open", "1 while the OpenAI circuit breaker is open or half-open.")
+
+
+class LLMUnavailable(Exception):
+    """
+    The call was not made (or given up on) to protect the service; retry later.
+    """
+    retry_after = 1
+
+
+class LLMBusy(LLMUnavailable):
+    pass
+
+
+class LLMCircuitOpen(LLMUnavailable):
+    def __init__(self, retry_after):
+        super().__init__(f"OpenAI circuit is open; retry in {retry_after:.0f}s")
+        self.retry_after = max(1, round(retry_after))
+
+
+class CircuitBreaker:
+    """
+    Closed until `failures` calls fail in a row; then open (every call is rejected) for
+    `reset_seconds`; then half-open, letting a single probe call through, whose outcome
+    closes the circuit or opens it again.
+    """
+
+    def __init__(self, failures=OPENAI_BREAKER_FAILURES, reset_seconds=OPENAI_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_seconds or self._probing:
+                raise LLMCircuitOpen(max(self.reset_seconds - waited, 1))
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("OpenAI circuit closed.")
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._probing or (self.opened_at is None and self.consecutive_failures >= self.failures):
+                if not self._probing:
+                    logger.warning("OpenAI circuit opened after %d failed calls.", self.consecutive_failures)
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        # The probe ended without telling anything about the upstream (e.g. a 400)
+        with self._lock:
+            self._probing = False
+
+
+class LLMClient:
+    def __init__(self, max_concurrency=OPENAI_MAX_CONCURRENCY, queue_timeout=OPENAI_QUEUE_TIMEOUT_SECONDS,
+                 timeout=OPENAI_TIMEOUT_SECONDS, max_retries=OPENAI_MAX_RETRIES,
+                 retry_base=OPENAI_RETRY_BASE_SECONDS, retry_max=OPENAI_RETRY_MAX_SECONDS, breaker=None):
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._client = None
+        self._pid = None
+        REGISTRY.register_collector(lambda: BREAKER_STATE.set(0 if self.breaker.state == "closed" else 1))
+
+    @property
+    def client(self):
+        # Created on first use, and again in a forked worker (the HTTP connection pool does not survive fork)
+        if self._client is None or self._pid != os.getpid():
+            # Retries are ours, so the SDK's own are off
+            self._client = openai.OpenAI(max_retries=0, timeout=self.timeout)
+            self._pid = os.getpid()
+        return self._client
+
+    def _attempt_timeout(self):
+        left = deadline.remaining()
+        if left is None:
+            return self.timeout
+        if left <= 0:
+            raise deadline.exceeded("openai")
+        return min(self.timeout, left)
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        retry_after = getattr(getattr(error, "response", None), "headers", {}).get("retry-after")
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.retry_max))
+            except ValueError:
+                pass
+        left = deadline.remaining()
+        if left is not None and delay >= left:
+            raise deadline.exceeded("openai")
+        return delay
+
+    def chat(self, operation, messages, **kwargs):
+        """
+        chat.completions.create with the bulkhead, timeouts, retries and breaker applied.
+        Raises LLMUnavailable when the call is shed, and the last OpenAI error when it failed.
+        """
+        try:
+            self.breaker.before_call()
+        except LLMCircuitOpen:
+            CALLS.inc(operation, "circuit_open")
+            raise
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.breaker.release_probe()
+            CALLS.inc(operation, "rejected")
+            raise LLMBusy(f"Too many OpenAI calls in flight; waited {self.queue_timeout}s for a slot")
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            with stage("openai"):
+                response = self._call_with_retries(operation, messages, kwargs)
+        except RETRYABLE_ERRORS:
+            self.breaker.record_failure()
+            CALLS.inc(operation, "failed")
+            raise
+        except deadline.DeadlineExceeded:
+            self.breaker.release_probe()
+            CALLS.inc(operation, "deadline")
+            raise
+        except Exception:
+            # Our request was wrong (4xx) or the response unusable; the upstream itself is fine
+            self.breaker.release_probe()
+            CALLS.inc(operation, "error")
+            raise
+        finally:
+            IN_FLIGHT.inc(amount=-1)
+            self._slots.release()
+            CALL_DURATION.observe(time.perf_counter() - started, operation)
+        self.breaker.record_success()
+        CALLS.inc(operation, "ok")
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            TOKENS.inc(operation, "prompt", amount=usage.prompt_tokens or 0)
+            TOKENS.inc(operation, "completion", amount=usage.completion_tokens or 0)
+        return response
+
+    def _call_with_retries(self, operation, messages, kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self.client.chat.completions.create(
+                    messages=messages, timeout=self._attempt_timeout(), **kwargs
+                )
+                ATTEMPTS.inc(operation, "ok")
+                return response
+            except RETRYABLE_ERRORS as e:
+                ATTEMPTS.inc(operation, type(e).__name__)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                logger.warning("OpenAI %s attempt %d failed (%s); retrying in %.2fs.", operation, attempt + 1, e, delay)
+                time.sleep(delay)
+                attempt += 1
+            except openai.APIStatusError as e:
+                ATTEMPTS.inc(operation, type(e).__name__)
+                raise
+
+
+llm = LLMClient()
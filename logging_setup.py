@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+import logging.handlers
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, "text" for plain lines during local development
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Per-route sampling of INFO/DEBUG records, e.g. "/generate_grocery_list/=0.05,/items/=0.01,default=1"
+# Warnings and errors are always kept.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# HTTP client libraries that log every request at INFO (the OpenAI SDK goes through httpx)
+QUIET_LOGGERS = ("httpx", "httpcore")
+
+# Environment variables whose values must never reach the logs
+SECRET_ENV_VARS = (
+    "MONGODB_URI", "MONGO_URI", "OPENAI_API_KEY", "PARTNER_API_KEY", "PROFILING_SECRET", "ADMIN_TOKEN",
+)
+SECRET_PATTERNS = [
+    # Credentials in MongoDB connection strings
+    (re.compile(r"(mongodb(?:\+srv)?://)[^@/\s]+@"), r"\1***@"),
+    # OpenAI style API keys
+    (re.compile(r"sk-[A-Za-z0-9_\-]{8,}"), "sk-***"),
+]
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Route and sampling decision of the current request
+_request = contextvars.ContextVar("chopnshop_log_request", default=None)
+
+
+def parse_sample_rates(value):
+    rates = {}
+    for entry in value.split(","):
+        if "=" not in entry:
+            continue
+        prefix, rate = entry.rsplit("=", 1)
+        rates[prefix.strip()] = float(rate)
+    return rates
+
+
+_sample_rates = parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+def sample_rate_for(path):
+    # The longest matching prefix wins
+    best, rate = -1, _sample_rates.get("default", 1.0)
+    for prefix, prefix_rate in _sample_rates.items():
+        if prefix != "default" and path.startswith(prefix) and len(prefix) > best:
+            best, rate = len(prefix), prefix_rate
+    return rate
+
+
+def start_request_logging(path):
+    """
+    Decide once per request whether its INFO/DEBUG records are kept, so a sampled
+    request keeps all of its records. Returns a token for end_request_logging.
+    """
+    rate = sample_rate_for(path)
+    sampled = rate >= 1 or random.random() < rate
+    return _request.set((path, sampled))
+
+
+def end_request_logging(token):
+    _request.reset(token)
+
+
+def redact(text):
+    for name in SECRET_ENV_VARS:
+        secret = os.environ.get(name)
+        if secret and len(secret) >= 8 and secret in text:
+            text = text.replace(secret, f"<{name}>")
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Drops INFO/DEBUG records of requests that were not sampled. Runs on the calling
+    thread, before anything is formatted.
+    """
+
+    def filter(self, record):
+        request = _request.get()
+        if request is not None:
+            record.route = request[0]
+            if not request[1] and record.levelno < logging.WARNING:
+                return False
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return redact(json.dumps(entry, default=str))
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        return redact(super().format(record))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records without formatting them, so message formatting, JSON encoding,
+    redaction and the write to stderr all happen on the listener thread. Log arguments
+    are rendered later, so pass values that are not mutated afterwards.
+    When the queue is full the record is dropped instead of blocking the request.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+def configure_logging(level=None, log_format=None, stream=None):
+    """
+    Route all logging through one bounded queue drained by a background thread.
+    Safe to call more than once; only the first call installs handlers.
+    """
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream)
+        if (log_format or LOG_FORMAT) == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        _handler = DeferredQueueHandler(log_queue)
+        _handler.addFilter(SamplingFilter())
+
+        root = logging.getLogger()
+        root.setLevel(level or LOG_LEVEL)
+        root.addHandler(_handler)
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    # Flush whatever is still queued
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_handler)
+            _listener.stop()
+            _listener = _handler = None
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork. The child gets its own queue (records the
+    # parent had not written yet stay the parent's) and its own listener thread.
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener is not None:
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        _handler.queue = log_queue
+        _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
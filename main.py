@@ -1,5 +1,5 @@
 import os
-import pymongo
+import logging
 import pandas as pd
 import pickle
 import faiss
@@ -8,35 +8,57 @@ import numpy as np
 #from bson.binary import Binary
 from dotenv import load_dotenv
 from scipy.spatial.distance import cosine
-from sentence_transformers import SentenceTransformer  # Using sentence transformers for embeddings
+from indexes import ITEMS_WITH_EMBEDDING_INDEX
+from db import get_client, get_database
+from metrics import stage
+from logging_setup import configure_logging
+from encoders import load_encoder
+from embedding_batcher import EmbeddingBatcher, EMBEDDING_MICROBATCH
+from index_manager import write_checksum
+from concurrent.futures import TimeoutError as FutureTimeout
+import deadline
 
 # Load environment variables and connect to MongoDB
 load_dotenv(override=True)
+configure_logging()
+logger = logging.getLogger(__name__)
 
-mongodb_uri = os.getenv("MONGO_URI")
-print(mongodb_uri)
-client = pymongo.MongoClient(mongodb_uri)
-db = client["chop-n-shop"]
+client = get_client()
+db = get_database()
 users_collection = db["users"]
 stores_collection = db["stores"]
 items_collection = db["items"]
 recipes_collection = db["recipes"]
 grocery_lists_collection = db["grocery_lists"]
 
-# Initialize the sentence-transformers model
-model = SentenceTransformer('all-MPNet-base-v2')
+# Location of the FAISS index and the matching list of item IDs
+FAISS_INDEX_FILE = os.getenv("FAISS_INDEX_FILE", "faiss_index_file.index")
+FAISS_IDS_FILE = os.getenv("FAISS_IDS_FILE", "ids_list.pkl")
+
+# Initialize the embedding model. EMBEDDING_BACKEND picks torch, torch-int8, onnx or onnx-int8;
+# EMBEDDING_MODEL=hashing swaps in a deterministic offline stand-in (see encoders.py).
+model = load_encoder()
+
+# Single-text encodes from concurrent requests are batched into one forward pass
+embedding_batcher = EmbeddingBatcher(model.encode) if EMBEDDING_MICROBATCH else None
 
 # Ping to check the connection
 try:
     client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
+    logger.info("Pinged your deployment. You successfully connected to MongoDB!")
 except Exception as e:
-    print(e)
+    logger.error("MongoDB ping failed: %s", e)
 
 # Build a FAISS index from MongoDB embeddings
 def build_faiss_index():
-    # Fetch all items with embeddings from MongoDB
+    # Fetch all items with embeddings from MongoDB, scanning only the partial index of embedded items
+    # when it exists (`python indexes.py ensure` creates it; building the FAISS index changes no schema)
     items = items_collection.find({"embedding": {"$exists": True}})
+    if ITEMS_WITH_EMBEDDING_INDEX in items_collection.index_information():
+        items = items.hint(ITEMS_WITH_EMBEDDING_INDEX)
+    else:
+        logger.warning("Index %s is missing, scanning the whole items collection; run `python indexes.py ensure`.",
+                       ITEMS_WITH_EMBEDDING_INDEX)
     
     # Extract embeddings and their corresponding IDs
     embeddings = []
@@ -48,8 +70,8 @@ def build_faiss_index():
         embeddings.append(embedding)
         ids.append(str(item["_id"]))  # Use stringified ObjectId as ID
         count += 1
-        if count % 100 == 0:
-            print(f"{count} embeddings processed...")
+        if count % 10000 == 0:
+            logger.debug("%d embeddings processed...", count)
 
     # Convert embeddings to numpy array (required by FAISS)
     embeddings_np = np.array(embeddings).astype("float32")
@@ -61,15 +83,35 @@ def build_faiss_index():
     # Add embeddings to the FAISS index
     index.add(embeddings_np)
     
-    print(f"FAISS index built with {index.ntotal} items.")
+    logger.info("FAISS index built with %d items.", index.ntotal)
     return index, ids  # Return the index and IDs
 
 # Function to generate embeddings for an item name (or description)
 def generate_embedding(text):
+    deadline.check("embed")
+    try:
+        with stage("embed"):
+            if embedding_batcher is not None:
+                # Wait for the shared batch no longer than the request's deadline allows
+                try:
+                    return embedding_batcher.encode(text, timeout=deadline.remaining()).tolist()
+                except FutureTimeout:
+                    raise deadline.exceeded("embed")
+            return model.encode(text).tolist()
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error("Error generating embedding for %r: %s", text, e)
+        return None
+
+# Function to generate embeddings for many texts at once (one batched forward pass per batch_size texts)
+def generate_embeddings(texts, batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))):
+    deadline.check("embed")
     try:
-        return model.encode(text).tolist()
+        with stage("embed"):
+            return np.asarray(model.encode(list(texts), batch_size=batch_size), dtype="float32")
     except Exception as e:
-        print(f"Error generating embedding for '{text}': {e}")
+        logger.error("Error generating embeddings for %d texts: %s", len(texts), e)
         return None
 
 # Function to search items based on a query
@@ -90,7 +132,7 @@ def search_items_by_query_faiss(query, index, ids, top_k=25):
         
         return similar_items
     else:
-        print("Error generating query embedding.")
+        logger.error("Error generating query embedding.")
         return []
 
 # Save the FAISS index and IDs list to disk
@@ -101,9 +143,11 @@ def save_faiss_index(index, ids, index_file, ids_file):
         # Save the IDs list
         with open(ids_file, "wb") as f:
             pickle.dump(ids, f)
-        print("FAISS index and IDs saved successfully.")
+        # Lets a reloading API (see index_manager.py) verify it read a complete pair
+        write_checksum(index_file, ids_file)
+        logger.info("FAISS index and IDs saved successfully.")
     except Exception as e:
-        print(f"Error saving FAISS index or IDs: {e}")
+        logger.error("Error saving FAISS index or IDs: %s", e)
 
 # Load the FAISS index and IDs list from disk
 def load_faiss_index(index_file, ids_file):
@@ -113,10 +157,10 @@ def load_faiss_index(index_file, ids_file):
         # Load the IDs list
         with open(ids_file, "rb") as f:
             ids = pickle.load(f)
-        print("FAISS index and IDs loaded successfully.")
+        logger.info("FAISS index and IDs loaded successfully.")
         return index, ids
     except Exception as e:
-        print(f"Error loading FAISS index: {e}")
+        logger.error("Error loading FAISS index: %s", e)
         return None, None
 
 # Main menu
@@ -124,12 +168,12 @@ def main():
     global faiss_index, item_ids  # To use the FAISS index in menu options
 
     # Check if FAISS index files exist before attempting to load
-    if os.path.exists("faiss_index_file.index") and os.path.exists("ids_list.pkl"):
-        faiss_index, item_ids = load_faiss_index("faiss_index_file.index", "ids_list.pkl")
+    if os.path.exists(FAISS_INDEX_FILE) and os.path.exists(FAISS_IDS_FILE):
+        faiss_index, item_ids = load_faiss_index(FAISS_INDEX_FILE, FAISS_IDS_FILE)
     else:
         print("FAISS index files not found, rebuilding index...")
         faiss_index, item_ids = build_faiss_index()
-        save_faiss_index(faiss_index, item_ids, "faiss_index_file.index", "ids_list.pkl")
+        save_faiss_index(faiss_index, item_ids, FAISS_INDEX_FILE, FAISS_IDS_FILE)
 
     if not faiss_index or not item_ids:
         print("Error loading FAISS index. Exiting...")
@@ -160,10 +204,10 @@ if __name__ == "__main__":
     print("Building FAISS index...")
 
     # Check if FAISS index files exist before attempting to load
-    if os.path.exists("faiss_index_file.index") and os.path.exists("ids_list.pkl"):
-        faiss_index, item_ids = load_faiss_index("faiss_index_file.index", "ids_list.pkl")
+    if os.path.exists(FAISS_INDEX_FILE) and os.path.exists(FAISS_IDS_FILE):
+        faiss_index, item_ids = load_faiss_index(FAISS_INDEX_FILE, FAISS_IDS_FILE)
     else:
         faiss_index, item_ids = build_faiss_index()
-        save_faiss_index(faiss_index, item_ids, "faiss_index_file.index", "ids_list.pkl")
+        save_faiss_index(faiss_index, item_ids, FAISS_INDEX_FILE, FAISS_IDS_FILE)
     
     main()
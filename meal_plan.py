@@ -0,0 +1,105 @@
+"""
+One grocery basket for several recipes (a week of meals). Ingredients shared by the
+recipes are bought once: the union of their simplified ingredients is resolved in one
+batched pass and a single budget applies to the whole basket.
+"""
+import os
+from bson.objectid import ObjectId
+from metrics import stage
+from query_cache import normalize_query
+from openai_recipe_grocery_list import recipes_collection, ingredient_table
+
+MAX_MEAL_PLAN_RECIPES = int(os.getenv("MAX_MEAL_PLAN_RECIPES", "21"))
+
+
+def load_recipes(recipe_ids):
+    """
+    The recipes with the given IDs, in the order given (duplicates kept once).
+    Raises ValueError when one does not exist or has no simplified ingredients.
+    """
+    object_ids = list(dict.fromkeys(ObjectId(recipe_id) for recipe_id in recipe_ids))
+    with stage("mongo_find"):
+        found = {recipe["_id"]: recipe for recipe in recipes_collection.find(
+            {"_id": {"$in": object_ids}}, {"name": 1, "simplified_ingredients": 1}
+        )}
+    missing = [str(object_id) for object_id in object_ids if not found.get(object_id, {}).get("simplified_ingredients")]
+    if missing:
+        raise ValueError(f"Recipes not found or without simplified ingredients: {', '.join(missing)}")
+    return [found[object_id] for object_id in object_ids]
+
+
+def generate_meal_plan(recipe_ids, user_preferences):
+    """
+    Consolidated grocery list for several recipes, plus what each recipe uses from it.
+    Ingredients are bought in the order they first appear across the recipes until the
+    budget runs out; `over_budget` is what the ingredients left out would cost on top.
+    """
+    recipes = load_recipes(recipe_ids)
+
+    # normalized ingredient -> (ingredient as first written, names of the recipes using it)
+    ingredients = {}
+    for recipe in recipes:
+        for ingredient in recipe["simplified_ingredients"]:
+            if not isinstance(ingredient, str) or not ingredient.strip():
+                continue
+            key = normalize_query(ingredient)
+            ingredients.setdefault(key, (ingredient, []))
+            if recipe["name"] not in ingredients[key][1]:
+                ingredients[key][1].append(recipe["name"])
+
+    candidates = ingredient_table.candidates_many(ingredients)
+
+    basket = {}
+    unmatched = []
+    left_out = []
+    total_cost = 0
+    for key, (ingredient, used_by) in ingredients.items():
+        with stage("filter"):
+            item = next(ingredient_table.eligible(
+                candidates.get(key, []), user_preferences["Dietary_preferences"], user_preferences["Allergies"]
+            ), None)
+        if item is None:
+            unmatched.append(ingredient)
+            continue
+        item_price = float(item.get("Price", 0))
+        if total_cost + item_price > user_preferences["Budget"]:
+            left_out.append({"ingredient": ingredient, "item_name": item["Item_name"], "price": item_price})
+            continue
+        total_cost = round(total_cost + item_price, 2)
+        basket[key] = {
+            "ingredient": ingredient,
+            "item_name": item["Item_name"],
+            "price": item_price,
+            "store": item["Store_name"],
+            "recipes": used_by,
+        }
+
+    over_budget = 0
+    if left_out:
+        over_budget = round(total_cost + sum(item["price"] for item in left_out) - user_preferences["Budget"], 2)
+
+    breakdown = []
+    for recipe in recipes:
+        keys = list(dict.fromkeys(normalize_query(ingredient) for ingredient in recipe["simplified_ingredients"]
+                                  if isinstance(ingredient, str) and ingredient.strip()))
+        items = [
+            {**{field: basket[key][field] for field in ("ingredient", "item_name", "price", "store")},
+             "shared": len(basket[key]["recipes"]) > 1}
+            for key in keys if key in basket
+        ]
+        breakdown.append({
+            "recipe_id": str(recipe["_id"]),
+            "recipe_name": recipe["name"],
+            "items": items,
+            "missing": [ingredients[key][0] for key in keys if key not in basket],
+            "total_cost": round(sum(item["price"] for item in items), 2),
+        })
+
+    return {
+        "grocery_list": list(basket.values()),
+        "total_cost": total_cost,
+        "over_budget": over_budget,
+        "left_out": left_out,
+        "unmatched": unmatched,
+        "recipes": breakdown,
+    }
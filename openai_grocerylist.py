@@ -1,27 +1,28 @@
 import openai
 import os
 from dotenv import load_dotenv
-from pymongo import MongoClient
 import faiss
 import numpy as np
 from bson.objectid import ObjectId
-from main import generate_embedding, load_faiss_index
+from main import model, FAISS_INDEX_FILE, FAISS_IDS_FILE
+from db import get_database
+from metrics import stage
+from index_manager import IndexManager
+import deadline
 
 # Load environment variables
 load_dotenv(override=True)
 
 # Set up OpenAI API key and MongoDB connection
 openai.api_key = os.getenv("OPENAI_API_KEY")
-mongodb_uri = os.getenv("MONGO_URI")
-client = MongoClient(mongodb_uri)
-db = client["chop-n-shop"]
+db = get_database()
 items_collection = db["items"]
 grocery_lists_collection = db["grocery_lists"]
 
-# Load FAISS index and item IDs
-faiss_index, item_ids = load_faiss_index("faiss_index_file.index", "ids_list.pkl")
-if not faiss_index or not item_ids:
+# Load the FAISS index and item IDs; shared by every search module and reloadable without a restart
+if not os.path.exists(FAISS_INDEX_FILE) or not os.path.exists(FAISS_IDS_FILE):
     raise ValueError("FAISS index or item IDs not loaded successfully. Ensure the files exist.")
+index_manager = IndexManager(FAISS_INDEX_FILE, FAISS_IDS_FILE, items_collection, model.get_sentence_embedding_dimension())
 
 # Normalize ingredients for consistent processing
 def normalize_ingredients(ingredients):
@@ -78,33 +79,50 @@ def is_item_valid(item, dietary_preferences, allergens):
     # Allergen check
     return check_allergen_suitability(ingredients, allergens)
 
-# Search for items in the FAISS index by query
+# Search for items by query (BM25 + FAISS, see hybrid_retriever.py)
 def search_items_by_query_faiss(query):
-    query_embedding = generate_embedding(query)
-    _, indices = faiss_index.search(np.array([query_embedding], dtype=np.float32), k=100)
-    return [items_collection.find_one({"_id": ObjectId(item_ids[idx])}) for idx in indices[0] if idx < len(item_ids)]
+    with index_manager.acquire() as version:
+        positions = version.retriever.search(query, k=100)
+        with stage("hydrate"):
+            return version.retriever.hydrate(positions)
 
-# Generate grocery list based on user preferences
+# Generate grocery list based on user preferences. Under a deadline (see deadline.py) the
+# items resolved before it ran out are returned, flagged "partial", with the rest "unresolved_items".
 def generate_grocery_list(user_preferences):
     grocery_lists = {"Trader Joe's": [], "Whole Foods Market": []}
     total_costs = {"Trader Joe's": 0, "Whole Foods Market": 0}
     selected_categories = {"Trader Joe's": set(), "Whole Foods Market": set()}
+    requests = user_preferences["Grocery_items"]
+    resolved = 0
 
-    for store in grocery_lists.keys():
-        for request in user_preferences["Grocery_items"]:
+    try:
+        # One search per requested item, shared by the stores (each store still fills in request order)
+        for request in requests:
             query_results = search_items_by_query_faiss(request)
 
-            for item in query_results:
-                if item and item.get("Store_name") == store:
-                    if not is_item_valid(item, user_preferences["Dietary_preferences"], user_preferences["Allergies"]):
-                        continue
-
-                    item_price = float(item.get("Price", 0))
-                    if total_costs[store] + item_price <= user_preferences["Budget"]:
-                        grocery_lists[store].append(item)
-                        selected_categories[store].add(item.get("Category", "unknown"))
-                        total_costs[store] += item_price
-                        break
+            # Picks are applied once every store is done, so a request is either resolved or not at all
+            picks = {}
+            for store in grocery_lists.keys():
+                for item in query_results:
+                    if item and item.get("Store_name") == store:
+                        deadline.check("filter")
+                        with stage("filter"):
+                            valid = is_item_valid(item, user_preferences["Dietary_preferences"], user_preferences["Allergies"])
+                        if not valid:
+                            continue
+
+                        item_price = float(item.get("Price", 0))
+                        if total_costs[store] + item_price <= user_preferences["Budget"]:
+                            picks[store] = (item, item_price)
+                            break
+            for store, (item, item_price) in picks.items():
+                grocery_lists[store].append(item)
+                selected_categories[store].add(item.get("Category", "unknown"))
+                total_costs[store] += item_price
+            resolved += 1
+    except deadline.DeadlineExceeded:
+        pass
+    unresolved = requests[resolved:]
 
     # Format grocery lists into JSON format
     formatted_lists = {}
@@ -122,29 +140,35 @@ def generate_grocery_list(user_preferences):
     # Save the result to the MongoDB grocery_list collection
     # grocery_lists_collection.insert_one(grocery_lists)  # Insert the grocery list as a JSON document
 
+    if unresolved:
+        formatted_lists["partial"] = True
+        formatted_lists["unresolved_items"] = unresolved
+
     # Return lists based on store preference
     if user_preferences.get("Store_preference"):
         store = user_preferences["Store_preference"]
-        return {store: formatted_lists.get(store, {"message": f"No items found for {store}."})}
+        preferred = {store: formatted_lists.get(store, {"message": f"No items found for {store}."})}
+        if unresolved:
+            preferred.update(partial=True, unresolved_items=unresolved)
+        return preferred
     
-    grocery_lists_collection.insert_one(formatted_lists)  # Insert here
+    with stage("mongo_insert"):
+        grocery_lists_collection.insert_one(formatted_lists)  # Insert here
 
     return formatted_lists
 
-# Example user preferences
-user_preferences = {
-    "Budget": 50.00,
-    "Grocery_items": ["pizza", "chips", "juice"],
-    "Dietary_preferences": "vegan",
-    "Allergies": ["peanuts"],
-    "Store_preference": None, 
-}
-
-# # Generate grocery list
-grocery_lists = generate_grocery_list(user_preferences)
+if __name__ == "__main__":
+    # Example user preferences
+    user_preferences = {
+        "Budget": 50.00,
+        "Grocery_items": ["pizza", "chips", "juice"],
+        "Dietary_preferences": "vegan",
+        "Allergies": ["peanuts"],
+        "Store_preference": None, 
+    }
 
-# # Save the result to the MongoDB grocery_list collection
-#grocery_lists_collection.insert_one(grocery_lists)  # Insert the grocery list as a JSON document
+    # # Generate grocery list
+    grocery_lists = generate_grocery_list(user_preferences)
 
-# # Print confirmation
-print("Grocery list saved to the database successfully!")
\ No newline at end of file
+    # # Print confirmation
+    print("Grocery list saved to the database successfully!")
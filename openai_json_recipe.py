@@ -1,21 +1,23 @@
 import openai
 import os
 import json
+import logging
 from dotenv import load_dotenv
-from pymongo import MongoClient
-import pymongo
+from db import get_database
+from metrics import stage
+from llm_client import llm, LLMUnavailable
 import requests
 import re 
 
 load_dotenv(override=True)
 
+logger = logging.getLogger(__name__)
+
 # OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # MongoDB connection
-mongodb_uri = os.getenv("MONGO_URI")
-client = pymongo.MongoClient(mongodb_uri)
-db = client["chop-n-shop"]
+db = get_database()
 recipes_collection = db["recipes"]
 
 def generate_recipe(prompt):
@@ -23,7 +25,9 @@ def generate_recipe(prompt):
     Generate a recipe using OpenAI based on the user's prompt.
     """
     try:
-        response = openai.chat.completions.create(
+        # Bulkhead, timeouts, retries and circuit breaker: see llm_client.py
+        response = llm.chat(
+            "recipe",
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are a professional recipe generator."},
@@ -38,10 +42,13 @@ def generate_recipe(prompt):
         recipe_data = json.loads(recipe_json)  # Convert JSON string to Python dictionary
         return recipe_data
     except json.JSONDecodeError:
-        print("Error: Could not decode JSON from OpenAI response.")
+        logger.error("Could not decode JSON from OpenAI response.")
         return None
+    except LLMUnavailable:
+        # Shed to protect the service; the caller should answer 503 rather than "failed"
+        raise
     except Exception as e:
-        print(f"Error generating recipe: {e}")
+        logger.error("Error generating recipe: %s", e)
         return None
 
 def save_recipe_to_db(recipe_data):
@@ -59,25 +66,25 @@ def save_recipe_to_db(recipe_data):
             "total_time": recipe_data.get('total_time', 'Unknown'),
             "link": recipe_data.get('link', 'Unknown'),
         }
-        result = recipes_collection.insert_one(recipe_document)
-        # print(f"Recipe saved successfully with ID: {result.inserted_id}")
+        with stage("mongo_insert"):
+            result = recipes_collection.insert_one(recipe_document)
         return result.inserted_id
     except Exception as e:
-        # print(f"Error saving recipe to database: {e}")
+        logger.error("Error saving recipe to database: %s", e)
         return None
 
 def generate_and_save_recipe(user_prompt):
     """
     Generate a recipe using OpenAI and save it to MongoDB.
     """
-    print("Generating recipe...")
+    logger.info("Generating recipe...")
     recipe_data = generate_recipe(user_prompt)
     
     if not recipe_data:
-        print("Failed to generate recipe.")
+        logger.warning("Failed to generate recipe.")
         return None
 
-    print("Saving recipe to database...")
+    logger.info("Saving recipe to database...")
     recipe_id = save_recipe_to_db(recipe_data)
     return recipe_id
 
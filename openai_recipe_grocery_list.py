@@ -1,40 +1,72 @@
 import openai
 import os
 from dotenv import load_dotenv
-from pymongo import MongoClient
 import faiss
 import numpy as np
 from bson.objectid import ObjectId
-from main import generate_embedding, load_faiss_index
+from db import get_database
+from metrics import stage
+from openai_grocerylist import index_manager
+from ingredient_candidates import IngredientCandidateTable
+from recipe_index import RecipeIndex
+from main import model, generate_embeddings
 
 # Load environment variables
 load_dotenv(override=True)
 
 # Set up OpenAI API key and MongoDB connection
 openai.api_key = os.getenv("OPENAI_API_KEY")
-mongodb_uri = os.getenv("MONGO_URI")
-client = MongoClient(mongodb_uri)
-db = client["chop-n-shop"]
+db = get_database()
 items_collection = db["items"]
 recipes_collection = db["recipes"]
 
-# Load FAISS index and item IDs
-faiss_index, item_ids = load_faiss_index("faiss_index_file.index", "ids_list.pkl")
-if not faiss_index or not item_ids:
-    raise ValueError("FAISS index or item IDs not loaded successfully. Ensure the files exist.")
-
 # Normalize simplified ingredients for consistent processing
 def normalize_ingredients(simplified_ingredients):
     return [simplified_ingredients.strip().lower() for simplified_ingredients in simplified_ingredients]
 
-# Search for items in the FAISS index by query
+# Search for items by query (BM25 + FAISS, see hybrid_retriever.py)
 def search_items_by_query_faiss(query):
     """
     Search the FAISS index for items that match a query and return the MongoDB documents.
     """
-    query_embedding = generate_embedding(query)
-    _, indices = faiss_index.search(np.array([query_embedding], dtype=np.float32), k=100)
-    return [items_collection.find_one({"_id": ObjectId(item_ids[idx])}) for idx in indices[0] if idx < len(item_ids)]
+    with index_manager.acquire() as version:
+        positions = version.retriever.search(query, k=100)
+        with stage("hydrate"):
+            return version.retriever.hydrate(positions)
+
+# Ingredients that rule an item out for each diet
+DIETARY_EXCLUSIONS = {
+    "vegan": [
+        "meat", "lamb", "chicken", "beef", "pork", "turkey", "duck", "veal", "bison", "goat", "game meat", 
+        "salami", "sausage", "bacon", "hot dog", "deli meat", "fish", "salmon", "tuna", "shrimp", "lobster", 
+        "crab", "cod", "mackerel", "sardines", "anchovies", "shellfish", "eggs", "chicken eggs", "duck eggs", 
+        "quail eggs", "egg powder", "milk", "cow's milk", "goat's milk", "sheep's milk", "cream", "butter", 
+        "cheese", "cheddar", "mozzarella", "parmesan", "brie", "gouda", "feta", "yogurt", "ice cream", "whey", 
+        "casein", "lactose", "honey", "royal jelly", "bee pollen", "gelatin", "marshmallow", "gummy", "fish sauce", 
+        "anchovy paste", "animal fat", "lard", "tallow", "bone marrow", "rennet"
+    ],
+    "vegetarian": [
+        "meat", "lamb", "chicken", "beef", "pork", "turkey", "duck", "veal", "bison", "goat", "game meat", 
+        "salami", "sausage", "bacon", "hot dog", "deli meat", "fish", "salmon", "tuna", "shrimp", "lobster", 
+        "crab", "cod", "mackerel", "sardines", "anchovies", "shellfish"
+    ],
+    "gluten-free": [
+        "wheat", "barley", "rye", "oats", "seitan", "bulgur", "couscous", "wheat flour", "whole wheat", "wheat germ", 
+        "wheat bran", "semolina", "durum", "wheat starch", "spelt", "farro", "malt", "malt syrup", "malt vinegar", 
+        "rye flour", "rye bread", "rye crackers", "barley flour", "barley-based products", "seitan", "bread", "cake", 
+        "cookie", "pasta"
+    ],
+    "lactose-free": [
+        "milk", "cow's milk", "goat's milk", "sheep's milk", "cheese", "cheddar", "mozzarella", "brie", "gouda", 
+        "feta", "parmesan", "cream cheese", "ricotta", "butter", "margarine", "cream", "heavy cream", "sour cream", 
+        "half-and-half", "whipped cream", "ice cream", "yogurt", "Greek yogurt", "whey", "lactose"
+    ],
+    "pescetarian": [
+        "meat", "chicken", "beef", "pork", "turkey", "duck", "veal", "bison", "goat", "game meat", 
+        "lamb", "chicken breast", "chicken wings", "chicken legs", "chicken thighs", "steak", "ground beef", 
+        "pork chops", "bacon", "ham", "sausage", "pork", "duck breast", "duck legs", "confit"
+    ]
+}
 
 # Validate dietary preferences and allergens
 def is_item_valid(item, dietary_preferences, allergens):
@@ -43,51 +75,27 @@ def is_item_valid(item, dietary_preferences, allergens):
     """
     simplified_ingredients = normalize_ingredients(item.get("Simplified Ingredients", []))
 
-    exclusions = {
-        "vegan": [
-            "meat", "lamb", "chicken", "beef", "pork", "turkey", "duck", "veal", "bison", "goat", "game meat", 
-            "salami", "sausage", "bacon", "hot dog", "deli meat", "fish", "salmon", "tuna", "shrimp", "lobster", 
-            "crab", "cod", "mackerel", "sardines", "anchovies", "shellfish", "eggs", "chicken eggs", "duck eggs", 
-            "quail eggs", "egg powder", "milk", "cow's milk", "goat's milk", "sheep's milk", "cream", "butter", 
-            "cheese", "cheddar", "mozzarella", "parmesan", "brie", "gouda", "feta", "yogurt", "ice cream", "whey", 
-            "casein", "lactose", "honey", "royal jelly", "bee pollen", "gelatin", "marshmallow", "gummy", "fish sauce", 
-            "anchovy paste", "animal fat", "lard", "tallow", "bone marrow", "rennet"
-        ],
-        "vegetarian": [
-            "meat", "lamb", "chicken", "beef", "pork", "turkey", "duck", "veal", "bison", "goat", "game meat", 
-            "salami", "sausage", "bacon", "hot dog", "deli meat", "fish", "salmon", "tuna", "shrimp", "lobster", 
-            "crab", "cod", "mackerel", "sardines", "anchovies", "shellfish"
-        ],
-        "gluten-free": [
-            "wheat", "barley", "rye", "oats", "seitan", "bulgur", "couscous", "wheat flour", "whole wheat", "wheat germ", 
-            "wheat bran", "semolina", "durum", "wheat starch", "spelt", "farro", "malt", "malt syrup", "malt vinegar", 
-            "rye flour", "rye bread", "rye crackers", "barley flour", "barley-based products", "seitan", "bread", "cake", 
-            "cookie", "pasta"
-        ],
-        "lactose-free": [
-            "milk", "cow's milk", "goat's milk", "sheep's milk", "cheese", "cheddar", "mozzarella", "brie", "gouda", 
-            "feta", "parmesan", "cream cheese", "ricotta", "butter", "margarine", "cream", "heavy cream", "sour cream", 
-            "half-and-half", "whipped cream", "ice cream", "yogurt", "Greek yogurt", "whey", "lactose"
-        ],
-        "pescetarian": [
-            "meat", "chicken", "beef", "pork", "turkey", "duck", "veal", "bison", "goat", "game meat", 
-            "lamb", "chicken breast", "chicken wings", "chicken legs", "chicken thighs", "steak", "ground beef", 
-            "pork chops", "bacon", "ham", "sausage", "pork", "duck breast", "duck legs", "confit"
-        ]
-    }
-    if dietary_preferences in exclusions:
-        if any(exclusion in simplified_ingredients for exclusion in exclusions[dietary_preferences]):
+    if dietary_preferences in DIETARY_EXCLUSIONS:
+        if any(exclusion in simplified_ingredients for exclusion in DIETARY_EXCLUSIONS[dietary_preferences]):
             return False
 
     # Check allergens
     return all(allergen.lower() not in ingredient for allergen in allergens for ingredient in simplified_ingredients)
 
+# Ranked candidates per recipe ingredient, rebuilt in the background (see ingredient_candidates.py)
+ingredient_table = IngredientCandidateTable(index_manager, recipes_collection, is_item_valid, DIETARY_EXCLUSIONS)
+
+# Recipe embeddings and per-diet cost estimates, for similar recipes and budget suggestions (see recipe_index.py)
+recipe_index = RecipeIndex(recipes_collection, generate_embeddings, model.get_sentence_embedding_dimension(),
+                           ingredient_table, DIETARY_EXCLUSIONS)
+
 # Generate grocery list based on a recipe
 def generate_grocery_list_from_recipe(recipe_id, user_preferences):
     """
-    Generate a grocery list by matching recipe ingredients with items in the FAISS index.
+    Generate a grocery list by matching recipe ingredients with their best eligible catalog item.
     """
-    recipe = recipes_collection.find_one({"_id": ObjectId(recipe_id)})
+    with stage("mongo_find"):
+        recipe = recipes_collection.find_one({"_id": ObjectId(recipe_id)})
     if not recipe or "simplified_ingredients" not in recipe:
         raise ValueError(f"Recipe with ID {recipe_id} not found or has no simplified ingredients.")
 
@@ -96,27 +104,28 @@ def generate_grocery_list_from_recipe(recipe_id, user_preferences):
     over_budget = 0
 
     for ingredient in recipe["simplified_ingredients"]:
-        query_results = search_items_by_query_faiss(ingredient)
-
-        for item in query_results:
-            if not item or not is_item_valid(item, user_preferences["Dietary_preferences"], user_preferences["Allergies"]):
-                continue
-
-            item_price = float(item.get("Price", 0))
-            new_total_cost = total_cost + item_price
-            if new_total_cost <= user_preferences["Budget"]:
-                grocery_list.append({
-                    "ingredient": ingredient,
-                    "item_name": item["Item_name"],
-                    "price": item_price,
-                    "store": item["Store_name"]
-                })
-                total_cost = round(new_total_cost, 2)  # Round to two decimal places
-                break  # Add only the first valid match for each ingredient
-            else:
-                # If adding the item exceeds the budget, track the over-budget amount
-                over_budget = round(new_total_cost - user_preferences["Budget"], 2)  # Round to two decimal places
-                break  # Skip to next item once the budget is exceeded
+        # Ranked candidates from the ingredient table (or a live search), then the first eligible one
+        candidates = ingredient_table.candidates(ingredient)
+        with stage("filter"):
+            item = next(ingredient_table.eligible(
+                candidates, user_preferences["Dietary_preferences"], user_preferences["Allergies"]
+            ), None)
+        if item is None:
+            continue
+
+        item_price = float(item.get("Price", 0))
+        new_total_cost = total_cost + item_price
+        if new_total_cost <= user_preferences["Budget"]:
+            grocery_list.append({
+                "ingredient": ingredient,
+                "item_name": item["Item_name"],
+                "price": item_price,
+                "store": item["Store_name"]
+            })
+            total_cost = round(new_total_cost, 2)  # Round to two decimal places
+        else:
+            # If adding the item exceeds the budget, track the over-budget amount
+            over_budget = round(new_total_cost - user_preferences["Budget"], 2)  # Round to two decimal places
 
     # Check if total cost exceeds the budget and calculate over-budget
     if over_budget > 0:
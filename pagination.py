@@ -0,0 +1,140 @@
+import os
+import base64
+import hashlib
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from responses import dumps
+
+# Page size limits for the list endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Number of documents pulled per round-trip when streaming
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def clamp_limit(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def build_projection(fields, allowed, default):
+    """
+    Turn a comma separated `fields` parameter into a Mongo projection.
+    Only whitelisted fields can be requested (when `allowed` is given), so large
+    internal fields like the pickled item embeddings never leave the database.
+    Returns the projection and the list of fields to output (None means all).
+    """
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        if any(field.startswith("$") or "." in field for field in requested):
+            raise HTTPException(status_code=400, detail="Only top-level fields can be selected")
+        if allowed is not None:
+            unknown = [field for field in requested if field not in allowed]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    elif default is None:
+        # No default projection means the whole document
+        return None, None
+    else:
+        requested = list(default)
+
+    projection = {field: 1 for field in requested}
+    # _id is always fetched because it is the pagination key
+    projection["_id"] = 1
+    return projection, requested
+
+
+def present(doc, output_fields):
+    """
+    Shape a document for the response: keep the requested fields
+    (ObjectIds and dates are left to the JSON encoder in responses.py).
+    """
+    if output_fields is None:
+        return dict(doc)
+    return {field: doc[field] for field in output_fields if field in doc}
+
+
+# Cursors are the last seen ObjectId, wrapped so clients treat them as opaque
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return ObjectId(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (InvalidId, ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_query(query, cursor):
+    if not cursor:
+        return query
+    return {**query, "_id": {"$gt": decode_cursor(cursor)}}
+
+
+def fetch_page(collection, query, projection, limit, cursor=None):
+    """
+    Fetch one page ordered by _id, starting after `cursor`.
+    Returns the documents and the cursor for the next page (or None).
+    """
+    docs = list(
+        collection.find(keyset_query(query, cursor), projection)
+        .sort("_id", 1)
+        .limit(limit + 1)
+    )
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]["_id"])
+    return docs, next_cursor
+
+
+def wants_ndjson(stream, accept):
+    return bool(stream) or (accept is not None and NDJSON_MEDIA_TYPE in accept)
+
+
+def ndjson_response(collection, query, projection, transform, cursor=None):
+    """
+    Stream every matching document as one JSON object per line.
+    The Mongo cursor is consumed lazily so memory stays flat regardless of result size.
+    """
+    mongo_cursor = (
+        collection.find(keyset_query(query, cursor), projection)
+        .sort("_id", 1)
+        .batch_size(STREAM_BATCH_SIZE)
+    )
+
+    def generate():
+        try:
+            for doc in mongo_cursor:
+                yield dumps(transform(doc)) + b"\n"
+        finally:
+            mongo_cursor.close()
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def compute_etag(body):
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def next_page_headers(next_cursor):
+    if not next_cursor:
+        return {}
+    return {"X-Next-Cursor": next_cursor}
@@ -0,0 +1,236 @@
+import os
+import gc
+import sys
+import time
+import argparse
+import multiprocessing
+from datetime import datetime
+import faiss
+from bson import json_util
+from pymongo import UpdateOne
+
+# Where the nightly suggestions are stored, one document per user
+SUGGESTIONS_COLLECTION = "suggested_grocery_lists"
+
+# Most restrictive diet first: is_item_valid only takes one diet per list
+DIET_PRIORITY = ["vegan", "vegetarian", "pescetarian", "gluten-free", "lactose-free"]
+
+# Store names in the users collection -> store names used in the grocery lists
+STORE_ALIASES = {
+    "trader joes": "Trader Joe's",
+    "trader joe's": "Trader Joe's",
+    "whole foods": "Whole Foods Market",
+    "whole foods market": "Whole Foods Market",
+}
+
+USER_PROJECTION = {
+    "Budget": 1, "Dietary_restrictions": 1, "Allergies": 1, "Food_request": 1, "Preferred_stores": 1,
+}
+
+
+def user_preferences(user):
+    """
+    Map a `users` document (see DataPopulation.py) onto generate_grocery_list preferences.
+    """
+    diets = [diet.lower() for diet in user.get("Dietary_restrictions") or []]
+    dietary_preference = next((diet for diet in DIET_PRIORITY if diet in diets), "none")
+
+    store_preference = None
+    for store in user.get("Preferred_stores") or []:
+        if store.lower() in STORE_ALIASES:
+            store_preference = STORE_ALIASES[store.lower()]
+            break
+
+    return {
+        "Budget": float(user.get("Budget") or 0),
+        "Grocery_items": list(user.get("Food_request") or []),
+        "Dietary_preferences": dietary_preference,
+        "Allergies": list(user.get("Allergies") or []),
+        "Store_preference": store_preference,
+    }
+
+
+def read_shared_index(index_file):
+    """
+    Memory-map the index when this FAISS build supports it, so every worker
+    shares the same page cache instead of holding its own copy.
+    """
+    for flag_name in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+        flag = getattr(faiss, flag_name, None)
+        if flag is None:
+            continue
+        try:
+            return faiss.read_index(index_file, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            continue
+    return faiss.read_index(index_file)
+
+
+# Per-process state, set up once by the pool initializer
+_worker = {}
+
+
+def init_worker(index_file, ids_file, threads):
+    # The model, modules and database client come from the parent (see main); only the index is per worker
+    from serve import init_worker as init_forked_worker
+    from db import get_database
+    from index_manager import load_index_version
+    import bulk_grocery_list
+
+    init_forked_worker(threads)
+    _worker["db"] = get_database()
+    # Same size and dimension checks as the API's index reloads; the checksum would read the whole index per worker
+    _worker["retriever"] = load_index_version(
+        index_file, ids_file, _worker["db"]["items"], read_index=read_shared_index, warm=False, verify_checksum=False,
+    ).retriever
+    _worker["bulk"] = bulk_grocery_list
+
+
+def process_shard(task):
+    """
+    Generate and upsert suggestions for every user whose _id falls in the shard's range.
+    """
+    shard_id, first_id, last_id = task
+    db = _worker["db"]
+    users = list(db["users"].find({"_id": {"$gte": first_id, "$lte": last_id}}, USER_PROJECTION))
+
+    requests = []
+    for user in users:
+        preferences = user_preferences(user)
+        if preferences["Grocery_items"]:
+            requests.append({"user_id": str(user["_id"]), "preferences": preferences})
+    if not requests:
+        return shard_id, len(users), 0
+
+    lists = _worker["bulk"].generate_grocery_lists_bulk(
+        requests, retriever=_worker["retriever"], persist=False
+    )
+
+    generated_at = datetime.utcnow()
+    operations = []
+    for request, grocery_list in zip(requests, lists):
+        grocery_list.pop("created_at", None)
+        grocery_list.pop("user_id", None)
+        operations.append(UpdateOne(
+            {"user_id": request["user_id"]},
+            {"$set": {
+                "user_id": request["user_id"],
+                "preferences": request["preferences"],
+                "grocery_list": grocery_list,
+                "generated_at": generated_at,
+            }},
+            upsert=True,
+        ))
+    db[SUGGESTIONS_COLLECTION].bulk_write(operations, ordered=False)
+    return shard_id, len(users), len(operations)
+
+
+def mixes_id_types(shard):
+    # MongoDB orders _ids of different BSON types by type, so a range from a string _id
+    # (DataPopulation.py users) to an ObjectId (/register/) matches no user at all
+    first_id, last_id = shard
+    return type(first_id) is not type(last_id)
+
+
+def plan_shards(db, shard_size):
+    """
+    Split the users collection into contiguous _id ranges of about `shard_size` users.
+    A range never spans two _id types (see mixes_id_types): a new one starts where the type changes.
+    """
+    shards = []
+    batch = []
+    for user in db["users"].find({}, {"_id": 1}).sort("_id", 1):
+        if batch and type(user["_id"]) is not type(batch[0]):
+            shards.append((batch[0], batch[-1]))
+            batch = []
+        batch.append(user["_id"])
+        if len(batch) == shard_size:
+            shards.append((batch[0], batch[-1]))
+            batch = []
+    if batch:
+        shards.append((batch[0], batch[-1]))
+    return shards
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json_util.loads(f.read())
+
+
+def save_checkpoint(path, checkpoint):
+    # Write to a temporary file and rename, so an interrupted write never corrupts the checkpoint
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json_util.dumps(checkpoint))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    from serve import limit_parent_threads, threads_per_worker
+    # Before the model is loaded, so the forked workers inherit no OpenMP pool (see serve.py)
+    limit_parent_threads()
+
+    from dotenv import load_dotenv
+    from db import get_database
+    from main import FAISS_INDEX_FILE, FAISS_IDS_FILE
+    # Loaded once here and shared copy-on-write by the forked workers; importing it does not read the index
+    import bulk_grocery_list  # noqa: F401
+
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description="Precompute suggested grocery lists for every user.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=500)
+    parser.add_argument("--checkpoint", default="precompute_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--index-file", default=FAISS_INDEX_FILE)
+    parser.add_argument("--ids-file", default=FAISS_IDS_FILE)
+    args = parser.parse_args(argv)
+
+    checkpoint = None if args.restart else load_checkpoint(args.checkpoint)
+    if checkpoint is None:
+        # The shard plan is saved with the checkpoint so a resumed run uses the same ranges
+        checkpoint = {"shards": plan_shards(get_database(), args.shard_size), "completed": []}
+        save_checkpoint(args.checkpoint, checkpoint)
+    elif any(mixes_id_types(shard) for shard in checkpoint["shards"]):
+        print("The checkpoint has a shard spanning string and ObjectId _ids, whose users would be skipped; "
+              "re-run with --restart.")
+        return 1
+    else:
+        print(f"Resuming: {len(checkpoint['completed'])} of {len(checkpoint['shards'])} shards already done.")
+
+    completed = set(checkpoint["completed"])
+    tasks = [
+        (shard_id, first_id, last_id)
+        for shard_id, (first_id, last_id) in enumerate(checkpoint["shards"])
+        if shard_id not in completed
+    ]
+
+    started = time.perf_counter()
+    users_done = 0
+    lists_written = 0
+    # Keep the collector from touching (and so copying) the pages the workers share
+    gc.freeze()
+    context = multiprocessing.get_context("fork")
+    initargs = (args.index_file, args.ids_file, threads_per_worker(args.workers))
+    with context.Pool(args.workers, initializer=init_worker, initargs=initargs) as pool:
+        for shard_id, users, written in pool.imap_unordered(process_shard, tasks):
+            checkpoint["completed"].append(shard_id)
+            save_checkpoint(args.checkpoint, checkpoint)
+            users_done += users
+            lists_written += written
+            print(f"Shard {shard_id}: {written} lists for {users} users "
+                  f"({len(checkpoint['completed'])}/{len(checkpoint['shards'])} shards)")
+
+    elapsed = time.perf_counter() - started
+    print(f"Done: {lists_written} lists for {users_done} users in {elapsed:.1f}s.")
+    os.remove(args.checkpoint)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Groups near-duplicate catalog items (the same product sold by several stores under
+different names) and stores the group on every item as `equivalence_group`:
+
+    python product_groups.py --workers 4 --threshold 0.92
+
+The item vectors are read from the FAISS index and normalized into a temporary
+memory-mapped matrix that every worker shares. Each worker runs an exact k-nearest-
+neighbour search (inner product, i.e. cosine similarity) for one chunk of items against
+the whole catalog. Two items are linked when each is among the other's k neighbours with
+at least `threshold` similarity. Links are merged strongest first with union-find, and a
+link that would grow a group past `max_group_size`, or put two items of the same store
+in one group, is dropped; together with requiring mutual neighbours this keeps chains of
+"almost similar" items from merging unrelated products (or a store's own variants).
+
+A group's ID is the smallest item _id in it, so re-running the job on an unchanged
+catalog writes nothing; only items whose group changed are updated. Items without a
+near-duplicate are their own group.
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import faiss
+from bson import ObjectId
+from pymongo import UpdateOne
+
+GROUP_FIELD = "equivalence_group"
+DEFAULT_K = 10
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_MAX_GROUP_SIZE = 20
+WRITE_BATCH_SIZE = 1000
+
+# Per-process state, set up once by the pool initializer
+_worker = {}
+
+
+def init_worker(vectors_file, k, threshold):
+    # Every worker is one core; FAISS must not start its own thread pool on top
+    faiss.omp_set_num_threads(1)
+    _worker["vectors"] = np.load(vectors_file, mmap_mode="r")
+    _worker["k"] = k
+    _worker["threshold"] = threshold
+
+
+def neighbours(task):
+    """
+    (item, neighbour, similarity) rows at or above the threshold for the items in [start, end).
+    """
+    start, end = task
+    vectors = _worker["vectors"]
+    k = min(_worker["k"] + 1, len(vectors))
+    similarities, positions = faiss.knn(np.ascontiguousarray(vectors[start:end]), vectors, k,
+                                        metric=faiss.METRIC_INNER_PRODUCT)
+    rows = np.arange(start, end)[:, None].repeat(k, axis=1)
+    keep = (similarities >= _worker["threshold"]) & (positions != rows) & (positions >= 0)
+    return rows[keep], positions[keep], similarities[keep]
+
+
+def normalized_vectors(index, path, chunk_size=65536):
+    """
+    Write the index's vectors, L2-normalized, to a .npy file and return its path.
+    """
+    vectors = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(index.ntotal, index.d))
+    for start in range(0, index.ntotal, chunk_size):
+        chunk = index.reconstruct_n(start, min(chunk_size, index.ntotal - start))
+        faiss.normalize_L2(chunk)
+        vectors[start:start + len(chunk)] = chunk
+    vectors.flush()
+    return path
+
+
+def find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def connected_components(count, edges, max_group_size=DEFAULT_MAX_GROUP_SIZE, stores=None):
+    """
+    Union-find over positions, merging the (a, b, similarity) edges strongest first.
+    With `stores` (store name per position, None when unknown), two groups holding an
+    item of the same store are never merged.
+    Returns the root position of every position and the number of edges merged.
+    """
+    parents = np.arange(count)
+    sizes = np.ones(count, dtype=np.int64)
+    group_stores = {i: {stores[i]} for i in range(count) if stores[i] is not None} if stores else {}
+    merged = 0
+    for a, b, _ in sorted(edges, key=lambda edge: -edge[2]):
+        root_a, root_b = find(parents, a), find(parents, b)
+        if root_a == root_b or sizes[root_a] + sizes[root_b] > max_group_size:
+            continue
+        stores_a, stores_b = group_stores.get(root_a, set()), group_stores.get(root_b, set())
+        if not stores_a.isdisjoint(stores_b):
+            continue
+        root, child = min(root_a, root_b), max(root_a, root_b)
+        parents[child] = root
+        sizes[root] += sizes[child]
+        if stores_a or stores_b:
+            group_stores[root] = stores_a | stores_b
+            group_stores.pop(child, None)
+        merged += 1
+    return np.array([find(parents, i) for i in range(count)]), merged
+
+
+def mutual_edges(chunks):
+    """
+    (a, b, similarity) for the pairs found from both sides, once each (a < b).
+    """
+    found = {}
+    for rows, positions, similarities in chunks:
+        for a, b, similarity in zip(rows.tolist(), positions.tolist(), similarities.tolist()):
+            found[a, b] = similarity
+    return [(a, b, similarity) for (a, b), similarity in found.items() if a < b and (b, a) in found]
+
+
+def group_ids(ids, roots):
+    """
+    Group ID per position: the smallest item _id of its component.
+    """
+    smallest = {}
+    for position, root in enumerate(roots):
+        item_id = ids[position]
+        if root not in smallest or ObjectId(item_id) < ObjectId(smallest[root]):
+            smallest[root] = item_id
+    return [smallest[root] for root in roots]
+
+
+def item_stores(items_collection, ids):
+    """
+    Store name per position of the index (None for items without one, or no longer stored).
+    """
+    stores = {str(item["_id"]): item.get("Store_name") for item in items_collection.find({}, {"Store_name": 1})}
+    return [stores.get(item_id) for item_id in ids]
+
+
+def write_groups(items_collection, ids, groups, batch_size=WRITE_BATCH_SIZE):
+    """
+    Set the group of every item whose stored group differs. Returns the number of updates.
+    """
+    current = {str(item["_id"]): item.get(GROUP_FIELD) for item in items_collection.find({}, {GROUP_FIELD: 1})}
+
+    operations = [
+        UpdateOne({"_id": ObjectId(item_id)}, {"$set": {GROUP_FIELD: group}})
+        for item_id, group in zip(ids, groups)
+        if item_id in current and current[item_id] != group
+    ]
+    for start in range(0, len(operations), batch_size):
+        items_collection.bulk_write(operations[start:start + batch_size], ordered=False)
+    return len(operations)
+
+
+def build_groups(index, ids, workers, k=DEFAULT_K, threshold=DEFAULT_THRESHOLD, chunk_size=2048,
+                 max_group_size=DEFAULT_MAX_GROUP_SIZE, stores=None):
+    """
+    Group ID per position of the index (see the module docstring), and the number of links merged.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        vectors_file = normalized_vectors(index, os.path.join(workdir, "vectors.npy"))
+        tasks = [(start, min(start + chunk_size, index.ntotal)) for start in range(0, index.ntotal, chunk_size)]
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(vectors_file, k, threshold)) as pool:
+            chunks = list(pool.imap_unordered(neighbours, tasks))
+    roots, merged = connected_components(index.ntotal, mutual_edges(chunks), max_group_size, stores)
+    return group_ids(ids, roots), merged
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from db import get_database
+    from main import FAISS_INDEX_FILE, FAISS_IDS_FILE
+
+    load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description="Group near-duplicate items across stores.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="neighbours looked at per item")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="minimum cosine similarity")
+    parser.add_argument("--chunk-size", type=int, default=2048, help="items per kNN task")
+    parser.add_argument("--max-group-size", type=int, default=DEFAULT_MAX_GROUP_SIZE)
+    parser.add_argument("--index-file", default=FAISS_INDEX_FILE)
+    parser.add_argument("--ids-file", default=FAISS_IDS_FILE)
+    parser.add_argument("--dry-run", action="store_true", help="report the groups without writing them")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    index = faiss.read_index(args.index_file)
+    with open(args.ids_file, "rb") as f:
+        ids = pickle.load(f)
+    if index.ntotal != len(ids):
+        raise SystemExit(f"Index holds {index.ntotal} vectors but the ID map has {len(ids)} entries")
+
+    items_collection = get_database()["items"]
+    groups, merged = build_groups(index, ids, args.workers, args.k, args.threshold, args.chunk_size,
+                                  args.max_group_size, item_stores(items_collection, ids))
+    sizes = np.unique(np.unique(groups, return_counts=True)[1], return_counts=True)
+    grouped = sum(size * count for size, count in zip(*sizes) if size > 1)
+    print(f"{len(ids)} items, {merged} near-duplicate links merged, "
+          f"{sum(count for size, count in zip(*sizes) if size > 1)} groups covering {grouped} items "
+          f"(largest {sizes[0].max() if len(sizes[0]) else 0}) in {time.perf_counter() - started:.1f}s.")
+    if args.dry_run:
+        return 0
+
+    updated = write_groups(items_collection, ids, groups)
+    print(f"Updated {updated} items in {time.perf_counter() - started:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+import os
+import re
+import sys
+import hmac
+import time
+import hashlib
+import asyncio
+import argparse
+import threading
+import contextvars
+from collections import Counter as StackCounter
+from datetime import datetime
+
+# Profiling is only wired into the app with PROFILING_ENABLED or a PROFILING_SECRET. ADMIN_TOKEN alone does
+# not turn it on: it also guards the index admin endpoints
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_SECRET = os.getenv("PROFILING_SECRET")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Only the newest profiles are kept; older ones are deleted as new ones are written
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "2")) / 1000
+PROFILE_MODES = ("sampling", "deterministic")
+
+# The deterministic profiler of the current request; its hook ignores calls made for other requests
+_profiled_request = contextvars.ContextVar("chopnshop_profiled_request", default=None)
+
+# Leaf functions of threads that are just waiting; left out of sampled stacks
+IDLE_FUNCTIONS = {"wait", "select", "poll", "_wait_for_tstate_lock", "get", "accept", "_worker", "run_forever"}
+
+
+def profiling_enabled():
+    return PROFILING_ENABLED or bool(PROFILING_SECRET)
+
+
+def sign_request(method, path, expires, secret=None):
+    secret = secret or PROFILING_SECRET
+    message = f"{method.upper()}:{path}:{expires}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(header_value, method, path):
+    """
+    Check an `X-Profile: <expires>.<signature>` header for this request.
+    """
+    if not PROFILING_SECRET or not header_value or "." not in header_value:
+        return False
+    expires, signature = header_value.split(".", 1)
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, sign_request(method, path, expires))
+
+
+class _Armed:
+    """
+    Profiling requested through the admin endpoint for the next `count` requests under `path_prefix`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.path_prefix = "/"
+        self.mode = "sampling"
+
+    def arm(self, count, path_prefix, mode):
+        with self._lock:
+            self.count = count
+            self.path_prefix = path_prefix or "/"
+            self.mode = mode
+
+    def take(self, path):
+        # Cheap unlocked check first: this runs on every request while profiling is wired in
+        if self.count <= 0:
+            return None
+        with self._lock:
+            if self.count > 0 and path.startswith(self.path_prefix):
+                self.count -= 1
+                return self.mode
+        return None
+
+    def status(self):
+        return {"remaining": self.count, "path_prefix": self.path_prefix, "mode": self.mode}
+
+
+armed = _Armed()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread at a fixed interval from a background thread.
+    Work offloaded to the thread pool shows up too; concurrent requests share the same samples.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                self.stacks[f"{names.get(thread_id, thread_id)};{_collapse(frame)}"] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class _ThreadTrace:
+    __slots__ = ("thread_name", "stack", "last", "stacks")
+
+    def __init__(self, thread_name):
+        self.thread_name = thread_name
+        self.stack = []
+        self.last = time.perf_counter()
+        self.stacks = StackCounter()
+
+    def charge(self, now):
+        if self.stack:
+            self.stacks[";".join(self.stack)] += int((now - self.last) * 1_000_000)
+
+
+class DeterministicProfiler:
+    """
+    Traces every Python call made for the request and attributes self time (in
+    microseconds) to each call stack, per thread. Calls of other requests served by the
+    event loop meanwhile are left out: the hook only records calls in the request's context.
+
+    The profile hook is process-wide, so deterministic profiles run one at a time
+    (ProfilingMiddleware queues them). Thread-pool work of the request is traced on
+    Python 3.12+, which can hook threads that are already running; on older versions
+    only the event-loop side is, and sampling mode covers the thread pool.
+    """
+
+    def __init__(self):
+        self.stacks = StackCounter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._traces = []
+        self._token = None
+
+    def _trace(self):
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            trace = self._local.trace = _ThreadTrace(threading.current_thread().name)
+            with self._lock:
+                self._traces.append(trace)
+        return trace
+
+    def _profile(self, frame, event, arg):
+        if _profiled_request.get() is not self:
+            return
+        now = time.perf_counter()
+        trace = self._trace()
+        if event in ("call", "c_call"):
+            name = _frame_name(frame) if event == "call" else f"{getattr(arg, '__qualname__', arg)} (builtin)"
+            trace.charge(now)
+            trace.stack.append(name)
+            trace.last = now
+        elif event in ("return", "c_return", "c_exception"):
+            trace.charge(now)
+            if trace.stack:
+                trace.stack.pop()
+            trace.last = now
+
+    def start(self):
+        self._token = _profiled_request.set(self)
+        if hasattr(threading, "setprofile_all_threads"):
+            threading.setprofile_all_threads(self._profile)
+        else:
+            sys.setprofile(self._profile)
+
+    def stop(self):
+        if hasattr(threading, "setprofile_all_threads"):
+            threading.setprofile_all_threads(None)
+        else:
+            sys.setprofile(None)
+        _profiled_request.reset(self._token)
+        with self._lock:
+            traces = list(self._traces)
+        for trace in traces:
+            for stack, micros in trace.stacks.items():
+                self.stacks[f"{trace.thread_name};{stack}"] += micros
+
+
+def _slug(text):
+    return re.sub(r"[^A-Za-z0-9]+", "-", text).strip("-") or "root"
+
+
+def new_profile_name(method, path, mode):
+    return f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{method.lower()}-{_slug(path)}-{mode}.collapsed"
+
+
+def write_profile(name, stacks):
+    """
+    Store collapsed stacks ("frame;frame;frame count" per line), the input format of
+    flamegraph.pl and speedscope.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, name), "w") as f:
+        for stack, count in stacks.most_common():
+            if count > 0:
+                f.write(f"{stack} {count}\n")
+    prune_profiles()
+
+
+def prune_profiles(keep=None):
+    """
+    Delete all but the newest `keep` (default PROFILE_KEEP) profiles; names start with their timestamp.
+    """
+    keep = PROFILE_KEEP if keep is None else keep
+    if not os.path.isdir(PROFILE_DIR):
+        return
+    names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".collapsed"))
+    for name in names[:max(len(names) - keep, 0)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith(".collapsed"):
+            stat = os.stat(os.path.join(PROFILE_DIR, name))
+            profiles.append({"name": name, "size": stat.st_size, "created_at": datetime.utcfromtimestamp(stat.st_mtime)})
+    return profiles
+
+
+def profile_path(name):
+    # Only bare file names produced by write_profile can be fetched
+    if os.path.basename(name) != name or not name.endswith(".collapsed"):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+# The profile hook is process-wide: deterministic profiles wait for each other
+_deterministic_lock = asyncio.Lock()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that runs a request under a profiler when it carries a valid signed
+    X-Profile header, or when the admin endpoint armed profiling for its path.
+    Only installed when PROFILING_ENABLED or PROFILING_SECRET is set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        mode = armed.take(scope["path"])
+        if mode is None:
+            header = None
+            for key, value in scope["headers"]:
+                if key == b"x-profile":
+                    header = value.decode()
+                    break
+            if header is None or not verify_signature(header, scope["method"], scope["path"]):
+                return await self.app(scope, receive, send)
+            mode = "sampling"
+
+        if mode == "deterministic":
+            async with _deterministic_lock:
+                return await self._run_profiled(scope, receive, send, DeterministicProfiler(), mode)
+        return await self._run_profiled(scope, receive, send, SamplingProfiler(), mode)
+
+    async def _run_profiled(self, scope, receive, send, profiler, mode):
+        name = new_profile_name(scope["method"], scope["path"], mode)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", name.encode())]
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            write_profile(name, profiler.stacks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create a signed X-Profile header for one request.")
+    parser.add_argument("method")
+    parser.add_argument("path")
+    parser.add_argument("--ttl", type=int, default=300, help="seconds the signature stays valid")
+    args = parser.parse_args(argv)
+
+    if not PROFILING_SECRET:
+        print("PROFILING_SECRET is not set.")
+        return 1
+    expires = int(time.time()) + args.ttl
+    print(f"X-Profile: {expires}.{sign_request(args.method, args.path, expires)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
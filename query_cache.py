@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from metrics import REGISTRY, counter, gauge
+
+# Memory budget for cached rankings (0 turns the cache off)
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Rough per-entry cost of the key, tuple and dict slot on top of the arrays
+ENTRY_OVERHEAD_BYTES = 200
+
+CACHE_REQUESTS = counter("chopnshop_query_cache_requests_total", "Query cache lookups.", ("result",))
+CACHE_EVICTIONS = counter("chopnshop_query_cache_evictions_total", "Entries evicted from the query cache.")
+CACHE_BYTES = gauge("chopnshop_query_cache_bytes", "Approximate memory held by the query cache.")
+CACHE_ENTRIES = gauge("chopnshop_query_cache_entries", "Entries in the query cache.")
+
+
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
+
+
+class QueryResultCache:
+    """
+    LRU cache of ranked search results, bounded by the bytes of the stored arrays.
+    Keys include the index version, so results of an older index are never returned
+    and simply age out.
+    """
+
+    def __init__(self, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query, k, mode, index_version):
+        return (normalize_query(query), k, mode, index_version)
+
+    def get(self, key):
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        CACHE_REQUESTS.inc("hit" if entry is not None else "miss")
+        return entry
+
+    def put(self, key, positions, scores):
+        """
+        Store the ranked positions and scores (as compact int32/float32 copies).
+        """
+        if self.max_bytes <= 0:
+            return
+        entry = (np.asarray(positions, dtype=np.int32).copy(), np.asarray(scores, dtype=np.float32).copy())
+        size = entry[0].nbytes + entry[1].nbytes + len(key[0]) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._entries[key] = entry + (size,)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted[2]
+                CACHE_EVICTIONS.inc()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+query_cache = QueryResultCache()
+
+
+def _collect_cache_metrics():
+    CACHE_BYTES.set(query_cache.bytes)
+    CACHE_ENTRIES.set(len(query_cache))
+
+
+REGISTRY.register_collector(_collect_cache_metrics)
@@ -0,0 +1,270 @@
+"""
+Vector index over the recipes collection, for "similar recipes" and "recipes you can
+make within budget" suggestions.
+
+Each recipe is embedded from its name and ingredients into an in-memory FAISS
+inner-product index (normalized vectors, so scores are cosine similarities). The index
+is built in the background at start-up and kept current incrementally: recipes saved
+through the API are added right after the response, and a background sync picks up recipes inserted
+by other workers or scripts.
+
+Every recipe with simplified ingredients also gets a cost estimate per diet: the price
+of the first item for each ingredient that suits the diet, from the ingredient candidate
+table (see ingredient_candidates.py). Estimates are recomputed when the table is rebuilt.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+import faiss
+import numpy as np
+from bson.objectid import ObjectId
+from metrics import REGISTRY, gauge, stage
+from query_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+# How often new recipes from other processes are picked up (0 turns the background index off)
+RECIPE_INDEX_SYNC_SECONDS = float(os.getenv("RECIPE_INDEX_SYNC_SECONDS", "60"))
+# Recipes inserted this long before the last sync are looked at again (ObjectIds from different hosts are not ordered)
+SYNC_OVERLAP_SECONDS = 120
+ENCODE_BATCH_SIZE = 256
+# Diet label of the estimate that ignores diets
+NO_DIET = "none"
+
+RECIPE_PROJECTION = {"name": 1, "ingredients": 1, "simplified_ingredients": 1}
+
+INDEXED_RECIPES = gauge("chopnshop_recipe_index_recipes", "Recipes in the recipe vector index.")
+
+
+def recipe_text(recipe):
+    ingredients = recipe.get("simplified_ingredients") or recipe.get("ingredients") or []
+    return f"{recipe.get('name', '')}: {', '.join(str(ingredient) for ingredient in ingredients)}"
+
+
+def recipe_ingredients(recipe):
+    return list(dict.fromkeys(
+        normalize_query(ingredient) for ingredient in recipe.get("simplified_ingredients") or []
+        if isinstance(ingredient, str) and ingredient.strip()
+    ))
+
+
+class RecipeIndex:
+    """
+    FAISS index of recipe embeddings plus a parallel list of recipe IDs, names,
+    simplified ingredients and per-diet cost estimates (one row per position).
+    """
+
+    def __init__(self, recipes_collection, encode_many, dimension, ingredient_table, diets,
+                 sync_seconds=RECIPE_INDEX_SYNC_SECONDS):
+        self.recipes_collection = recipes_collection
+        self.encode_many = encode_many
+        self.dimension = dimension
+        self.ingredient_table = ingredient_table
+        self.diets = (NO_DIET,) + tuple(diets)
+        self.sync_seconds = sync_seconds
+        self.ready = False
+        self._index = faiss.IndexFlatIP(dimension)
+        self._ids = []
+        self._positions = {}
+        self._names = []
+        self._ingredients = []
+        self._costs = {diet: np.zeros(0, dtype=np.float32) for diet in self.diets}
+        self._costs_built_at = None
+        self._synced_at = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        REGISTRY.register_collector(lambda: INDEXED_RECIPES.set(len(self._ids)))
+
+    def start(self):
+        # Started at start-up, and again in a forked child (threads do not survive fork)
+        if self.sync_seconds <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="recipe-index", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Error syncing the recipe index: %s", e)
+            time.sleep(self.sync_seconds)
+
+    def ensure_ready(self):
+        # Before the background build finishes (or with it turned off), the first caller builds the index
+        if not self.ready:
+            self.sync()
+
+    def sync(self):
+        """
+        Add the recipes inserted since the last sync (all of them the first time) and
+        refresh the cost estimates if the ingredient table was rebuilt.
+        """
+        with self._sync_lock:
+            self._sync()
+
+    def _sync(self):
+        started = time.perf_counter()
+        query = {}
+        if self._synced_at is not None:
+            since = self._synced_at - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+            query = {"_id": {"$gte": ObjectId.from_datetime(since)}}
+        synced_at = datetime.utcnow()
+        batch = []
+        added = 0
+        for recipe in self.recipes_collection.find(query, RECIPE_PROJECTION):
+            if str(recipe["_id"]) in self._positions:
+                continue
+            batch.append(recipe)
+            if len(batch) >= ENCODE_BATCH_SIZE:
+                added += self.add_many(batch)
+                batch = []
+        added += self.add_many(batch)
+        self._synced_at = synced_at
+        if self.ingredient_table.built_at != self._costs_built_at:
+            self.refresh_costs()
+        if not self.ready:
+            self.ready = True
+            logger.info("Recipe index built over %d recipes in %.1fs.", len(self._ids), time.perf_counter() - started)
+        elif added:
+            logger.info("Added %d recipes to the recipe index.", added)
+
+    def add(self, recipe):
+        """
+        Index one recipe document (with its _id) right after it is saved.
+        """
+        return self.add_many([recipe])
+
+    def add_many(self, recipes):
+        recipes = [recipe for recipe in recipes if str(recipe["_id"]) not in self._positions]
+        if not recipes:
+            return 0
+        embeddings = self.encode_many([recipe_text(recipe) for recipe in recipes])
+        if embeddings is None:
+            raise ValueError(f"Failed to embed {len(recipes)} recipes.")
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        ingredients = [recipe_ingredients(recipe) for recipe in recipes]
+        costs = self._estimate_costs(ingredients)
+        with self._lock:
+            # Another thread may have added some of them meanwhile
+            fresh = [i for i, recipe in enumerate(recipes) if str(recipe["_id"]) not in self._positions]
+            self._index.add(embeddings[fresh])
+            for i in fresh:
+                self._positions[str(recipes[i]["_id"])] = len(self._ids)
+                self._ids.append(str(recipes[i]["_id"]))
+                self._names.append(recipes[i].get("name", ""))
+                self._ingredients.append(ingredients[i])
+            for diet in self.diets:
+                self._costs[diet] = np.concatenate([self._costs[diet], costs[diet][fresh]])
+        return len(fresh)
+
+    def _estimate_costs(self, ingredient_lists):
+        """
+        Per diet, the estimated cost of each recipe (inf when an ingredient has no suitable
+        item, or the recipe has no simplified ingredients).
+        """
+        costs = {diet: np.full(len(ingredient_lists), np.inf, dtype=np.float32) for diet in self.diets}
+        wanted = {ingredient for ingredients in ingredient_lists for ingredient in ingredients}
+        if not wanted:
+            return costs
+        candidates = self.ingredient_table.candidates_many(wanted)
+        # The item a recipe grocery list would pick: the best ranked one that suits the diet
+        prices = {}
+        for ingredient in wanted:
+            for diet in self.diets:
+                prices[ingredient, diet] = next(
+                    (float(item.get("Price", 0)) for item, diets in candidates.get(ingredient, [])
+                     if diet == NO_DIET or diet in diets),
+                    np.inf,
+                )
+        for row, ingredients in enumerate(ingredient_lists):
+            if ingredients:
+                for diet in self.diets:
+                    costs[diet][row] = sum(prices[ingredient, diet] for ingredient in ingredients)
+        return costs
+
+    def refresh_costs(self):
+        built_at = self.ingredient_table.built_at
+        with self._lock:
+            ingredient_lists = list(self._ingredients)
+        costs = self._estimate_costs(ingredient_lists)
+        with self._lock:
+            # Rows added since the snapshot already have fresh estimates
+            for diet in self.diets:
+                self._costs[diet] = np.concatenate([costs[diet], self._costs[diet][len(ingredient_lists):]])
+        self._costs_built_at = built_at
+
+    def _vector(self, recipe_id):
+        if recipe_id not in self._positions:
+            # Saved by another worker since the last sync
+            recipe = self.recipes_collection.find_one({"_id": ObjectId(recipe_id)}, RECIPE_PROJECTION)
+            if recipe is None:
+                return None
+            self.add(recipe)
+        with self._lock:
+            return self._index.reconstruct(self._positions[recipe_id]).reshape(1, -1)
+
+    def _embed_query(self, query):
+        vector = self.encode_many([query])
+        if vector is None:
+            raise ValueError("Failed to embed the query.")
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _row(self, position, score=None):
+        row = {"recipe_id": self._ids[position], "name": self._names[position]}
+        if score is not None:
+            row["similarity"] = round(float(score), 4)
+        return row
+
+    def similar(self, recipe_id, k=10):
+        """
+        The k recipes most similar to a recipe, best first. None when the recipe does not exist.
+        """
+        vector = self._vector(recipe_id)
+        if vector is None:
+            return None
+        with self._lock, stage("faiss_search"):
+            scores, positions = self._index.search(vector, min(k + 1, self._index.ntotal))
+        return [self._row(position, score) for score, position in zip(scores[0], positions[0])
+                if position >= 0 and self._ids[position] != recipe_id][:k]
+
+    def within_budget(self, budget, diet=NO_DIET, allergens=(), query=None, k=10):
+        """
+        Recipes whose estimated cost for the diet fits the budget: cheapest first, or
+        most similar to `query` first when one is given.
+        """
+        diet = diet if diet in self.diets else NO_DIET
+        allergens = [allergen.lower() for allergen in allergens]
+        vector = self._embed_query(query) if query else None
+        with self._lock:
+            costs = self._costs[diet]
+            affordable = np.flatnonzero(costs <= budget)
+            if allergens:
+                affordable = np.array([
+                    position for position in affordable
+                    if not any(allergen in ingredient for allergen in allergens for ingredient in self._ingredients[position])
+                ], dtype=np.int64)
+            if len(affordable) == 0:
+                return []
+            if vector is not None:
+                # Nearest neighbours among the affordable recipes only
+                selector = faiss.SearchParameters(sel=faiss.IDSelectorBatch(affordable.astype(np.int64)))
+                with stage("faiss_search"):
+                    _, positions = self._index.search(vector, min(k, len(affordable)), params=selector)
+                order = [position for position in positions[0] if position >= 0]
+            else:
+                order = affordable[np.argsort(costs[affordable], kind="stable")][:k]
+            return [
+                {**self._row(position), "estimated_cost": round(float(costs[position]), 2)}
+                for position in order
+            ]
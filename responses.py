@@ -0,0 +1,207 @@
+"""
+JSON rendering and compression for the API responses.
+
+Responses are rendered with orjson, which serializes ObjectId (as its hex string),
+datetime (ISO 8601, like FastAPI's encoder), Decimal and numpy values itself, so routes
+return Mongo documents as they come instead of converting fields in Python loops:
+
+    return json_response({"grocery_lists": docs, "next_cursor": next_cursor})
+
+Returning the response directly also skips FastAPI's jsonable_encoder pass. Routes that
+return plain values still render through ORJSONResponse, the app's default response class.
+
+CompressionMiddleware compresses JSON, NDJSON and text bodies of at least
+COMPRESSION_MIN_BYTES with brotli or gzip, whichever the client prefers in
+Accept-Encoding (brotli when the `brotli` package is installed and both are acceptable).
+Streamed responses are compressed chunk by chunk.
+"""
+import os
+import zlib
+from decimal import Decimal
+import orjson
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from starlette.datastructures import Headers, MutableHeaders
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from metrics import histogram, stage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent as they are; compressing them saves less than it costs
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# Larger bodies are compressed in a worker thread so the event loop keeps serving
+COMPRESS_IN_THREAD_BYTES = 256 * 1024
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+RESPONSE_BYTES = histogram(
+    "chopnshop_response_bytes", "Size of non-streamed response bodies as sent, by content encoding.", ("encoding",),
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+
+
+def _default(value):
+    # Types orjson does not know; anything else is a bug in the route and raises TypeError
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal):
+        # Same as FastAPI's encoder: whole numbers as ints, the rest as floats
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, Decimal128):
+        return _default(value.to_decimal())
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """
+    Serialize to JSON bytes (see the module docstring for the types handled).
+    """
+    return orjson.dumps(content, default=_default, option=JSON_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content):
+        with stage("serialize"):
+            return dumps(content)
+
+
+def json_response(content, status_code=200, headers=None):
+    return ORJSONResponse(content=content, status_code=status_code, headers=headers)
+
+
+def choose_encoding(accept_encoding):
+    """
+    The content encoding to use for an Accept-Encoding header, or None for identity.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    wildcard = weights.get("*", 0.0)
+    available = (["br"] if brotli is not None else []) + ["gzip"]
+    # Highest weight wins; on a tie the order above (brotli first) decides
+    ranked = sorted(available, key=lambda encoding: -weights.get(encoding, wildcard))
+    best = ranked[0]
+    return best if weights.get(best, wildcard) > 0 else None
+
+
+class _GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, body, final):
+        data = self._compressor.compress(body)
+        return data + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, body, final):
+        data = self._compressor.process(body)
+        return data + (self._compressor.finish() if final else self._compressor.flush())
+
+
+COMPRESSORS = {"br": _BrotliCompressor, "gzip": _GzipCompressor}
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses response bodies in the encoding the client prefers.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size))
+
+
+class _CompressingSend:
+    def __init__(self, send, encoding, minimum_size):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] in (204, 206, 304)
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                # Small or not, the body sent depends on Accept-Encoding, which caches must know
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+                self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start is not None:
+            start, self.start = self.start, None
+            if self.encoding is None or (not more_body and len(body) < self.minimum_size):
+                self.passthrough = True
+                if not more_body:
+                    RESPONSE_BYTES.observe(len(body), "identity")
+                await self.send(start)
+                await self.send(message)
+                return
+            self.compressor = COMPRESSORS[self.encoding]()
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = self.encoding
+            # The compressed body is a different representation of the same resource
+            if "etag" in headers and not headers["etag"].startswith("W/"):
+                headers["ETag"] = "W/" + headers["etag"]
+            body = await self._compress(body, not more_body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+                RESPONSE_BYTES.observe(len(body), self.encoding)
+            await self.send(start)
+        else:
+            body = await self._compress(body, not more_body)
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _compress(self, body, final):
+        if len(body) >= COMPRESS_IN_THREAD_BYTES:
+            return await run_in_threadpool(self.compressor.compress, body, final)
+        return self.compressor.compress(body, final)
@@ -0,0 +1,213 @@
+"""
+Multi-worker API server that loads the embedding model and FAISS index once:
+
+    python serve.py --workers 4 --port 8000
+    SERVE_WORKERS=4 SERVE_THREADS=2 python serve.py
+
+The parent imports the app (model weights, FAISS index, BM25 index), moves everything it
+allocated into the garbage collector's permanent generation and then forks the workers.
+The children share those pages copy-on-write instead of loading their own copies, and
+all accept connections from one listening socket. The parent only supervises: a worker
+that dies is replaced, and SIGTERM/SIGINT shut every worker down gracefully.
+
+Fork safety:
+- Torch and FAISS run single-threaded in the parent, so no OpenMP pool exists at fork
+  time; each worker then sizes its pools to --threads.
+- ONNX Runtime sessions own threads that do not survive fork, so with the onnx backends
+  each worker creates its own session (those weights are not shared).
+- PyMongo resets the shared client's pools and monitors in a forked child; the parent
+  never serves, so no connection is in use when it forks.
+- Background threads (embedding batcher, index watcher, ingredient table) start inside
+  each worker.
+"""
+import os
+import gc
+import sys
+import time
+import random
+import signal
+import socket
+import logging
+import argparse
+import warnings
+
+logger = logging.getLogger(__name__)
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+# Threads per worker for torch, ONNX Runtime, FAISS and BLAS (0: the cores divided by the workers)
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", "0"))
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", "8000"))
+# Seconds a worker gets to finish its requests on shutdown
+SERVE_GRACEFUL_TIMEOUT = float(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+# A worker that exits sooner than this after starting is not restarted in a tight loop
+MIN_WORKER_LIFETIME_SECONDS = 5
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def threads_per_worker(workers, threads=0):
+    return threads if threads > 0 else max(1, (os.cpu_count() or 1) // workers)
+
+
+def limit_parent_threads():
+    """
+    Keep the parent single-threaded in torch and FAISS. Runs before the app is imported,
+    so the model is loaded without starting an OpenMP pool that the workers would inherit.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, "1")
+    os.environ["EMBEDDING_THREADS"] = "1"
+    # The tokenizers' Rust pool cannot be used after fork either
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+def preload():
+    """
+    Import the app in the parent and build everything the workers can share.
+    """
+    import api
+    from openai_grocerylist import index_manager
+
+    # Loads the FAISS index and builds the BM25 index
+    index_manager.active
+    return api.app
+
+
+def init_worker(threads, preloaded=True):
+    """
+    Per-worker setup right after fork (logging_setup restarts its own listener thread).
+    """
+    import encoders
+    import main
+    from embedding_batcher import EmbeddingBatcher
+
+    gc.enable()
+    # Every worker would otherwise make the same sampling decisions as its siblings
+    random.seed()
+    # Expected: the parent's client had no operation in flight, and PyMongo resets it after fork
+    warnings.filterwarnings("ignore", message="MongoClient opened before fork")
+
+    encoders.EMBEDDING_THREADS = threads
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(threads)
+    try:
+        import faiss
+        faiss.omp_set_num_threads(threads)
+    except ImportError:
+        pass
+
+    if preloaded and isinstance(main.model, encoders.OnnxEncoder):
+        main.model = encoders.load_encoder()
+        if main.embedding_batcher is not None:
+            main.embedding_batcher = EmbeddingBatcher(main.model.encode)
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, threads, preloaded):
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if not preloaded:
+        os.environ["EMBEDDING_THREADS"] = str(threads)
+        app = preload()
+    init_worker(threads, preloaded)
+    # log_config=None keeps the logging configured by logging_setup.py
+    config = uvicorn.Config(app, log_config=None, timeout_graceful_shutdown=SERVE_GRACEFUL_TIMEOUT)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(workers=SERVE_WORKERS, threads=SERVE_THREADS, host=SERVE_HOST, port=SERVE_PORT, preload_app=True,
+          ready=None):
+    """
+    Fork `workers` API workers on host:port and supervise them until SIGTERM/SIGINT.
+    With preload_app=False every worker imports the app itself (no sharing).
+    """
+    threads = threads_per_worker(workers, threads)
+    app = None
+    if preload_app:
+        gc.disable()
+        limit_parent_threads()
+        app = preload()
+        import faiss
+        faiss.omp_set_num_threads(1)
+        # Objects that exist now are never scanned again, so the collector does not dirty shared pages
+        gc.collect()
+        gc.freeze()
+
+    sock = bind_socket(host, port)
+    children = {}
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(app, sock, threads, preload_app)
+            except BaseException:
+                logger.exception("Worker %d crashed.", slot)
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (slot, time.monotonic())
+        logger.info("Started worker %d (pid %d, %d threads).", slot, pid, threads)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(workers):
+        spawn(slot)
+    if ready is not None:
+        ready(list(children))
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot, started = children.pop(pid, (None, None))
+        if slot is None or stopping:
+            continue
+        logger.warning("Worker %d (pid %d) exited with status %d; restarting it.", slot, pid, status)
+        if time.monotonic() - started < MIN_WORKER_LIFETIME_SECONDS:
+            time.sleep(MIN_WORKER_LIFETIME_SECONDS)
+        if not stopping:
+            spawn(slot)
+    sock.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the API with preloaded, forked workers.")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS, help="torch/FAISS threads per worker")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--no-preload", action="store_true", help="load the app in every worker instead")
+    args = parser.parse_args(argv)
+    return serve(args.workers, args.threads, args.host, args.port, preload_app=not args.no_preload)
+
+
+if __name__ == "__main__":
+    sys.exit(main())